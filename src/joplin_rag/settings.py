@@ -109,6 +109,18 @@ STATICFILES_DIRS = [BASE_DIR / 'static'] # Source directory for static files
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Hash uploads while they stream to disk, so re-uploads of an unchanged database are detected
+FILE_UPLOAD_HANDLERS = [
+    'notes.uploadhandlers.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+# Retention of uploaded SQLite files (used by the prune_uploads command, 0 disables a limit):
+# keep the newest UPLOAD_KEEP_FILES files per user, and none older than UPLOAD_MAX_AGE_DAYS
+UPLOAD_KEEP_FILES = int(os.environ.get('UPLOAD_KEEP_FILES', '1'))
+UPLOAD_MAX_AGE_DAYS = int(os.environ.get('UPLOAD_MAX_AGE_DAYS', '30'))
+
 # Celery Configuration for background tasks
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
@@ -116,6 +128,9 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# Redis tier shared by the application caches (set empty to use in-process caches only)
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', CELERY_BROKER_URL) or None
+
 # django-allauth configuration for email-based authentication
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
@@ -134,13 +149,123 @@ ACCOUNT_LOGOUT_REDIRECT_URL = 'account_login'
 
 # OpenAI API Key for generating embeddings
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+# Alternative API endpoint, e.g. an OpenAI-compatible server (None uses api.openai.com)
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+
+# Shared OpenAI client: request and connect timeouts (seconds), connection pool size,
+# and retries for chat requests (embedding requests are retried by the scheduler)
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '60'))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', '10'))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '2'))
 
 # RAG Settings
 RAG_CHUNK_SIZE = int(os.environ.get('RAG_CHUNK_SIZE', '1000'))
 RAG_CHUNK_OVERLAP = int(os.environ.get('RAG_CHUNK_OVERLAP', '200'))
 
+# Text splitter: recursive (langchain, RAG_CHUNK_SIZE/RAG_CHUNK_OVERLAP characters) or
+# markdown (keeps headings, code blocks, tables and OCR text together; chunks of at most
+# RAG_CHUNK_TOKENS embedding-model tokens). Changing it re-splits notes on the next upload.
+RAG_CHUNKER = os.environ.get('RAG_CHUNKER', 'recursive')
+RAG_CHUNK_TOKENS = int(os.environ.get('RAG_CHUNK_TOKENS', '512'))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.environ.get('RAG_CHUNK_OVERLAP_TOKENS', '0'))
+
+# Number of notes read from the uploaded SQLite file per batch
+RAG_ETL_BATCH_SIZE = int(os.environ.get('RAG_ETL_BATCH_SIZE', '500'))
+
+# Changing the index settings builds a new index generation while search keeps serving the
+# old one; once swapped, the old generation's chunks are deleted this many per statement
+RAG_GENERATION_GC_BATCH_SIZE = int(os.environ.get('RAG_GENERATION_GC_BATCH_SIZE', '5000'))
+
+# Minimum seconds between progress updates written to UploadStats during an ETL run
+RAG_PROGRESS_INTERVAL = float(os.environ.get('RAG_PROGRESS_INTERVAL', '2.0'))
+
+# Uploads with more notes than this are split into shards processed in parallel by Celery workers
+RAG_ETL_SHARD_SIZE = int(os.environ.get('RAG_ETL_SHARD_SIZE', '2000'))
+
+# Vector index (hnsw, ivfflat or none) and distance metric (cosine, l2 or inner_product).
+# Changing these requires `manage.py rebuild_vector_index`.
+RAG_VECTOR_INDEX = os.environ.get('RAG_VECTOR_INDEX', 'hnsw')
+RAG_VECTOR_DISTANCE = os.environ.get('RAG_VECTOR_DISTANCE', 'cosine')
+RAG_HNSW_M = int(os.environ.get('RAG_HNSW_M', '16'))
+RAG_HNSW_EF_CONSTRUCTION = int(os.environ.get('RAG_HNSW_EF_CONSTRUCTION', '64'))
+RAG_IVFFLAT_LISTS = int(os.environ.get('RAG_IVFFLAT_LISTS', '100'))
+
+# Search-time recall settings: higher ef_search/probes trade latency for recall.
+# Iterative scans (off, relaxed_order or strict_order) keep scanning the index until
+# enough rows pass the per-user filter.
+RAG_HNSW_EF_SEARCH = int(os.environ.get('RAG_HNSW_EF_SEARCH', '100'))
+RAG_IVFFLAT_PROBES = int(os.environ.get('RAG_IVFFLAT_PROBES', '10'))
+RAG_ITERATIVE_SCAN = os.environ.get('RAG_ITERATIVE_SCAN', 'relaxed_order')
+
+# Search mode (vector, lexical or hybrid). Hybrid fuses the top RAG_HYBRID_CANDIDATES
+# vector and full-text matches with reciprocal rank fusion (constant RAG_RRF_K).
+RAG_SEARCH_MODE = os.environ.get('RAG_SEARCH_MODE', 'hybrid')
+RAG_HYBRID_CANDIDATES = int(os.environ.get('RAG_HYBRID_CANDIDATES', '50'))
+RAG_RRF_K = int(os.environ.get('RAG_RRF_K', '60'))
+
+# Binary-quantized search: an HNSW index over 1-bit quantized embeddings (Hamming distance)
+# returns RAG_BINARY_CANDIDATES candidates, re-ranked by exact distance. More candidates
+# raise recall at the cost of latency (`manage.py benchmark_binary_search` reports both).
+RAG_BINARY_INDEX = os.environ.get('RAG_BINARY_INDEX', 'true').lower() == 'true'
+RAG_BINARY_CANDIDATES = int(os.environ.get('RAG_BINARY_CANDIDATES', '200'))
+
+# Embedding model and vector size. text-embedding-3 models are shortened to
+# RAG_EMBEDDING_DIMENSIONS with the API's `dimensions` parameter; other models must
+# produce vectors of exactly that size. Vectors are stored as halfvec, so changing
+# either setting re-embeds every note on its next upload, and the ANN index has to be
+# rebuilt (`manage.py rebuild_vector_index`) once the new dimensions are in place.
+#
+# Embedding backend: openai (Embeddings API), local (sentence-transformers on this machine;
+# needs the `local` extra) or hash (deterministic feature hashing, for tests and benchmarks).
+# The local backend defaults to sentence-transformers/all-MiniLM-L6-v2 with 384 dimensions.
+RAG_EMBEDDING_PROVIDER = os.environ.get('RAG_EMBEDDING_PROVIDER', 'openai')
+_local_embeddings = RAG_EMBEDDING_PROVIDER == 'local'
+RAG_EMBEDDING_MODEL = os.environ.get(
+    'RAG_EMBEDDING_MODEL',
+    'sentence-transformers/all-MiniLM-L6-v2' if _local_embeddings else 'text-embedding-ada-002',
+)
+RAG_LOCAL_DEVICE = os.environ.get('RAG_LOCAL_DEVICE', 'cpu')
+RAG_LOCAL_BACKEND = os.environ.get('RAG_LOCAL_BACKEND', 'torch') # torch, onnx or openvino
+RAG_LOCAL_BATCH_SIZE = int(os.environ.get('RAG_LOCAL_BATCH_SIZE', '32'))
+RAG_EMBEDDING_DIMENSIONS = int(os.environ.get('RAG_EMBEDDING_DIMENSIONS', '384' if _local_embeddings else '1536'))
+
+# Embedding request batching across notes (token budget and input count per request)
+RAG_EMBEDDING_BATCH_TOKENS = int(os.environ.get('RAG_EMBEDDING_BATCH_TOKENS', '100000'))
+RAG_EMBEDDING_BATCH_SIZE = int(os.environ.get('RAG_EMBEDDING_BATCH_SIZE', '512'))
+
+# Concurrent embedding requests, provider rate limits and retry backoff
+RAG_EMBEDDING_CONCURRENCY = int(os.environ.get('RAG_EMBEDDING_CONCURRENCY', '4'))
+RAG_EMBEDDING_RPM = int(os.environ.get('RAG_EMBEDDING_RPM', '3000'))
+RAG_EMBEDDING_TPM = int(os.environ.get('RAG_EMBEDDING_TPM', '1000000'))
+RAG_EMBEDDING_MAX_RETRIES = int(os.environ.get('RAG_EMBEDDING_MAX_RETRIES', '5'))
+RAG_EMBEDDING_BACKOFF_SECONDS = float(os.environ.get('RAG_EMBEDDING_BACKOFF_SECONDS', '1.0'))
+RAG_EMBEDDING_BACKOFF_MAX_SECONDS = float(os.environ.get('RAG_EMBEDDING_BACKOFF_MAX_SECONDS', '60.0'))
+
+# Query embedding cache for search (in-process LRU size and TTL in seconds for both tiers)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+QUERY_EMBEDDING_CACHE_TTL = int(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', '604800'))
+
+# Serve search and elaboration with async views; enable when running under an ASGI
+# server (uvicorn joplin_rag.asgi:application), leave off under WSGI (gunicorn)
+RAG_ASYNC_VIEWS = os.environ.get('RAG_ASYNC_VIEWS', 'false').lower() == 'true'
+
+# Chat model used to elaborate on search results
+RAG_ELABORATE_MODEL = os.environ.get('RAG_ELABORATE_MODEL', 'gpt-4o-mini')
+
+# Cache of finished elaborations (in-process LRU size and TTL in seconds for both tiers)
+ELABORATION_CACHE_SIZE = int(os.environ.get('ELABORATION_CACHE_SIZE', '256'))
+ELABORATION_CACHE_TTL = int(os.environ.get('ELABORATION_CACHE_TTL', '86400'))
+
+# Embedding cache eviction (used by the prune_embedding_cache command, 0 disables a limit)
+EMBEDDING_CACHE_MAX_AGE_DAYS = int(os.environ.get('EMBEDDING_CACHE_MAX_AGE_DAYS', '90'))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '0'))
+
 # Markdown Rendering (set to False to see raw markdown in search results)
 RENDER_MARKDOWN = os.environ.get('RENDER_MARKDOWN', 'true').lower() == 'true'
+# Chunks are rendered to HTML at ingest; this many renderings of chunks without stored
+# HTML (e.g. indexed while rendering was off) are kept in process
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', '512'))
 
 # Development Email Backend (prints to console instead of sending real emails)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -0,0 +1,252 @@
+from contextlib import contextmanager
+from itertools import accumulate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Sequence
+import base64
+import json
+import math
+import random
+import resource
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import uuid
+from django.db import connection
+from .providers import HashingProvider
+
+# Joplin timestamps of the generated notes start here (ms since the epoch)
+BASE_TIMESTAMP_MS = 1600000000000
+
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    """
+    Build a vocabulary of pronounceable pseudo-words.
+    """
+    syllables = [c + v for c in 'bcdfghklmnprstvz' for v in 'aeiou']
+    return [''.join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for _ in range(size)]
+
+def zipf_weights(size: int) -> List[float]:
+    """
+    Cumulative Zipf weights: a few words are common and most are rare, as in real notes.
+    """
+    return list(accumulate(1 / (rank + 1) for rank in range(size)))
+
+def make_text(words: int, vocabulary: Sequence[str], cum_weights: Sequence[float], rng: random.Random) -> str:
+    """
+    Generate markdown-ish text of about `words` words, in paragraphs with occasional headings.
+    """
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, rng.randint(20, 120))
+        text = ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=length))
+        if rng.random() < 0.15:
+            text = f"## {text.split(' ', 1)[0].title()}\n\n{text}"
+        paragraphs.append(text.capitalize() + '.')
+        remaining -= length
+
+        # Occasional code blocks and tables, which chunkers should keep whole
+        structure = rng.random()
+        if structure < 0.05:
+            lines = [' '.join(rng.choices(vocabulary, k=rng.randint(2, 6))) for _ in range(rng.randint(3, 15))]
+            paragraphs.append('```\n' + '\n'.join(f"{line} = {rng.randint(0, 99)}" for line in lines) + '\n```')
+        elif structure < 0.10:
+            columns = rng.randint(2, 4)
+            rows = [rng.choices(vocabulary, k=columns) for _ in range(rng.randint(2, 10))]
+            paragraphs.append('\n'.join(
+                [f"| {' | '.join(rows[0])} |", '|' + '---|' * columns] +
+                [f"| {' | '.join(row)} |" for row in rows[1:]]
+            ))
+    return '\n\n'.join(paragraphs)
+
+def generate_joplin_database(
+    path: str,
+    notes: int,
+    mean_words: int = 300,
+    ocr_ratio: float = 0.2,
+    resources_per_note: int = 2,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Write a synthetic Joplin SQLite database with the tables the ETL reads.
+    Body lengths follow a log-normal distribution around `mean_words` (most
+    notes are short, a few are very long). A share of the notes link to
+    resources with OCR text; resources are shared between notes through the
+    many-to-many note_resources table, as attachments are in Joplin.
+
+    Args:
+        path: Where to write the database (an existing file is overwritten).
+        notes: Number of notes to generate.
+        mean_words: Mean body length in words.
+        ocr_ratio: Share of notes linked to OCR'd resources.
+        resources_per_note: Maximum number of resources linked to such a note.
+        seed: Random seed; the same arguments always produce the same database.
+
+    Returns:
+        The number of notes, resources and note_resources rows written.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(5000, rng)
+    cum_weights = zipf_weights(len(vocabulary))
+    # Log-normal with sigma 1: the median note is ~60% of the mean length
+    sigma = 1.0
+    mu = math.log(max(mean_words, 1)) - sigma ** 2 / 2
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript("""
+            DROP TABLE IF EXISTS notes;
+            DROP TABLE IF EXISTS resources;
+            DROP TABLE IF EXISTS note_resources;
+            CREATE TABLE notes (id TEXT PRIMARY KEY, title TEXT, body TEXT, updated_time INT, parent_id TEXT, deleted_time INT DEFAULT 0);
+            CREATE TABLE resources (id TEXT PRIMARY KEY, title TEXT, ocr_text TEXT, updated_time INT);
+            CREATE TABLE note_resources (note_id TEXT, resource_id TEXT);
+        """)
+        folders = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(max(1, notes // 100))]
+        resource_ids: List[str] = []
+        counts = {'notes': 0, 'resources': 0, 'note_resources': 0}
+
+        for i in range(notes):
+            note_id = uuid.UUID(int=rng.getrandbits(128)).hex
+            words = max(1, int(rng.lognormvariate(mu, sigma)))
+            conn.execute(
+                "INSERT INTO notes VALUES (?, ?, ?, ?, ?, 0)",
+                (note_id, make_text(rng.randint(2, 8), vocabulary, cum_weights, rng).rstrip('.'),
+                 make_text(words, vocabulary, cum_weights, rng), BASE_TIMESTAMP_MS + i * 1000, rng.choice(folders)),
+            )
+            counts['notes'] += 1
+
+            if rng.random() >= ocr_ratio:
+                continue
+            for _ in range(rng.randint(1, max(1, resources_per_note))):
+                # Reuse an existing attachment a quarter of the time
+                if resource_ids and rng.random() < 0.25:
+                    resource_id = rng.choice(resource_ids)
+                else:
+                    resource_id = uuid.UUID(int=rng.getrandbits(128)).hex
+                    conn.execute(
+                        "INSERT INTO resources VALUES (?, ?, ?, ?)",
+                        (resource_id, f"Scan {len(resource_ids) + 1}",
+                         make_text(rng.randint(10, 200), vocabulary, cum_weights, rng), BASE_TIMESTAMP_MS + i * 1000),
+                    )
+                    resource_ids.append(resource_id)
+                    counts['resources'] += 1
+                conn.execute("INSERT INTO note_resources VALUES (?, ?)", (note_id, resource_id))
+                counts['note_resources'] += 1
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+class StubEmbeddingServer:
+    """
+    Local stand-in for the OpenAI Embeddings API.
+    Answers POST .../embeddings with deterministic feature-hashing vectors
+    (see HashingProvider) after a fixed latency, so ETL throughput can be
+    measured with realistic request overhead but no network or API cost.
+    Point the OpenAI client at `url` through the OPENAI_BASE_URL setting.
+    """
+
+    def __init__(self, dimensions: int, latency: float = 0.0):
+        """
+        Initialize the server (call start() or use it as a context manager).
+
+        Args:
+            dimensions: Size of the returned vectors.
+            latency: Seconds each request waits before answering.
+        """
+        self.provider = HashingProvider('stub', dimensions)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                texts = body['input']
+                if isinstance(texts, str):
+                    texts = [texts]
+                time.sleep(stub.latency)
+                with stub.lock:
+                    stub.requests += 1
+
+                data = []
+                for index, vector in enumerate(stub.provider.embed(texts)):
+                    if body.get('encoding_format') == 'base64':
+                        vector = base64.b64encode(struct.pack(f'<{len(vector)}f', *vector)).decode('ascii')
+                    data.append({'object': 'embedding', 'index': index, 'embedding': vector})
+                payload = json.dumps({
+                    'object': 'list',
+                    'data': data,
+                    'model': body.get('model', 'stub'),
+                    'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+                }).encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'StubEmbeddingServer':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'StubEmbeddingServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+class QueryCounter:
+    """
+    Counts the queries run on the default database connection, without
+    keeping their SQL in memory (unlike CaptureQueriesContext).
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    """
+    Count the queries run inside the block (on this thread's connection).
+    """
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of this process in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def percentile(values: Sequence[float], share: float) -> float:
+    """
+    Return the nearest-rank percentile of the values, e.g. share=0.95 for p95.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(share * len(ordered)) - 1))]
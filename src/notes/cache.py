@@ -0,0 +1,137 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import threading
+import time
+import redis
+
+class TwoTierCache:
+    """
+    Small key/value cache with an in-process LRU in front of a shared Redis tier.
+    Local hits avoid any network round trip; Redis hits are shared across web
+    workers and promoted into the local tier. If Redis is not configured or is
+    unreachable the cache silently degrades to the local tier only.
+    """
+
+    # How long to bypass Redis after a connection error
+    REDIS_RETRY_SECONDS = 30
+
+    def __init__(
+        self,
+        namespace: str,
+        max_local_entries: int,
+        ttl: int,
+        redis_url: Optional[str] = None,
+        dumps: Callable[[Any], bytes] = lambda value: value,
+        loads: Callable[[bytes], Any] = lambda value: value,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            namespace: Prefix for Redis keys, also used for the shared hit counters.
+            max_local_entries: Maximum number of entries kept in process (0 disables the local tier).
+            ttl: Time to live in seconds, for both tiers.
+            redis_url: Redis connection URL, or None for a local-only cache.
+            dumps: Serializer from a value to the bytes stored in Redis.
+            loads: Deserializer from Redis bytes back to a value.
+        """
+        self.namespace = namespace
+        self.max_local_entries = max_local_entries
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.dumps = dumps
+        self.loads = loads
+        self.local: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+        self._redis: Optional[redis.Redis] = None
+        self._redis_down_until: float = 0.0
+
+    def _redis_call(self, method: str, *args, **kwargs) -> Any:
+        """
+        Run a Redis command, returning None if Redis is unconfigured or failing.
+        After an error the Redis tier is skipped for REDIS_RETRY_SECONDS so an
+        outage does not add a timeout to every lookup.
+        """
+        if not self.redis_url or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                self.redis_url, socket_timeout=0.25, socket_connect_timeout=0.25
+            )
+        try:
+            return getattr(self._redis, method)(*args, **kwargs)
+        except redis.RedisError as e:
+            print(f"Warning: cache {self.namespace} Redis tier unavailable: {e}")
+            self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+            return None
+
+    def _count(self, counter: str) -> None:
+        # Only lookups that already went to Redis are counted there, so local hits stay network-free
+        with self.lock:
+            self.counters[counter] += 1
+        self._redis_call('hincrby', f"{self.namespace}:stats", counter, 1)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a key, local tier first.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self.local.move_to_end(key)
+                    self.counters['local_hits'] += 1
+                    return value
+                del self.local[key]
+
+        raw = self._redis_call('get', f"{self.namespace}:{key}")
+        if raw is not None:
+            value = self.loads(raw)
+            self._set_local(key, value)
+            self._count('redis_hits')
+            return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a value in both tiers.
+        """
+        self._set_local(key, value)
+        self._redis_call('set', f"{self.namespace}:{key}", self.dumps(value), ex=self.ttl)
+
+    def _set_local(self, key: str, value: Any) -> None:
+        if self.max_local_entries <= 0:
+            return
+        with self.lock:
+            self.local[key] = (value, time.monotonic() + self.ttl)
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_local_entries:
+                self.local.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report hit/miss counters for this process and, when available, across all processes.
+
+        Returns:
+            A dict with 'local' counters, the local 'hit_rate' and the 'shared' Redis counters.
+        """
+        with self.lock:
+            local = dict(self.counters)
+        lookups = sum(local.values())
+        result: Dict[str, Any] = {
+            'local': local,
+            'hit_rate': (local['local_hits'] + local['redis_hits']) / lookups if lookups else 0.0,
+            'shared': {},
+        }
+        shared = self._redis_call('hgetall', f"{self.namespace}:stats")
+        if shared:
+            result['shared'] = {k.decode(): int(v) for k, v in shared.items()}
+        return result
@@ -0,0 +1,288 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, List, Tuple
+import re
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from .providers import get_embedding_model, get_token_counter
+
+# Supported text splitters (RAG_CHUNKER)
+CHUNKERS = ('recursive', 'markdown')
+
+# Line heading the OCR text of a resource (see etl.build_resource_text)
+OCR_SEPARATOR = '--- OCR TEXT FROM IMAGES ---'
+
+HEADING = re.compile(r'^#{1,6}\s')
+FENCE = re.compile(r'^\s*(```|~~~)')
+TABLE_ROW = re.compile(r'^\s*\|')
+TABLE_DIVIDER = re.compile(r'^\s*\|?\s*:?-{3,}')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r'\S+\s*')
+
+# A block of a note: its kind ('text', 'heading', 'code', 'table' or 'separator') and text
+Block = Tuple[str, str]
+# A piece of a chunk: its text and token count
+Piece = Tuple[str, int]
+
+class Chunker(ABC):
+    """
+    Base class of the text splitters. A chunker is built once per ETL run and
+    reused for every note.
+    """
+
+    @abstractmethod
+    def split(self, text: str) -> List[str]:
+        """
+        Split a note's text into chunks to embed.
+
+        Args:
+            text: A note body, or a resource's OCR text.
+
+        Returns:
+            The chunk texts, in order.
+        """
+
+class RecursiveChunker(Chunker):
+    """
+    langchain's recursive splitter, sizing chunks in characters.
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+
+    def split(self, text: str) -> List[str]:
+        return self.splitter.split_text(text)
+
+class MarkdownChunker(Chunker):
+    """
+    Splits notes along their markdown structure into chunks of at most
+    `max_tokens` tokens of the embedding model.
+
+    The text is parsed into blocks (paragraphs and lists, headings, fenced code
+    and tables), which are packed greedily into chunks. Code blocks and tables
+    are never cut unless they alone exceed the budget, in which case they are
+    split by lines, re-fenced or with the table header repeated. A heading
+    starts a new chunk once the current one is a quarter full, and the OCR
+    separator always does, so OCR text is never mixed into body chunks.
+    Overlap, if any, repeats whole trailing blocks of the previous chunk.
+    """
+
+    def __init__(self, max_tokens: int, overlap_tokens: int = 0, count_tokens: Callable[[str], int] = None):
+        """
+        Initialize the chunker.
+
+        Args:
+            max_tokens: Token budget of a chunk.
+            overlap_tokens: Tokens of the previous chunk to repeat at the start of the next.
+            count_tokens: Token counter (defaults to the embedding model's tiktoken encoding).
+        """
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_section_tokens = max_tokens // 4
+        self.count_tokens = count_tokens or get_token_counter(get_embedding_model())
+
+    def split(self, text: str) -> List[str]:
+        chunks: List[str] = []
+        current: List[Piece] = []
+        size = 0
+
+        def emit(overlap: bool, carry_heading: bool = True) -> None:
+            nonlocal current, size
+            carry: List[Piece] = []
+            # Do not leave a heading dangling at the end of a chunk
+            if carry_heading and len(current) > 1 and HEADING.match(current[-1][0]):
+                carry.append(current.pop())
+            if current:
+                chunks.append('\n\n'.join(piece for piece, _ in current))
+                if overlap and self.overlap_tokens:
+                    carry = self._overlap(current) + carry
+            current = carry
+            size = sum(tokens for _, tokens in current)
+
+        for kind, block in parse_blocks(text):
+            tokens = self.count_tokens(block) + 1 # +1 for the blank line joining blocks
+            if kind == 'separator':
+                emit(overlap=False, carry_heading=False)
+            elif kind == 'heading' and size >= self.min_section_tokens:
+                emit(overlap=False)
+
+            pieces = [(block, tokens)] if tokens <= self.max_tokens else self._split_block(kind, block)
+            for piece, piece_tokens in pieces:
+                if current and size + piece_tokens > self.max_tokens:
+                    emit(overlap=True)
+                    # Overlap only fills the space the new piece leaves
+                    while current and size + piece_tokens > self.max_tokens:
+                        size -= current.pop(0)[1]
+                current.append((piece, piece_tokens))
+                size += piece_tokens
+        emit(overlap=False)
+        return chunks
+
+    def _overlap(self, pieces: List[Piece]) -> List[Piece]:
+        """
+        Return the trailing pieces of a chunk that fit in the overlap budget.
+        """
+        carry: List[Piece] = []
+        total = 0
+        for piece, tokens in reversed(pieces):
+            if total + tokens > self.overlap_tokens:
+                break
+            carry.insert(0, (piece, tokens))
+            total += tokens
+        return carry
+
+    def _split_block(self, kind: str, block: str) -> List[Piece]:
+        """
+        Split a block larger than the chunk budget into pieces that fit.
+        """
+        lines = block.split('\n')
+        if kind == 'code':
+            opening = lines[0]
+            closed = len(lines) > 1 and FENCE.match(lines[-1])
+            closing = lines[-1] if closed else FENCE.match(opening).group(1)
+            body = lines[1:-1] if closed else lines[1:]
+            return self._pack(body, '\n', prefix=opening + '\n', suffix='\n' + closing)
+        if kind == 'table':
+            header = lines[:2] if len(lines) > 1 and TABLE_DIVIDER.match(lines[1]) else lines[:1]
+            return self._pack(lines[len(header):], '\n', prefix='\n'.join(header) + '\n')
+        return self._pack(SENTENCE_END.split(block), ' ')
+
+    def _pack(self, units: List[str], joiner: str, prefix: str = '', suffix: str = '') -> List[Piece]:
+        """
+        Greedily pack text units (lines, sentences or words) into pieces within
+        the budget, each wrapped in prefix and suffix. Units that are too large
+        on their own are split into words, and words into character runs.
+        """
+        budget = max(1, self.max_tokens - self.count_tokens(prefix + suffix) - 1)
+        pieces: List[Piece] = []
+        current: List[str] = []
+        size = 0
+
+        def emit() -> None:
+            nonlocal current, size
+            if current:
+                text = prefix + joiner.join(current) + suffix
+                pieces.append((text, self.count_tokens(text) + 1))
+            current, size = [], 0
+
+        for unit in units:
+            tokens = self.count_tokens(unit)
+            if tokens > budget:
+                emit()
+                for part in self._split_unit(unit, budget):
+                    pieces.append((prefix + part + suffix, self.count_tokens(prefix + part + suffix) + 1))
+                continue
+            if current and size + tokens > budget:
+                emit()
+            current.append(unit)
+            size += tokens
+        emit()
+        return pieces
+
+    def _split_unit(self, unit: str, budget: int) -> List[str]:
+        """
+        Split one oversized sentence or line by words, falling back to
+        character runs for words that alone exceed the budget. Words are
+        counted one at a time, which slightly overestimates the joined text.
+        """
+        parts: List[str] = []
+        current = ''
+        size = 0
+        for word in WORD.findall(unit):
+            tokens = self.count_tokens(word)
+            if size + tokens <= budget:
+                current += word
+                size += tokens
+                continue
+            if current.strip():
+                parts.append(current.rstrip())
+            while tokens > budget:
+                # Cut at the share of characters that fits, assuming evenly sized tokens
+                cut = max(1, len(word) * budget // tokens)
+                parts.append(word[:cut])
+                word = word[cut:]
+                tokens = self.count_tokens(word)
+            current, size = word, tokens
+        if current.strip():
+            parts.append(current.rstrip())
+        return parts
+
+def parse_blocks(text: str) -> List[Block]:
+    """
+    Parse a note's markdown into blocks: fenced code (kept whole, fences
+    included), tables (consecutive '|' rows), headings, the OCR separator,
+    and paragraphs or lists (lines up to the next blank line).
+    """
+    lines = text.split('\n')
+    blocks: List[Block] = []
+    paragraph: List[str] = []
+
+    def flush() -> None:
+        if paragraph:
+            blocks.append(('text', '\n'.join(paragraph)))
+            paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = FENCE.match(line)
+        if fence:
+            flush()
+            end = i + 1
+            while end < len(lines) and not lines[end].lstrip().startswith(fence.group(1)):
+                end += 1
+            blocks.append(('code', '\n'.join(lines[i:end + 1])))
+            i = end + 1
+        elif TABLE_ROW.match(line):
+            flush()
+            end = i
+            while end < len(lines) and TABLE_ROW.match(lines[end]):
+                end += 1
+            blocks.append(('table', '\n'.join(lines[i:end])))
+            i = end
+        elif line.strip() == OCR_SEPARATOR:
+            flush()
+            blocks.append(('separator', line.strip()))
+            i += 1
+        elif HEADING.match(line):
+            flush()
+            blocks.append(('heading', line))
+            i += 1
+        elif not line.strip():
+            flush()
+            i += 1
+        else:
+            paragraph.append(line)
+            i += 1
+    flush()
+    return blocks
+
+def get_chunker_settings() -> Tuple[str, int, int]:
+    """
+    Return the configured chunker with its chunk size and overlap: characters
+    (RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP) for 'recursive', tokens
+    (RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP_TOKENS) for 'markdown'.
+    """
+    chunker = getattr(settings, 'RAG_CHUNKER', 'recursive')
+    if chunker not in CHUNKERS:
+        raise ImproperlyConfigured(f"Unsupported RAG_CHUNKER: {chunker}")
+    if chunker == 'markdown':
+        return chunker, getattr(settings, 'RAG_CHUNK_TOKENS', 512), getattr(settings, 'RAG_CHUNK_OVERLAP_TOKENS', 0)
+    return chunker, getattr(settings, 'RAG_CHUNK_SIZE', 1000), getattr(settings, 'RAG_CHUNK_OVERLAP', 200)
+
+@lru_cache(maxsize=8)
+def build_chunker(name: str, size: int, overlap: int, model: str) -> Chunker:
+    if name == 'markdown':
+        return MarkdownChunker(size, overlap, get_token_counter(model))
+    return RecursiveChunker(size, overlap)
+
+def get_chunker() -> Chunker:
+    """
+    Return the chunker configured by the RAG_CHUNK* settings, shared across notes and runs.
+    """
+    return build_chunker(*get_chunker_settings(), get_embedding_model())
@@ -0,0 +1,145 @@
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+import hashlib
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import markdown
+from .cache import TwoTierCache
+from .models import NoteChunk
+from .providers import get_async_openai_client, get_openai_client
+from .rendering import MARKDOWN_EXTENSIONS, sanitize_html
+from .search import normalize_query
+
+SYSTEM_PROMPT = """You are a helpful assistant that elaborates on search results.
+The user searched for information and got a partial match from their notes.
+Your job is to:
+1. Clean up the content (fix any OCR errors, formatting issues) and return valid markdown.
+2. Follow these markdown rules:
+    a. For tables: Use plain text for headers (no formatting like **bold** or *italics*).
+    b. For headers outside of tables:Only use `###` or `####`
+3. Highlight the parts most relevant to the search query
+4. Provide a short,clear summary
+Keep your response concise."""
+
+_elaboration_cache: Optional[TwoTierCache] = None
+
+def get_elaboration_cache() -> TwoTierCache:
+    """
+    Return the process-wide cache of finished elaborations (in-process LRU in front of Redis).
+    Entries are dicts with the markdown 'text' and its rendered 'html'.
+    """
+    global _elaboration_cache
+    if _elaboration_cache is None:
+        _elaboration_cache = TwoTierCache(
+            'elaboration',
+            max_local_entries=getattr(settings, 'ELABORATION_CACHE_SIZE', 256),
+            ttl=getattr(settings, 'ELABORATION_CACHE_TTL', 86400),
+            redis_url=getattr(settings, 'CACHE_REDIS_URL', None),
+            dumps=lambda entry: json.dumps(entry).encode('utf-8'),
+            loads=lambda raw: json.loads(raw),
+        )
+    return _elaboration_cache
+
+def get_elaboration_model() -> str:
+    """
+    Return the chat model used for elaborations (RAG_ELABORATE_MODEL).
+    """
+    return getattr(settings, 'RAG_ELABORATE_MODEL', 'gpt-4o-mini')
+
+def elaboration_cache_key(chunk: NoteChunk, query: str, model: str) -> str:
+    """
+    Build the cache key of an elaboration.
+    The chunk's content hash is part of the key, so a chunk re-indexed with
+    different text never serves an elaboration of its old content.
+    """
+    content_hash = chunk.content_hash or NoteChunk.hash_content(chunk.content)
+    key = f"{chunk.id}:{content_hash}:{model}:{normalize_query(query)}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def build_messages(chunk: NoteChunk, query: str) -> List[Dict[str, str]]:
+    """
+    Build the chat messages asking the model to elaborate on a chunk.
+    """
+    user_prompt = f"""Search Query: "{query}"
+
+Note Title: {chunk.title}
+
+Content from the note:
+{chunk.content}
+
+Please elaborate on this content in relation to the search query."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+def render_elaboration(text: str) -> str:
+    """
+    Render elaboration markdown to sanitized HTML (the model may echo HTML from the notes).
+    """
+    return sanitize_html(markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS))
+
+def stream_elaboration(chunk: NoteChunk, query: str) -> Iterator[str]:
+    """
+    Stream an elaboration of a chunk from the chat API, yielding text deltas as
+    they arrive. Once the completion has finished it is stored in the
+    elaboration cache; an interrupted stream is never cached.
+
+    Args:
+        chunk: The NoteChunk to elaborate on (with its note or resource loaded).
+        query: The user's search query.
+
+    Yields:
+        Pieces of the markdown response, in order.
+    """
+    model = get_elaboration_model()
+    stream = get_openai_client().chat.completions.create(
+        model=model,
+        messages=build_messages(chunk, query),
+        max_tokens=500,
+        temperature=0.7,
+        stream=True,
+    )
+    parts: List[str] = []
+    for event in stream:
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    cache_elaboration(chunk, query, model, ''.join(parts))
+
+async def astream_elaboration(chunk: NoteChunk, query: str) -> AsyncIterator[str]:
+    """
+    Async version of stream_elaboration, on the event loop's AsyncOpenAI client.
+    The worker is free for other requests while waiting on the model.
+    """
+    model = get_elaboration_model()
+    stream = await get_async_openai_client().chat.completions.create(
+        model=model,
+        messages=build_messages(chunk, query),
+        max_tokens=500,
+        temperature=0.7,
+        stream=True,
+    )
+    parts: List[str] = []
+    async for event in stream:
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta.content
+        if delta:
+            parts.append(delta)
+            yield delta
+
+    await sync_to_async(cache_elaboration, thread_sensitive=False)(chunk, query, model, ''.join(parts))
+
+def cache_elaboration(chunk: NoteChunk, query: str, model: str, text: str) -> None:
+    """
+    Store a finished elaboration, with its rendered HTML, in the elaboration cache.
+    """
+    get_elaboration_cache().set(
+        elaboration_cache_key(chunk, query, model),
+        {'text': text, 'html': render_elaboration(text)},
+    )
@@ -0,0 +1,328 @@
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, wait
+from typing import Dict, List, Optional, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import EmbeddingCache, EmbeddingCacheStats, FailedEmbedding, IndexGeneration, IndexedDocument, NoteChunk
+from .providers import EmbeddingProvider
+from .rendering import render_chunk_html
+from .scheduler import EmbeddingScheduler
+from .stats import ETLStats
+
+def get_cached_embeddings(model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+    """
+    Look up embeddings in the global cache, record a hit for each entry found
+    and add the lookup's hits and misses to the model's EmbeddingCacheStats.
+
+    Args:
+        model: The embedding model key the vectors were produced with (see embedding_model_key).
+        text_hashes: sha256 digests of the texts to look up.
+
+    Returns:
+        A mapping of text hash to embedding for every hash present in the cache.
+    """
+    if not text_hashes:
+        return {}
+
+    entries = EmbeddingCache.objects.filter(
+        model=model, text_hash__in=set(text_hashes)
+    ).values_list('id', 'text_hash', 'embedding')
+
+    found: Dict[str, List[float]] = {}
+    hit_ids = []
+    for entry_id, text_hash, embedding in entries:
+        found[text_hash] = list(embedding)
+        hit_ids.append(entry_id)
+
+    if hit_ids:
+        EmbeddingCache.objects.filter(id__in=hit_ids).update(
+            hit_count=F('hit_count') + 1,
+            last_used_at=timezone.now(),
+        )
+    record_cache_lookups(model, len(hit_ids), len(set(text_hashes)) - len(hit_ids))
+    return found
+
+def record_cache_lookups(model: str, hits: int, misses: int) -> None:
+    """
+    Add to the hit and miss counters of a model's embedding cache statistics.
+
+    Args:
+        model: The embedding model key the lookups were made for.
+        hits: Number of distinct texts found in the cache.
+        misses: Number of distinct texts missing from the cache.
+    """
+    counters = EmbeddingCacheStats.objects.filter(model=model)
+    increments = {'hits': F('hits') + hits, 'misses': F('misses') + misses, 'updated_at': timezone.now()}
+    if not counters.update(**increments):
+        # First lookup for this model; another worker may be creating the row too
+        EmbeddingCacheStats.objects.bulk_create([EmbeddingCacheStats(model=model)], ignore_conflicts=True)
+        counters.update(**increments)
+
+def store_embeddings(model: str, embeddings: Dict[str, List[float]]) -> None:
+    """
+    Add freshly generated embeddings to the global cache.
+
+    Args:
+        model: The embedding model key the vectors were produced with (see embedding_model_key).
+        embeddings: A mapping of text hash to embedding.
+    """
+    if not embeddings:
+        return
+    EmbeddingCache.objects.bulk_create(
+        [EmbeddingCache(model=model, text_hash=text_hash, embedding=embedding)
+         for text_hash, embedding in embeddings.items()],
+        ignore_conflicts=True,
+    )
+
+def embed_texts(provider: EmbeddingProvider, texts: List[str]) -> Tuple[List[List[float]], int]:
+    """
+    Embed a list of texts, serving repeated text from the global cache.
+    Only texts missing from the cache are sent to the embeddings API,
+    and each distinct text is sent at most once.
+
+    Args:
+        provider: The embedding provider used for cache misses.
+        texts: The texts to embed.
+
+    Returns:
+        A tuple of the embeddings (in the same order as texts) and the number of cache hits.
+    """
+    hashes = [NoteChunk.hash_content(text) for text in texts]
+    cached = get_cached_embeddings(provider.model_key, hashes)
+
+    missing: Dict[str, str] = {}
+    for text, text_hash in zip(texts, hashes):
+        if text_hash not in cached and text_hash not in missing:
+            missing[text_hash] = text
+
+    if missing:
+        fresh = dict(zip(missing.keys(), provider.embed(list(missing.values()))))
+        store_embeddings(provider.model_key, fresh)
+        cached.update(fresh)
+
+    hits = len(texts) - len(missing)
+    return [cached[text_hash] for text_hash in hashes], hits
+
+async def aembed_texts(provider: EmbeddingProvider, texts: List[str]) -> Tuple[List[List[float]], int]:
+    """
+    Async version of embed_texts: the cache queries run in a worker thread
+    and the embeddings request is awaited without blocking the event loop.
+    """
+    hashes = [NoteChunk.hash_content(text) for text in texts]
+    cached = await sync_to_async(get_cached_embeddings, thread_sensitive=False)(provider.model_key, hashes)
+
+    missing: Dict[str, str] = {}
+    for text, text_hash in zip(texts, hashes):
+        if text_hash not in cached and text_hash not in missing:
+            missing[text_hash] = text
+
+    if missing:
+        fresh = dict(zip(missing.keys(), await provider.aembed(list(missing.values()))))
+        await sync_to_async(store_embeddings, thread_sensitive=False)(provider.model_key, fresh)
+        cached.update(fresh)
+
+    hits = len(texts) - len(missing)
+    return [cached[text_hash] for text_hash in hashes], hits
+
+class EmbeddingBatcher:
+    """
+    Collects chunks from many notes and embeds them in as few API requests as possible.
+    A request is flushed once the queued chunks reach the token budget or the
+    input-count limit, and handed to an EmbeddingScheduler so several requests
+    can be in flight at once. Completed requests are fanned back out to their
+    notes and bulk-inserted as NoteChunk rows; requests that still fail after
+    the scheduler's retries are recorded as FailedEmbedding rows, and so is every
+    unwritten chunk when the run is aborted (see abort).
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        max_tokens: Optional[int] = None,
+        max_inputs: Optional[int] = None,
+        stats: Optional[ETLStats] = None,
+        generation: Optional[IndexGeneration] = None,
+    ):
+        """
+        Initialize the batcher.
+
+        Args:
+            provider: The embedding provider used for embedding requests.
+            max_tokens: Token budget per request (defaults to RAG_EMBEDDING_BATCH_TOKENS).
+            max_inputs: Maximum number of inputs per request (defaults to RAG_EMBEDDING_BATCH_SIZE).
+            stats: Where to count cached, embedded, failed and written chunks.
+            generation: The index generation the chunks are written to.
+        """
+        self.provider = provider
+        self.model_key = provider.model_key
+        self.stats = stats or ETLStats()
+        self.generation = generation
+        self.max_tokens: int = max_tokens or getattr(settings, 'RAG_EMBEDDING_BATCH_TOKENS', 100000)
+        self.max_inputs: int = max_inputs or getattr(settings, 'RAG_EMBEDDING_BATCH_SIZE', 512)
+        self.count_tokens = provider.count_tokens
+        # Chunks are rendered once here instead of on every search page view
+        self.render_html: bool = getattr(settings, 'RENDER_MARKDOWN', True)
+        self.scheduler = EmbeddingScheduler(provider, stats=self.stats)
+        self.pending: List[NoteChunk] = []
+        self.pending_tokens: int = 0
+        self.in_flight: Dict[Future, Tuple[List[NoteChunk], Dict[str, List[float]], List[str]]] = {}
+        self.attempts: Dict[Tuple[Optional[int], Optional[int], int, str], int] = {}
+
+    def add(self, owner: IndexedDocument, chunk_index: int, text: str, text_hash: str) -> None:
+        """
+        Queue a chunk for embedding, flushing first if it would overflow the current batch.
+
+        Args:
+            owner: The NoteMetadata or ResourceMetadata the chunk belongs to.
+            chunk_index: Position of the chunk within the note or resource.
+            text: The chunk text.
+            text_hash: sha256 digest of the chunk text.
+        """
+        tokens = self.count_tokens(text)
+        if self.pending and (
+            self.pending_tokens + tokens > self.max_tokens or
+            len(self.pending) >= self.max_inputs
+        ):
+            self.flush()
+
+        chunk = NoteChunk(
+            **{NoteChunk.owner_field(type(owner)): owner},
+            user_id=owner.user_id,
+            generation=self.generation,
+            chunk_index=chunk_index,
+            content=text,
+            content_hash=text_hash,
+        )
+        if self.render_html:
+            render_chunk_html(chunk)
+        self.pending.append(chunk)
+        self.pending_tokens += tokens
+
+    def requeue_failed(self, user, scope: Optional[Q] = None) -> int:
+        """
+        Re-queue every chunk on the user's retry list and wait for the results,
+        so that the notes and resources processed afterwards see these chunks as already stored.
+
+        Args:
+            user: The owner of the notes and resources.
+            scope: Only re-queue the entries matching this condition (e.g. a shard's id range).
+
+        Returns:
+            The number of chunks re-queued.
+        """
+        failures = FailedEmbedding.objects.filter(Q(note__user=user) | Q(resource__user=user))
+        if scope is not None:
+            failures = failures.filter(scope)
+        failures = list(failures.select_related('note', 'resource'))
+        for failure in failures:
+            key = (failure.note_id, failure.resource_id, failure.chunk_index, failure.content_hash)
+            self.attempts[key] = failure.attempts
+            self.add(failure.note or failure.resource, failure.chunk_index, failure.content, failure.content_hash)
+        FailedEmbedding.objects.filter(id__in=[f.id for f in failures]).delete()
+        self.close(shutdown=False)
+        return len(failures)
+
+    def flush(self) -> None:
+        """
+        Send the queued chunks as one request. Cached embeddings are resolved
+        immediately; the remaining texts are scheduled on the worker pool.
+        Blocks while the number of in-flight requests is at the concurrency limit.
+        """
+        if not self.pending:
+            return
+
+        # The chunks stay queued until saved or scheduled, so abort still sees them if this raises
+        chunks = self.pending
+        with self.stats.timer('write_seconds'):
+            cached = get_cached_embeddings(self.model_key, [c.content_hash for c in chunks])
+
+        missing: Dict[str, str] = {}
+        for chunk in chunks:
+            if chunk.content_hash not in cached and chunk.content_hash not in missing:
+                missing[chunk.content_hash] = chunk.content
+        self.stats.add('chunks_cached', len(chunks) - len(missing))
+
+        if missing:
+            tokens = sum(self.count_tokens(text) for text in missing.values())
+            future = self.scheduler.submit(list(missing.values()), tokens)
+            self.in_flight[future] = (chunks, cached, list(missing.keys()))
+        else:
+            self._save(chunks, cached)
+        self.pending, self.pending_tokens = [], 0
+
+        while len(self.in_flight) >= self.scheduler.concurrency:
+            self._collect(FIRST_COMPLETED)
+
+    def close(self, shutdown: bool = True) -> None:
+        """
+        Flush the remaining chunks and wait for every in-flight request.
+
+        Args:
+            shutdown: Also stop the scheduler's worker threads.
+        """
+        self.flush()
+        while self.in_flight:
+            self._collect(ALL_COMPLETED)
+        if shutdown:
+            self.scheduler.shutdown()
+
+    def abort(self, error: Exception) -> None:
+        """
+        Give up on the queued and in-flight chunks after the run failed: they are
+        recorded on the retry list, since their documents' metadata is already
+        stored as up to date, then the worker threads are released without waiting.
+
+        Args:
+            error: The exception that stopped the run.
+        """
+        chunks = self.pending + [chunk for request in self.in_flight.values() for chunk in request[0]]
+        self.pending, self.pending_tokens = [], 0
+        self.in_flight.clear()
+        self.scheduler.shutdown(wait=False)
+        if chunks:
+            self._record_failure(chunks, error)
+
+    def _collect(self, return_when: str) -> None:
+        with self.stats.timer('embed_wait_seconds'):
+            done, _ = wait(list(self.in_flight), return_when=return_when)
+        for future in done:
+            # Only taken off in_flight once handled, so abort still sees the chunks if this raises
+            chunks, cached, missing_hashes = self.in_flight[future]
+            try:
+                fresh = dict(zip(missing_hashes, future.result()))
+            except Exception as e:
+                self._record_failure(chunks, e)
+                del self.in_flight[future]
+                continue
+            self.stats.add('chunks_embedded', len(fresh))
+            with self.stats.timer('write_seconds'):
+                store_embeddings(self.model_key, fresh)
+            cached.update(fresh)
+            self._save(chunks, cached)
+            del self.in_flight[future]
+
+    def _save(self, chunks: List[NoteChunk], embeddings: Dict[str, List[float]]) -> None:
+        for chunk in chunks:
+            chunk.embedding = embeddings[chunk.content_hash]
+        # Bulk create for performance
+        with self.stats.timer('write_seconds'):
+            NoteChunk.objects.bulk_create(chunks)
+        self.stats.add('chunks_written', len(chunks))
+
+    def _record_failure(self, chunks: List[NoteChunk], error: Exception) -> None:
+        titles = sorted({c.title for c in chunks})
+        print(f"Error generating embeddings for {len(chunks)} chunks ({', '.join(titles[:5])}): {error}")
+        self.stats.add('chunks_failed', len(chunks))
+        FailedEmbedding.objects.bulk_create([
+            FailedEmbedding(
+                note=chunk.note,
+                resource=chunk.resource,
+                chunk_index=chunk.chunk_index,
+                content=chunk.content,
+                content_hash=chunk.content_hash,
+                attempts=self.attempts.get((chunk.note_id, chunk.resource_id, chunk.chunk_index, chunk.content_hash), 0) + 1,
+                last_error=str(error),
+            )
+            for chunk in chunks
+        ])
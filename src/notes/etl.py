@@ -1,13 +1,80 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type
+from urllib.parse import quote
 import sqlite3
 import os
 from datetime import datetime
 import pytz
 from django.utils import timezone
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from django.conf import settings
-from .models import NoteMetadata, NoteChunk, JoplinUpload
-import openai
+from django.db import transaction
+from django.db.models import F, Q
+from .models import IndexedDocument, NoteMetadata, NoteChunk, JoplinUpload, ResourceMetadata, UploadShard, UploadStats
+from .stats import ETLStats
+from .chunking import OCR_SEPARATOR, get_chunker, get_chunker_settings
+from .embeddings import EmbeddingBatcher
+from .generations import activate_generation, get_target_generation
+from .providers import embedding_model_key, get_embedding_provider, get_provider_name
+
+# Resources worth indexing: with OCR text, and attached to at least one live note
+LIVE_OCR_RESOURCES = """
+    r.ocr_text != '' AND r.ocr_text IS NOT NULL AND EXISTS (
+        SELECT 1 FROM note_resources nr
+        JOIN notes n ON n.id = nr.note_id
+        WHERE nr.resource_id = r.id AND n.deleted_time = 0
+    )
+"""
+
+def build_resource_text(ocr_text: str) -> str:
+    """
+    Prepare a resource's content for splitting: its OCR text, headed by the OCR separator.
+    A resource is indexed once, however many notes attach it.
+
+    Args:
+        ocr_text: The OCR text of the resource.
+
+    Returns:
+        The text to split into chunks.
+    """
+    return OCR_SEPARATOR + "\n" + ocr_text
+
+def get_index_settings() -> Dict[str, Any]:
+    """
+    Return the NoteMetadata fields recording how a note was indexed, with their current values.
+    Notes indexed with other chunking settings are re-split, and notes embedded
+    with another model (or size) are re-embedded on the next upload.
+    """
+    chunker, chunk_size, chunk_overlap = get_chunker_settings()
+    return {
+        'chunker': chunker,
+        'chunk_size': chunk_size,
+        'chunk_overlap': chunk_overlap,
+        'embedding_model': embedding_model_key(),
+    }
+
+def settings_mismatch(document: IndexedDocument, index_settings: Dict[str, Any]) -> bool:
+    """
+    Whether a note or resource was indexed with other settings than index_settings.
+    """
+    return any(getattr(document, field) != value for field, value in index_settings.items())
+
+def range_conditions(
+    condition: str, column: str, start_id: Optional[str], end_id: Optional[str]
+) -> Tuple[str, List[Any]]:
+    """
+    Add an id range (None means unbounded) to a SQLite WHERE condition.
+
+    Returns:
+        The combined condition and its parameters.
+    """
+    conditions = [condition]
+    params: List[Any] = []
+    if start_id:
+        conditions.append(f"{column} >= ?")
+        params.append(start_id)
+    if end_id:
+        conditions.append(f"{column} < ?")
+        params.append(end_id)
+    return " AND ".join(conditions), params
 
 def get_process_time(timestamp_ms: Optional[int]) -> datetime:
     """
@@ -33,180 +100,716 @@ class JoplinETL:
     def __init__(self, upload_id: int):
         """
         Initialize the ETL process for a specific upload.
+        Large uploads may be processed by several instances in parallel,
+        each handling one note-id range (see process_range). All of them write
+        to the same index generation (see generations.get_target_generation).
 
         Args:
             upload_id: The ID of the JoplinUpload instance to process.
         """
         self.upload: JoplinUpload = JoplinUpload.objects.get(id=upload_id)
         self.db_path: str = self.upload.file.path
-        self.openai_api_key: Optional[str] = settings.OPENAI_API_KEY
         self.new_count: int = 0
         self.updated_count: int = 0
+        self.batcher: Optional[EmbeddingBatcher] = None
+        self.stats: ETLStats = ETLStats(self.upload.id)
+        self.chunker = get_chunker()
+        self.generation = get_target_generation(self.upload, get_index_settings())
+        # The UploadShard this instance processes, whose note counts are kept up to date per batch
+        self.shard_id: Optional[int] = None
         
-        if not self.openai_api_key:
+        if get_provider_name() == 'openai' and not settings.OPENAI_API_KEY:
              print("Warning: OPENAI_API_KEY not found. Embeddings will fail if not using a mock.")
 
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the uploaded SQLite file read-only.
+        The file is never modified after upload, so it is opened as immutable,
+        which lets SQLite skip locking and change detection.
+
+        Returns:
+            A connection whose rows are sqlite3.Row objects.
+        """
+        uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro&immutable=1"
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def iter_note_batches(
+        self,
+        conn: sqlite3.Connection,
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        ids: Optional[List[str]] = None,
+    ) -> Iterator[List[sqlite3.Row]]:
+        """
+        Stream live notes, one batch at a time.
+        Notes are read in id order with fetchmany, so memory is bounded by the
+        batch size rather than the size of the Joplin database. The OCR text of
+        their resources is indexed separately (see iter_resource_batches).
+        With a list of ids (see find_changed_ids), only those notes are read at all.
+
+        Args:
+            conn: A connection from connect().
+            start_id: Only include notes with an id >= start_id.
+            end_id: Only include notes with an id < end_id.
+            ids: Only include these notes.
+
+        Yields:
+            Lists of note rows.
+        """
+        # We only want notes that haven't been deleted.
+        where, params = range_conditions("deleted_time = 0", 'id', start_id, end_id)
+        yield from self._fetch_batches(conn, f"""
+            SELECT id, title, body, parent_id, updated_time
+            FROM notes
+            WHERE {where}
+        """, params, 'id', ids)
+
+    def iter_resource_batches(
+        self,
+        conn: sqlite3.Connection,
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        ids: Optional[List[str]] = None,
+    ) -> Iterator[List[sqlite3.Row]]:
+        """
+        Stream the resources with OCR text that live notes attach, one batch at a time.
+        Joplin stores the relationship in the note_resources table; a resource
+        attached to several notes is still read (and indexed) once.
+
+        Args:
+            conn: A connection from connect().
+            start_id: Only include resources with an id >= start_id.
+            end_id: Only include resources with an id < end_id.
+            ids: Only include these resources.
+
+        Yields:
+            Lists of resource rows.
+        """
+        where, params = range_conditions(LIVE_OCR_RESOURCES, 'r.id', start_id, end_id)
+        yield from self._fetch_batches(conn, f"""
+            SELECT r.id, r.title, r.ocr_text, r.updated_time
+            FROM resources r
+            WHERE {where}
+        """, params, 'r.id', ids)
+
+    def _fetch_batches(
+        self,
+        conn: sqlite3.Connection,
+        sql: str,
+        params: List[Any],
+        id_column: str,
+        ids: Optional[List[str]],
+    ) -> Iterator[List[sqlite3.Row]]:
+        batch_size = getattr(settings, 'RAG_ETL_BATCH_SIZE', 500)
+        if ids is not None:
+            # One query per batch of ids, which keeps under SQLite's variable limit
+            for i in range(0, len(ids), batch_size):
+                batch = ids[i:i + batch_size]
+                rows = conn.execute(
+                    f"{sql} AND {id_column} IN ({', '.join('?' * len(batch))}) ORDER BY {id_column}",
+                    params + batch,
+                ).fetchall()
+                if rows:
+                    yield rows
+            return
+
+        cursor = conn.execute(f"{sql} ORDER BY {id_column}", params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def plan_shards(self, shard_size: int, resources: bool = False) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Split the live notes into contiguous note-id ranges of about shard_size notes.
+        Only note ids are read, so planning is cheap even for large databases.
+
+        Args:
+            shard_size: The number of notes per shard.
+            resources: Split the resources to index (see iter_resource_batches) instead.
+
+        Returns:
+            A list of (start_id, end_id) ranges; None means unbounded.
+        """
+        if resources:
+            sql = f"SELECT r.id FROM resources r WHERE {LIVE_OCR_RESOURCES} ORDER BY r.id"
+        else:
+            sql = "SELECT id FROM notes WHERE deleted_time = 0 ORDER BY id"
+        conn = self.connect()
+        boundaries: List[str] = []
+        for position, row in enumerate(conn.execute(sql)):
+            if position and position % shard_size == 0:
+                boundaries.append(row['id'])
+        conn.close()
+
+        starts: List[Optional[str]] = [None] + boundaries
+        ends: List[Optional[str]] = boundaries + [None]
+        return list(zip(starts, ends))
+
+    def start_embeddings(self) -> None:
+        """
+        Create the embedding batcher for this run, if an embedding provider is configured.
+        Chunks from many notes are queued on the shared batcher so that
+        embedding requests are sized by token budget, not by note.
+        """
+        if self.batcher is None:
+            provider = get_embedding_provider()
+            if provider:
+                self.batcher = EmbeddingBatcher(provider, generation=self.generation, stats=self.stats)
+
+    def retry_failed_embeddings(self, shard: Optional[UploadShard] = None) -> None:
+        """
+        Embed the chunks on the user's retry list before any note is processed.
+
+        Args:
+            shard: Only retry the chunks of the notes (or resources) in this shard's range.
+        """
+        scope = None
+        if shard is not None:
+            owner = 'resource' if shard.resources else 'note'
+            scope = Q(**{f'{owner}__isnull': False})
+            if shard.start_id:
+                scope &= Q(**{f'{owner}__joplin_id__gte': shard.start_id})
+            if shard.end_id:
+                scope &= Q(**{f'{owner}__joplin_id__lt': shard.end_id})
+
+        self.start_embeddings()
+        if self.batcher:
+            try:
+                retried = self.batcher.requeue_failed(self.upload.user, scope)
+            except Exception as e:
+                # The entries were taken off the retry list when queued
+                self.abort_embeddings(e)
+                raise
+            if retried:
+                print(f"Retried {retried} previously failed chunks.")
+            self.stats.flush(force=True)
+
+    def close_embeddings(self) -> None:
+        """
+        Wait for outstanding embedding requests and release the batcher's worker threads.
+        """
+        if self.batcher:
+            self.batcher.close()
+            self.batcher = None
+
+    def abort_embeddings(self, error: Exception) -> None:
+        """
+        Move the batcher's unwritten chunks to the retry list after a failure
+        (see EmbeddingBatcher.abort) and release its worker threads.
+
+        Args:
+            error: The exception that stopped the run.
+        """
+        if self.batcher:
+            batcher, self.batcher = self.batcher, None
+            batcher.abort(error)
+
+    def process_range(self, start_id: Optional[str] = None, end_id: Optional[str] = None) -> Tuple[int, int]:
+        """
+        Process every live note in a note-id range and wait for its embeddings.
+
+        Args:
+            start_id: Inclusive lower bound of the range (None for no bound).
+            end_id: Exclusive upper bound of the range (None for no bound).
+
+        Returns:
+            A tuple of (new notes, updated notes) in the range.
+        """
+        self.new_count = 0
+        self.updated_count = 0
+        self.start_embeddings()
+
+        existing = self.load_existing_metadata(start_id, end_id)
+
+        conn = self.connect()
+        try:
+            changed_ids, total = self.find_changed_ids(conn, existing, start_id, end_id)
+            if changed_ids is not None:
+                print(f"Reading {len(changed_ids)} of {total} notes, the others are unchanged.")
+            scanned = 0
+            batches = self.iter_note_batches(conn, start_id, end_id, changed_ids)
+            while True:
+                with self.stats.timer('extract_seconds'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                self.process_batch(batch, existing)
+                scanned += len(batch)
+                self.stats.add('notes_scanned', len(batch))
+                self.stats.flush()
+            if changed_ids is not None:
+                # Notes left in SQLite are unchanged; count them as skipped so
+                # progress still adds up to the upload's total
+                unchanged = total - scanned
+                self.stats.add('notes_scanned', unchanged)
+                self.stats.add('notes_skipped', unchanged)
+            self.close_embeddings()
+        except Exception as e:
+            self.abort_embeddings(e)
+            raise
+        finally:
+            conn.close()
+            self.stats.flush(force=True)
+
+        print(f"ETL stats: {self.stats.summary()}")
+        return self.new_count, self.updated_count
+
+    def process_resource_range(self, start_id: Optional[str] = None, end_id: Optional[str] = None) -> int:
+        """
+        Index every resource with OCR text in a resource-id range and wait for its embeddings.
+
+        Args:
+            start_id: Inclusive lower bound of the range (None for no bound).
+            end_id: Exclusive upper bound of the range (None for no bound).
+
+        Returns:
+            The number of new or updated resources in the range.
+        """
+        self.start_embeddings()
+        existing = self.load_existing_metadata(start_id, end_id, model=ResourceMetadata)
+
+        indexed = 0
+        conn = self.connect()
+        try:
+            changed_ids, total = self.find_changed_ids(conn, existing, start_id, end_id, resources=True)
+            if changed_ids is not None:
+                print(f"Reading {len(changed_ids)} of {total} resources, the others are unchanged.")
+            batches = self.iter_resource_batches(conn, start_id, end_id, changed_ids)
+            while True:
+                with self.stats.timer('extract_seconds'):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                indexed += self.process_resource_batch(batch, existing)
+                self.stats.flush()
+            self.close_embeddings()
+        except Exception as e:
+            self.abort_embeddings(e)
+            raise
+        finally:
+            conn.close()
+            self.stats.flush(force=True)
+        return indexed
+
+    def load_existing_metadata(
+        self,
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        model: Type[IndexedDocument] = NoteMetadata,
+    ) -> Dict[str, IndexedDocument]:
+        """
+        Load the user's indexed notes (or resources) in a Joplin id range with a
+        single query, so deciding whether a document changed needs no per-document lookups.
+
+        Args:
+            start_id: Inclusive lower bound of the range (None for no bound).
+            end_id: Exclusive upper bound of the range (None for no bound).
+            model: NoteMetadata or ResourceMetadata.
+
+        Returns:
+            A mapping of Joplin id to its NoteMetadata or ResourceMetadata.
+        """
+        queryset = model.objects.filter(user=self.upload.user)
+        if start_id:
+            queryset = queryset.filter(joplin_id__gte=start_id)
+        if end_id:
+            queryset = queryset.filter(joplin_id__lt=end_id)
+        with self.stats.timer('write_seconds'):
+            return {metadata.joplin_id: metadata for metadata in queryset}
+
+    def find_changed_ids(
+        self,
+        conn: sqlite3.Connection,
+        existing: Dict[str, IndexedDocument],
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        resources: bool = False,
+    ) -> Tuple[Optional[List[str]], int]:
+        """
+        Find the notes (or resources) of a range that have to be read again:
+        those not indexed yet, and those updated since they were indexed. Only ids and timestamps are read from SQLite.
+        Each document is compared with its own last_updated rather than with the
+        newest one: notes arriving by sync keep the updated_time of the device
+        they were edited on, which can be older than more recent local edits.
+
+        Args:
+            conn: A connection from connect().
+            existing: The user's NoteMetadata or ResourceMetadata in the range, from load_existing_metadata.
+            start_id: Inclusive lower bound of the range (None for no bound).
+            end_id: Exclusive upper bound of the range (None for no bound).
+            resources: Look at the resources to index (see iter_resource_batches) instead of the notes.
+
+        Returns:
+            A tuple of (ids to read, number of documents in the range). The ids
+            are None when every document must be read: nothing is indexed yet,
+            or one was indexed with other settings (see get_index_settings).
+        """
+        if not existing:
+            return None, 0
+        index_settings = get_index_settings()
+        if any(settings_mismatch(metadata, index_settings) for metadata in existing.values()):
+            print("Indexing settings changed, reading all notes.")
+            return None, 0
+
+        if resources:
+            where, params = range_conditions(LIVE_OCR_RESOURCES, 'r.id', start_id, end_id)
+            sql = f"SELECT r.id, r.updated_time FROM resources r WHERE {where}"
+        else:
+            where, params = range_conditions("deleted_time = 0", 'id', start_id, end_id)
+            sql = f"SELECT id, updated_time FROM notes WHERE {where}"
+        changed: List[str] = []
+        total = 0
+        with self.stats.timer('extract_seconds'):
+            for joplin_id, updated_time in conn.execute(sql, params):
+                total += 1
+                metadata = existing.get(joplin_id)
+                if metadata is None or get_process_time(updated_time) > metadata.last_updated:
+                    changed.append(joplin_id)
+        return sorted(changed), total
+
+    def count_notes(self, start_id: Optional[str] = None, end_id: Optional[str] = None) -> int:
+        """
+        Count the live notes in the uploaded database, optionally within a note-id range.
+        """
+        where, params = range_conditions("deleted_time = 0", 'id', start_id, end_id)
+        conn = self.connect()
+        total = conn.execute(f"SELECT COUNT(*) FROM notes WHERE {where}", params).fetchone()[0]
+        conn.close()
+        return total
+
+    def start_progress(self, notes_total: int) -> None:
+        """
+        Reset the upload's progress counters before a run.
+
+        Args:
+            notes_total: The number of notes the run will scan.
+        """
+        UploadStats.objects.update_or_create(
+            upload=self.upload,
+            defaults={field.name: field.default for field in UploadStats._meta.concrete_fields
+                      if field.name not in ('id', 'upload', 'updated_at')} | {'notes_total': notes_total},
+        )
+
+    def sweep_deleted_notes(self) -> int:
+        """
+        Delete the user's indexed notes that are no longer live in the uploaded
+        database (trashed or removed in Joplin), with their chunks. Resources
+        that no live note attaches any more, or that lost their OCR text, are deleted too.
+        Only ids are compared, and deletes run in batches of RAG_ETL_BATCH_SIZE.
+
+        Returns:
+            The number of notes deleted.
+        """
+        conn = self.connect()
+        live_ids = {row['id'] for row in conn.execute("SELECT id FROM notes WHERE deleted_time = 0")}
+        live_resource_ids = {row['id'] for row in conn.execute(
+            f"SELECT r.id FROM resources r WHERE {LIVE_OCR_RESOURCES}"
+        )}
+        conn.close()
+        if not live_ids:
+            # Most likely the wrong file rather than an empty notebook, keep the index
+            print("No live notes in the upload, skipping the deleted notes sweep.")
+            return 0
+
+        vanished = self._delete_vanished(NoteMetadata, live_ids)
+        if vanished:
+            print(f"Deleted {vanished} notes removed from Joplin.")
+        vanished_resources = self._delete_vanished(ResourceMetadata, live_resource_ids)
+        if vanished_resources:
+            print(f"Deleted {vanished_resources} resources no longer attached to a note.")
+        return vanished
+
+    def _delete_vanished(self, model: Type[IndexedDocument], live_ids: Set[str]) -> int:
+        owner_field = NoteChunk.owner_field(model)
+        with self.stats.timer('write_seconds'):
+            vanished = [
+                document_id for document_id, joplin_id in model.objects.filter(
+                    user=self.upload.user
+                ).values_list('id', 'joplin_id').iterator()
+                if joplin_id not in live_ids
+            ]
+            batch_size = getattr(settings, 'RAG_ETL_BATCH_SIZE', 500)
+            for i in range(0, len(vanished), batch_size):
+                batch = vanished[i:i + batch_size]
+                with transaction.atomic():
+                    NoteChunk.objects.filter(**{f'{owner_field}_id__in': batch}).delete()
+                    model.objects.filter(id__in=batch).delete()
+        return len(vanished)
+
+    def sync_resource_links(self) -> None:
+        """
+        Bring the links between the user's indexed notes and resources in line
+        with the upload's note_resources table, so resource chunks are found
+        through the notes that currently attach them.
+        Only ids are compared; links are added and removed in bulk.
+        """
+        conn = self.connect()
+        rows = conn.execute(f"""
+            SELECT DISTINCT nr.note_id, nr.resource_id
+            FROM note_resources nr
+            JOIN notes n ON n.id = nr.note_id
+            JOIN resources r ON r.id = nr.resource_id
+            WHERE n.deleted_time = 0 AND r.ocr_text != '' AND r.ocr_text IS NOT NULL
+        """).fetchall()
+        conn.close()
+
+        user = self.upload.user
+        Link = ResourceMetadata.notes.through
+        with self.stats.timer('write_seconds'):
+            note_ids = dict(NoteMetadata.objects.filter(user=user).values_list('joplin_id', 'id'))
+            resource_ids = dict(ResourceMetadata.objects.filter(user=user).values_list('joplin_id', 'id'))
+            wanted = {
+                (resource_ids[resource_id], note_ids[note_id]) for note_id, resource_id in rows
+                if note_id in note_ids and resource_id in resource_ids
+            }
+            stored = {
+                (resource_id, note_id): link_id for link_id, resource_id, note_id in Link.objects.filter(
+                    resourcemetadata__user=user
+                ).values_list('id', 'resourcemetadata_id', 'notemetadata_id').iterator()
+            }
+            stale = [link_id for pair, link_id in stored.items() if pair not in wanted]
+            batch_size = getattr(settings, 'RAG_ETL_BATCH_SIZE', 500)
+            with transaction.atomic():
+                for i in range(0, len(stale), batch_size):
+                    Link.objects.filter(id__in=stale[i:i + batch_size]).delete()
+                Link.objects.bulk_create([
+                    Link(resourcemetadata_id=resource_id, notemetadata_id=note_id)
+                    for resource_id, note_id in wanted - stored.keys()
+                ], batch_size=batch_size)
+
+    def finish(self, new_count: int, updated_count: int, deleted_count: int = 0) -> None:
+        """
+        Mark the upload as processed and store its statistics.
+        """
+        self.upload.processed = True
+        self.upload.error_message = None
+        self.upload.new_notes_count = new_count
+        self.upload.updated_notes_count = updated_count
+        self.upload.deleted_notes_count = deleted_count
+        self.upload.save()
+
+    def fail(self, error: Exception) -> None:
+        """
+        Store an error message on the upload for user feedback.
+        Uses an update query so concurrent shards do not overwrite each other's fields.
+        """
+        JoplinUpload.objects.filter(id=self.upload.id).update(error_message=str(error))
+
     def process(self) -> None:
         """
         Main entry point for the ETL process.
-        Connects to the SQLite DB, maps resources to notes, and processes each note.
+        Connects to the SQLite DB and streams the notes through process_batch,
+        then the resources with OCR text through process_resource_batch.
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-
-            # 1. Map Resources (OCR Text) -> Note IDs
-            # Joplin stores the relationship in the note_resources table.
-            # We only CARE about resources that have OCR text (images that were processed).
-            print("Fetching resources...")
-            cursor.execute("""
-                SELECT nr.note_id, r.ocr_text, r.title 
-                FROM resources r
-                JOIN note_resources nr ON r.id = nr.resource_id
-                WHERE r.ocr_text != '' AND r.ocr_text IS NOT NULL
-            """)
-            note_resources: Dict[str, List[str]] = {}
-            for row in cursor.fetchall():
-                note_id = row['note_id']
-                if note_id not in note_resources:
-                    note_resources[note_id] = []
-                note_resources[note_id].append(row['ocr_text'])
-
-            # 2. Fetch Notes
-            # We only want notes that haven't been deleted.
-            print("Fetching notes...")
-            cursor.execute("""
-                SELECT id, title, body, updated_time, parent_id 
-                FROM notes 
-                WHERE deleted_time = 0
-            """)
-            
-            notes = cursor.fetchall()
-            print(f"Found {len(notes)} notes.")
+            total = self.count_notes()
+            print(f"Found {total} notes.")
+            self.start_progress(total)
 
-            # 3. Process Each Note
-            self.new_count = 0
-            self.updated_count = 0
-            
-            for note in notes:
-                self.process_note(note, note_resources.get(note['id'], []))
+            self.retry_failed_embeddings()
+            new_count, updated_count = self.process_range()
+            self.process_resource_range()
+            deleted_count = self.sweep_deleted_notes()
+            self.sync_resource_links()
+            activate_generation(self.generation)
             
             # Update upload status and statistics
-            self.upload.processed = True
-            self.upload.new_notes_count = self.new_count
-            self.upload.updated_notes_count = self.updated_count
-            self.upload.save()
-            conn.close()
+            self.finish(new_count, updated_count, deleted_count)
             
         except Exception as e:
-            # Store error message in the upload instance for user feedback
-            self.upload.error_message = str(e)
-            self.upload.save()
+            self.fail(e)
             raise e
 
-    def process_note(self, note_row: sqlite3.Row, ocr_texts: List[str]) -> None:
+    def process_batch(self, batch: List[sqlite3.Row], existing: Dict[str, NoteMetadata]) -> None:
         """
-        Process a single note row from the SQLite database.
-        Checks for updates, splits text into chunks, and generates embeddings.
+        Process a batch of note rows from the SQLite database (see index_documents).
 
         Args:
-            note_row: A dictionary-like row from the 'notes' table.
-            ocr_texts: A list of OCR text fragments associated with this note.
+            batch: Note rows from iter_note_batches.
+            existing: The user's NoteMetadata by Joplin id; new notes are added to it.
         """
-        joplin_id = note_row['id']
-        title = note_row['title']
-        body = note_row['body']
-        updated_ms = note_row['updated_time']
-        updated_dt = get_process_time(updated_ms)
-        parent_id = note_row['parent_id']
+        new_count, changed_count = self.index_documents(NoteMetadata, [
+            (row['id'], get_process_time(row['updated_time']), row['body'],
+             {'title': row['title'], 'parent_id': row['parent_id']})
+            for row in batch
+        ], existing)
+        self.new_count += new_count
+        self.updated_count += changed_count
+        self.stats.add('notes_skipped', len(batch) - new_count - changed_count)
 
+    def process_resource_batch(self, batch: List[sqlite3.Row], existing: Dict[str, ResourceMetadata]) -> int:
+        """
+        Process a batch of resource rows from the SQLite database (see index_documents).
+
+        Args:
+            batch: Resource rows from iter_resource_batches.
+            existing: The user's ResourceMetadata by Joplin id; new resources are added to it.
+
+        Returns:
+            The number of new or changed resources in the batch.
+        """
+        new_count, changed_count = self.index_documents(ResourceMetadata, [
+            (row['id'], get_process_time(row['updated_time']), build_resource_text(row['ocr_text']),
+             {'title': row['title']})
+            for row in batch
+        ], existing)
+        return new_count + changed_count
+
+    def index_documents(
+        self,
+        model: Type[IndexedDocument],
+        documents: List[Tuple[str, datetime, str, Dict[str, Any]]],
+        existing: Dict[str, IndexedDocument],
+    ) -> Tuple[int, int]:
+        """
+        Index a batch of notes or resources.
+        New, changed and unchanged documents are told apart in memory against the
+        preloaded metadata; metadata changes are written with bulk_create and
+        bulk_update in one transaction, then the new and changed documents are
+        split and their chunks diffed against the stored ones.
+
+        Args:
+            model: NoteMetadata or ResourceMetadata.
+            documents: (Joplin id, updated time, text to split, other fields to store) tuples.
+            existing: The user's metadata of the model by Joplin id; new documents are added to it.
+
+        Returns:
+            A tuple of (new documents, changed documents).
+        """
         # Get current RAG settings
-        current_chunk_size = getattr(settings, 'RAG_CHUNK_SIZE', 1000)
-        current_chunk_overlap = getattr(settings, 'RAG_CHUNK_OVERLAP', 200)
-
-        # Check existing metadata in our Django DB
-        metadata, created = NoteMetadata.objects.get_or_create(
-            user=self.upload.user,
-            joplin_id=joplin_id,
-            defaults={
-                'title': title,
-                'last_updated': updated_dt,
-                'parent_id': parent_id,
-                'chunk_size': current_chunk_size,
-                'chunk_overlap': current_chunk_overlap,
-            }
-        )
+        index_settings = get_index_settings()
+        owner_field = NoteChunk.owner_field(model)
 
-        # Force update if settings mismatch or if note content has changed in Joplin
-        settings_mismatch = (
-            metadata.chunk_size != current_chunk_size or 
-            metadata.chunk_overlap != current_chunk_overlap
-        )
+        new_documents: List[Tuple[IndexedDocument, str]] = []
+        changed_documents: List[Tuple[IndexedDocument, str]] = []
+        reembed: Set[int] = set() # Ids of documents whose stored vectors are from another model
+        for joplin_id, updated_dt, full_text, fields in documents:
+            metadata = existing.get(joplin_id)
+            if metadata is None:
+                print(f"New {owner_field} {fields['title']}...")
+                metadata = model(
+                    user=self.upload.user,
+                    joplin_id=joplin_id,
+                    last_updated=updated_dt,
+                    **fields,
+                    **index_settings,
+                )
+                existing[joplin_id] = metadata
+                new_documents.append((metadata, full_text))
+                continue
 
-        # If not created, check if update is needed
-        if not created:
-            if not settings_mismatch and metadata.last_updated and updated_dt <= metadata.last_updated:
+            # Force update if settings mismatch or if the content has changed in Joplin
+            mismatch = settings_mismatch(metadata, index_settings)
+            if not mismatch and metadata.last_updated and updated_dt <= metadata.last_updated:
                 # Already up to date and settings match, skip processing
-                return
-            
-            # Update needed: delete old chunks and update metadata info
-            if settings_mismatch:
-                print(f"Settings change detected for note {title}. Re-indexing...")
+                continue
+
+            # Update needed: refresh metadata info, chunks are diffed below
+            if mismatch:
+                print(f"Settings change detected for {owner_field} {fields['title']}. Re-indexing...")
             else:
-                print(f"Updating note {title}...")
-                
-            metadata.chunks.all().delete()
-            metadata.title = title
+                print(f"Updating {owner_field} {fields['title']}...")
             metadata.last_updated = updated_dt
-            metadata.parent_id = parent_id
-            metadata.chunk_size = current_chunk_size
-            metadata.chunk_overlap = current_chunk_overlap
-            metadata.save()
-            self.updated_count += 1
-        else:
-            print(f"New note {title}...")
-            self.new_count += 1
+            for field, value in fields.items():
+                setattr(metadata, field, value)
+            if metadata.embedding_model != index_settings['embedding_model']:
+                reembed.add(metadata.id)
+            for field, value in index_settings.items():
+                setattr(metadata, field, value)
+            changed_documents.append((metadata, full_text))
+
+        if not new_documents and not changed_documents:
+            return 0, 0
+
+        with self.stats.timer('write_seconds'), transaction.atomic():
+            if self.shard_id and model is NoteMetadata:
+                # Counted with the metadata writes: a retried shard sees these notes as unchanged
+                UploadShard.objects.filter(id=self.shard_id).update(
+                    new_notes_count=F('new_notes_count') + len(new_documents),
+                    updated_notes_count=F('updated_notes_count') + len(changed_documents),
+                )
+            model.objects.bulk_create([metadata for metadata, _ in new_documents])
+            model.objects.bulk_update(
+                [metadata for metadata, _ in changed_documents],
+                ['last_updated', *documents[0][3], *index_settings],
+            )
+            stored_chunks: Dict[int, List[NoteChunk]] = {}
+            for chunk in NoteChunk.objects.filter(**{
+                'generation': self.generation,
+                f'{owner_field}_id__in': [metadata.id for metadata, _ in changed_documents],
+            }).only('id', f'{owner_field}_id', 'chunk_index', 'content_hash'):
+                stored_chunks.setdefault(getattr(chunk, f'{owner_field}_id'), []).append(chunk)
+
+        stale_ids: List[int] = []
+        chunks_to_reindex: List[NoteChunk] = []
+        for metadata, full_text in new_documents + changed_documents:
+            stored = stored_chunks.get(metadata.id, [])
+            if metadata.id in reembed:
+                # Vectors of another model cannot be reused, embed every chunk again
+                stale_ids.extend(chunk.id for chunk in stored)
+                stored = []
+            stale, reindexed = self.diff_chunks(metadata, full_text, stored)
+            stale_ids.extend(stale)
+            chunks_to_reindex.extend(reindexed)
 
-        # Prepare full content by appending OCR text from images to the end of the note
-        full_text = body + "\n\n"
-        if ocr_texts:
-            full_text += "--- OCR TEXT FROM IMAGES ---\n"
-            full_text += "\n\n".join(ocr_texts)
+        with self.stats.timer('write_seconds'), transaction.atomic():
+            if stale_ids:
+                NoteChunk.objects.filter(id__in=stale_ids).delete()
+            if chunks_to_reindex:
+                NoteChunk.objects.bulk_update(chunks_to_reindex, ['chunk_index'])
+        return len(new_documents), len(changed_documents)
 
+    def diff_chunks(
+        self,
+        metadata: IndexedDocument,
+        full_text: str,
+        stored_chunks: List[NoteChunk],
+    ) -> Tuple[List[int], List[NoteChunk]]:
+        """
+        Split a note (or resource) and diff the new split against its stored chunks by content hash.
+        Unchanged chunks keep their embeddings, new or changed chunks are queued
+        for embedding, and dropped chunks are returned for deletion.
+
+        Args:
+            metadata: The note's NoteMetadata or the resource's ResourceMetadata.
+            full_text: The note body, or the resource's OCR text.
+            stored_chunks: The document's chunks currently in the database.
+
+        Returns:
+            A tuple of (ids of chunks to delete, kept chunks whose chunk_index changed).
+        """
         # Split Text into manageable segments for embedding
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=getattr(settings, 'RAG_CHUNK_SIZE', 1000),
-            chunk_overlap=getattr(settings, 'RAG_CHUNK_OVERLAP', 200),
-            length_function=len,
-        )
-        texts = text_splitter.split_text(full_text)
+        with self.stats.timer('split_seconds'):
+            texts = self.chunker.split(full_text)
+            hashes = [NoteChunk.hash_content(text) for text in texts]
 
-        # Generate Embeddings & Save Chunks
-        if not texts:
-            return
+        existing: Dict[str, List[NoteChunk]] = {}
+        for chunk in stored_chunks:
+            existing.setdefault(chunk.content_hash, []).append(chunk)
 
-        if self.openai_api_key:
-            client = openai.OpenAI(api_key=self.openai_api_key)
-            
-            try:
-                # Generate embeddings for all chunks in one batch
-                response = client.embeddings.create(input=texts, model="text-embedding-ada-002")
-                embeddings = [data.embedding for data in response.data]
-                
-                chunks_to_create = []
-                for i, (text, embedding) in enumerate(zip(texts, embeddings)):
-                    chunks_to_create.append(NoteChunk(
-                        note=metadata,
-                        chunk_index=i,
-                        content=text,
-                        embedding=embedding
-                    ))
-                
-                # Bulk create for performance
-                NoteChunk.objects.bulk_create(chunks_to_create)
-                
-            except Exception as e:
-                print(f"Error generating embeddings for {title}: {e}")
-        else:
-             print(f"Skipping embeddings for {title} (No API Key)")
+        chunks_to_reindex: List[NoteChunk] = []
+        pending: List[Tuple[int, str, str]] = []
+        for i, (text, text_hash) in enumerate(zip(texts, hashes)):
+            matches = existing.get(text_hash)
+            if matches:
+                chunk = matches.pop()
+                if chunk.chunk_index != i:
+                    chunk.chunk_index = i
+                    chunks_to_reindex.append(chunk)
+            else:
+                pending.append((i, text, text_hash))
+
+        # Queue new or changed chunks for embedding
+        if pending:
+            if self.batcher:
+                for i, text, text_hash in pending:
+                    self.batcher.add(metadata, i, text, text_hash)
+            else:
+                print(f"Skipping embeddings for {metadata.title} (No API Key)")
+
+        stale_ids = [chunk.id for chunks in existing.values() for chunk in chunks]
+        return stale_ids, chunks_to_reindex
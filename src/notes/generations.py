@@ -0,0 +1,129 @@
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import IndexGeneration, JoplinUpload, NoteChunk, NoteMetadata, ResourceMetadata
+
+def get_active_generation(user) -> Optional[IndexGeneration]:
+    """
+    Return the generation search reads for a user, or None before their first upload.
+    """
+    return IndexGeneration.objects.filter(user=user, state=IndexGeneration.ACTIVE).first()
+
+def get_target_generation(upload: JoplinUpload, index_settings: Dict[str, Any]) -> IndexGeneration:
+    """
+    Return the generation an upload writes its chunks to.
+
+    While the index settings match the active generation, uploads update it in
+    place (content changes only touch the changed notes). When they differ, a
+    new generation is built next to it, and search keeps reading the active one
+    until activate_generation swaps them. A build interrupted by a failure is
+    resumed by the next upload with the same settings; builds for other
+    settings are abandoned and garbage-collected.
+
+    Args:
+        upload: The JoplinUpload being processed.
+        index_settings: The current index settings (see etl.get_index_settings).
+
+    Returns:
+        The active generation, or the generation being built.
+    """
+    user = upload.user
+    with transaction.atomic():
+        active = IndexGeneration.objects.select_for_update().filter(
+            user=user, state=IndexGeneration.ACTIVE
+        ).first()
+        if active is None:
+            # Nothing is served yet, so the first generation is active from the start
+            return IndexGeneration.objects.create(
+                user=user, upload=upload, state=IndexGeneration.ACTIVE,
+                activated_at=timezone.now(), **index_settings,
+            )
+        if all(getattr(active, field) == value for field, value in index_settings.items()):
+            return active
+
+        building = IndexGeneration.objects.filter(
+            user=user, state=IndexGeneration.BUILDING, **index_settings
+        ).first()
+        if building:
+            print(f"Resuming index generation {building.id} for {user.email}.")
+            return building
+
+        abandoned: List[int] = list(IndexGeneration.objects.filter(
+            user=user, state=IndexGeneration.BUILDING
+        ).values_list('id', flat=True))
+        IndexGeneration.objects.filter(id__in=abandoned).update(state=IndexGeneration.RETIRED)
+        generation = IndexGeneration.objects.create(user=user, upload=upload, **index_settings)
+        # Documents already recorded with these settings may have their chunks in
+        # an abandoned build, so every one is split again into the new generation
+        NoteMetadata.objects.filter(user=user).update(chunker='')
+        ResourceMetadata.objects.filter(user=user).update(chunker='')
+        for generation_id in abandoned:
+            schedule_collection(generation_id)
+    print(f"Building index generation {generation.id} for {user.email}, "
+          f"generation {active.id} keeps serving search.")
+    return generation
+
+def activate_generation(generation: IndexGeneration) -> bool:
+    """
+    Swap a finished generation in as its user's active one, in one transaction,
+    and queue the previously active generation for garbage collection.
+    Does nothing for a generation that is already active, or was abandoned in the meantime.
+
+    Returns:
+        Whether the generation was swapped in.
+    """
+    with transaction.atomic():
+        current = IndexGeneration.objects.select_for_update().get(id=generation.id)
+        if current.state != IndexGeneration.BUILDING:
+            return False
+        # Retire first: at most one generation per user may be active
+        retired: List[int] = list(IndexGeneration.objects.select_for_update().filter(
+            user_id=generation.user_id, state=IndexGeneration.ACTIVE
+        ).values_list('id', flat=True))
+        IndexGeneration.objects.filter(id__in=retired).update(state=IndexGeneration.RETIRED)
+        current.state = IndexGeneration.ACTIVE
+        current.activated_at = timezone.now()
+        current.save(update_fields=['state', 'activated_at'])
+        for generation_id in retired:
+            schedule_collection(generation_id)
+
+    generation.state = current.state
+    generation.activated_at = current.activated_at
+    print(f"Activated index generation {generation.id}, retired {retired}.")
+    return True
+
+def schedule_collection(generation_id: int) -> None:
+    """
+    Queue a retired generation for deletion once the current transaction commits.
+    """
+    from .tasks import collect_generation_task
+    transaction.on_commit(lambda: collect_generation_task.delay(generation_id))
+
+def collect_generation(generation_id: int, batch_size: Optional[int] = None) -> int:
+    """
+    Delete a retired generation's chunks in batches, then the generation itself.
+    Each batch is its own short statement, so a large generation is removed
+    without long locks on the chunk table. Generations that are not retired are left alone.
+
+    Args:
+        generation_id: The IndexGeneration to delete.
+        batch_size: Chunks deleted per statement (defaults to RAG_GENERATION_GC_BATCH_SIZE).
+
+    Returns:
+        The number of chunks deleted.
+    """
+    if not IndexGeneration.objects.filter(id=generation_id, state=IndexGeneration.RETIRED).exists():
+        return 0
+    batch_size = batch_size or getattr(settings, 'RAG_GENERATION_GC_BATCH_SIZE', 5000)
+
+    deleted = 0
+    while True:
+        ids = list(NoteChunk.objects.filter(generation_id=generation_id).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        NoteChunk.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+    IndexGeneration.objects.filter(id=generation_id, state=IndexGeneration.RETIRED).delete()
+    print(f"Deleted index generation {generation_id} ({deleted} chunks).")
+    return deleted
@@ -0,0 +1,98 @@
+from typing import Callable, List, Set, Tuple
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from notes.models import NoteChunk
+from notes.providers import get_embedding_dimensions
+from notes.search import _binary_search, _vector_search
+from notes.vector_index import configure_binary_search, configure_search, dimensions_expression
+
+class Command(BaseCommand):
+    """
+    Measure recall and latency of binary-quantized search against exact search.
+    Query vectors are sampled from the user's stored chunk embeddings, so no
+    embeddings API calls are made. Exact results come from a sequential scan
+    (index scans disabled for the query), and recall@k is the share of the exact
+    top k that a method returns. The ANN vector search is reported for comparison.
+    """
+    help = "Report recall@k and latency of binary search at several candidate depths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help="Email of the user whose notes are searched.")
+        parser.add_argument('--queries', type=int, default=50, help="Number of sampled query vectors.")
+        parser.add_argument('-k', type=int, default=5, help="Number of results per search.")
+        parser.add_argument(
+            '--candidates', default='50,100,200,400',
+            help="Comma-separated candidate depths to benchmark.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Vector search requires PostgreSQL with pgvector.")
+
+        User = get_user_model()
+        try:
+            user = User.objects.get(email=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}")
+        k = options['k']
+        depths = [int(depth) for depth in options['candidates'].split(',')]
+
+        queries = list(NoteChunk.objects.alias(
+            dimensions=dimensions_expression()
+        ).filter(
+            user=user, dimensions=get_embedding_dimensions()
+        ).order_by('?').values_list('embedding', flat=True)[:options['queries']])
+        if not queries:
+            raise CommandError("The user has no embedded chunks.")
+        self.stdout.write(f"{len(queries)} queries, k={k}")
+
+        def exact(cursor, query):
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+            return _vector_search(query, user, k)
+
+        def ann(cursor, query):
+            configure_search(cursor)
+            return _vector_search(query, user, k)
+
+        def binary(depth: int) -> Callable:
+            def search(cursor, query):
+                configure_binary_search(cursor, depth)
+                return _binary_search(query, user, k, depth)
+            return search
+
+        methods = [('exact', exact), ('vector (ANN)', ann)] + [
+            (f"binary ({depth} candidates)", binary(depth)) for depth in depths
+        ]
+        results = {name: self._run(queries, search) for name, search in methods}
+        exact_ids, _ = results['exact']
+
+        self.stdout.write(f"{'method':<28} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, (ids, latencies) in results.items():
+            recall = sum(
+                len(found & expected) / len(expected) if expected else 1.0
+                for found, expected in zip(ids, exact_ids)
+            ) / len(queries)
+            latencies = sorted(latencies)
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(f"{name:<28} {recall:>9.3f} {p50:>8.1f} {p95:>8.1f}")
+
+    def _run(self, queries: List[List[float]], search: Callable) -> Tuple[List[Set[int]], List[float]]:
+        """
+        Run a search for every query vector, each in its own transaction so the
+        SET LOCAL recall settings do not leak between methods.
+
+        Returns:
+            The result chunk ids and the latency in milliseconds of each query.
+        """
+        ids: List[Set[int]] = []
+        latencies: List[float] = []
+        for query in queries:
+            start = time.perf_counter()
+            with transaction.atomic(), connection.cursor() as cursor:
+                results = search(cursor, query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            ids.append({chunk.id for chunk in results})
+        return ids, latencies
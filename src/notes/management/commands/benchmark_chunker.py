@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Callable, List
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from notes.benchmark import generate_joplin_database, percentile
+from notes.chunking import MarkdownChunker, RecursiveChunker
+from notes.etl import LIVE_OCR_RESOURCES, build_resource_text
+from notes.providers import get_embedding_model, get_token_counter
+
+class Command(BaseCommand):
+    """
+    Compare the throughput and output of the text splitters on a synthetic
+    (or given) Joplin database, split as the ETL indexes it: every live note's
+    body, and the OCR text of every attached resource once. For each splitter it
+    reports documents/sec, chunk count, tokens per chunk and the total tokens
+    that would be sent to the embeddings API, overlap included. 'recursive (per note)' builds a new
+    langchain splitter for every note, as the ETL used to.
+    """
+    help = "Benchmark the recursive and markdown chunkers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help="Joplin SQLite file to split (default: generate one).")
+        parser.add_argument('--notes', type=int, default=2000, help="Notes to generate.")
+        parser.add_argument('--mean-words', type=int, default=300, help="Mean body length of generated notes.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generator.")
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'RAG_CHUNK_SIZE', 1000),
+                            help="Recursive splitter chunk size in characters.")
+        parser.add_argument('--chunk-overlap', type=int, default=getattr(settings, 'RAG_CHUNK_OVERLAP', 200),
+                            help="Recursive splitter overlap in characters.")
+        parser.add_argument('--chunk-tokens', type=int, default=getattr(settings, 'RAG_CHUNK_TOKENS', 512),
+                            help="Markdown chunker budget in tokens.")
+        parser.add_argument('--overlap-tokens', type=int, default=getattr(settings, 'RAG_CHUNK_OVERLAP_TOKENS', 0),
+                            help="Markdown chunker overlap in tokens.")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = options['database']
+            if not path:
+                path = os.path.join(directory, 'joplin.sqlite')
+                generate_joplin_database(path, options['notes'], mean_words=options['mean_words'], seed=options['seed'])
+            texts = self._load_texts(path)
+
+        count_tokens = get_token_counter(get_embedding_model())
+        size, overlap = options['chunk_size'], options['chunk_overlap']
+
+        def per_note(text: str) -> List[str]:
+            splitter = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap, length_function=len)
+            return splitter.split_text(text)
+
+        splitters = [
+            ('recursive (per note)', per_note),
+            ('recursive', RecursiveChunker(size, overlap).split),
+            ('markdown', MarkdownChunker(options['chunk_tokens'], options['overlap_tokens'], count_tokens).split),
+        ]
+        megabytes = sum(len(text.encode('utf-8')) for text in texts) / (1024 * 1024)
+        self.stdout.write(f"{len(texts)} documents, {megabytes:.1f} MiB of text")
+        self.stdout.write(
+            f"{'splitter':<22} {'docs/s':>9} {'MiB/s':>7} {'chunks':>8} {'mean tok':>9} "
+            f"{'p95 tok':>8} {'max tok':>8} {'total tok':>10}"
+        )
+        for name, split in splitters:
+            self._run(name, split, texts, megabytes, count_tokens)
+
+    def _load_texts(self, path: str) -> List[str]:
+        """
+        Build the texts the ETL splits: note bodies and resource OCR texts.
+        """
+        conn = sqlite3.connect(path)
+        try:
+            bodies = conn.execute("SELECT body FROM notes WHERE deleted_time = 0").fetchall()
+            ocr_texts = conn.execute(f"SELECT r.ocr_text FROM resources r WHERE {LIVE_OCR_RESOURCES}").fetchall()
+        finally:
+            conn.close()
+        return [body or '' for (body,) in bodies] + [build_resource_text(ocr_text) for (ocr_text,) in ocr_texts]
+
+    def _run(self, name: str, split: Callable[[str], List[str]], texts: List[str], megabytes: float,
+             count_tokens: Callable[[str], int]) -> None:
+        start = time.perf_counter()
+        chunks = [chunk for text in texts for chunk in split(text)]
+        elapsed = time.perf_counter() - start
+
+        tokens = [count_tokens(chunk) for chunk in chunks]
+        self.stdout.write(
+            f"{name:<22} {len(texts) / elapsed:>9.0f} {megabytes / elapsed:>7.2f} {len(chunks):>8} "
+            f"{sum(tokens) / len(tokens):>9.1f} {percentile(tokens, 0.95):>8} {max(tokens):>8} {sum(tokens):>10}"
+        )
@@ -0,0 +1,94 @@
+from contextlib import ExitStack
+import os
+import tempfile
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from notes.benchmark import StubEmbeddingServer, count_queries, generate_joplin_database, peak_rss_mb
+from notes.etl import JoplinETL
+from notes.models import EmbeddingCache, EmbeddingCacheStats, JoplinUpload, NoteChunk
+from notes.providers import embedding_model_key, get_embedding_dimensions
+
+class Command(BaseCommand):
+    """
+    Measure ETL throughput on a synthetic (or given) Joplin database.
+    The upload is processed twice for a throwaway user: a cold run that embeds
+    every chunk, then a re-upload of the unchanged file, which should read and
+    write almost nothing. Embeddings come from a local stub of the Embeddings
+    API with a configurable latency (or the in-process hash provider), under a
+    unique model name so the global embedding cache never serves the cold run.
+    The user, its notes and the benchmark's cache entries are deleted afterwards.
+    """
+    help = "Report ETL notes/sec, database queries and peak RSS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help="Joplin SQLite file to load (default: generate one).")
+        parser.add_argument('--notes', type=int, default=1000, help="Notes to generate.")
+        parser.add_argument('--mean-words', type=int, default=300, help="Mean body length of generated notes.")
+        parser.add_argument('--ocr-ratio', type=float, default=0.2, help="Share of generated notes with OCR text.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the generator.")
+        parser.add_argument(
+            '--provider', choices=('stub', 'hash'), default='stub',
+            help="stub: OpenAI client against a local stub server; hash: in-process hashing provider.",
+        )
+        parser.add_argument('--latency-ms', type=float, default=200, help="Stub server latency per request.")
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            path = options['database']
+            if not path:
+                directory = stack.enter_context(tempfile.TemporaryDirectory())
+                path = os.path.join(directory, 'joplin.sqlite')
+                start = time.perf_counter()
+                counts = generate_joplin_database(
+                    path, options['notes'], mean_words=options['mean_words'],
+                    ocr_ratio=options['ocr_ratio'], seed=options['seed'],
+                )
+                self.stdout.write(
+                    f"Generated {counts['notes']} notes and {counts['resources']} resources "
+                    f"in {time.perf_counter() - start:.1f}s"
+                )
+
+            run_id = uuid.uuid4().hex[:12]
+            overrides = {'RAG_EMBEDDING_MODEL': f'benchmark-{run_id}'}
+            if options['provider'] == 'stub':
+                server = stack.enter_context(StubEmbeddingServer(
+                    get_embedding_dimensions(), latency=options['latency_ms'] / 1000
+                ))
+                overrides.update(RAG_EMBEDDING_PROVIDER='openai', OPENAI_API_KEY='benchmark', OPENAI_BASE_URL=server.url)
+            else:
+                overrides.update(RAG_EMBEDDING_PROVIDER='hash')
+            stack.enter_context(override_settings(**overrides))
+
+            user = get_user_model().objects.create(email=f'benchmark-{run_id}@example.invalid')
+            try:
+                # The file is read from `path` directly, not from MEDIA_ROOT
+                upload = JoplinUpload.objects.create(user=user, file=os.path.basename(path))
+                self.stdout.write(f"{'run':<10} {'notes/s':>9} {'seconds':>8} {'queries':>8} {'chunks':>8} {'peak RSS MiB':>13}")
+                for run in ('cold', 'unchanged'):
+                    self._run(run, upload, path)
+            finally:
+                user.delete()
+                EmbeddingCache.objects.filter(model=embedding_model_key()).delete()
+                EmbeddingCacheStats.objects.filter(model=embedding_model_key()).delete()
+
+    def _run(self, name: str, upload: JoplinUpload, path: str) -> None:
+        """
+        Process the upload once and print its throughput line.
+        """
+        etl = JoplinETL(upload.id)
+        etl.db_path = path
+        start = time.perf_counter()
+        with count_queries() as queries:
+            etl.process()
+        elapsed = time.perf_counter() - start
+
+        notes = etl.stats['notes_scanned']
+        chunks = NoteChunk.objects.filter(user=upload.user).count()
+        self.stdout.write(
+            f"{name:<10} {notes / elapsed:>9.1f} {elapsed:>8.2f} {queries.count:>8} "
+            f"{chunks:>8} {peak_rss_mb():>13.1f}"
+        )
+        self.stdout.write(f"  {etl.stats.summary()}")
@@ -0,0 +1,128 @@
+import random
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from notes.benchmark import count_queries, make_text, make_vocabulary, percentile, peak_rss_mb, zipf_weights
+from notes.models import EmbeddingCache, EmbeddingCacheStats, IndexGeneration, NoteChunk, NoteMetadata
+from notes.providers import HashingProvider, embedding_model_key, get_embedding_dimensions
+from notes.search import SEARCH_MODES, embed_query, search_notes
+
+# Synthetic chunks per synthetic note
+CHUNKS_PER_NOTE = 4
+# Chunks embedded and inserted per bulk_create
+INSERT_BATCH = 1000
+
+class Command(BaseCommand):
+    """
+    Measure search_notes latency as a user's corpus grows.
+    A throwaway user is filled with synthetic chunks up to each requested size
+    (embedded with the hash provider, which also embeds the queries, so no API
+    calls are made) and every search mode is timed on the same random queries.
+    Query embeddings are cached before timing, so latencies cover the SQL and
+    loading the results; the SQL-per-query column catches N+1 regressions.
+    The user, its chunks and the query embeddings' cache entries are deleted afterwards.
+    """
+    help = "Report search_notes p50/p95/p99 latency at several corpus sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', default='1000,10000,100000', help="Comma-separated corpus sizes.")
+        parser.add_argument('--queries', type=int, default=100, help="Timed queries per size and mode.")
+        parser.add_argument('-k', type=int, default=5, help="Number of results per search.")
+        parser.add_argument(
+            '--modes', default='vector,lexical,hybrid,binary',
+            help="Comma-separated search modes to time.",
+        )
+        parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Search requires PostgreSQL with pgvector.")
+        sizes = sorted(int(size) for size in options['chunks'].split(','))
+        modes = options['modes'].split(',')
+        for mode in modes:
+            if mode not in SEARCH_MODES:
+                raise CommandError(f"Unsupported search mode: {mode}")
+
+        rng = random.Random(options['seed'])
+        vocabulary = make_vocabulary(5000, rng)
+        cum_weights = zipf_weights(len(vocabulary))
+        provider = HashingProvider('benchmark', get_embedding_dimensions())
+        queries = [' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(2, 6)))
+                   for _ in range(options['queries'] + 5)]
+
+        run_id = uuid.uuid4().hex[:12]
+        user = get_user_model().objects.create(email=f'benchmark-{run_id}@example.invalid')
+        generation = IndexGeneration.objects.create(user=user, state=IndexGeneration.ACTIVE)
+        model_key = embedding_model_key(f'benchmark-{run_id}', provider='hash')
+        try:
+            with override_settings(RAG_EMBEDDING_PROVIDER='hash', RAG_EMBEDDING_MODEL=f'benchmark-{run_id}'):
+                for query in queries:
+                    embed_query(query)
+                self.stdout.write(
+                    f"{'chunks':>8} {'mode':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                    f"{'SQL/q':>8} {'peak RSS MiB':>13}"
+                )
+                total = 0
+                for size in sizes:
+                    start = time.perf_counter()
+                    while total < size:
+                        count = min(INSERT_BATCH, size - total)
+                        self._insert_chunks(user, generation, provider, total, count, vocabulary, cum_weights, rng)
+                        total += count
+                    with connection.cursor() as cursor:
+                        cursor.execute("ANALYZE notes_notechunk")
+                    self.stdout.write(f"Loaded {size} chunks in {time.perf_counter() - start:.1f}s")
+
+                    for mode in modes:
+                        self._time(size, mode, queries, user, options['k'])
+        finally:
+            user.delete()
+            EmbeddingCache.objects.filter(model=model_key).delete()
+            EmbeddingCacheStats.objects.filter(model=model_key).delete()
+
+    def _insert_chunks(self, user, generation, provider, offset, count, vocabulary, cum_weights, rng) -> None:
+        """
+        Add `count` synthetic chunks (and their notes) to the user's corpus.
+        """
+        notes = NoteMetadata.objects.bulk_create([
+            NoteMetadata(user=user, joplin_id=uuid.UUID(int=rng.getrandbits(128)).hex,
+                         title=f"Benchmark note {(offset + i) // CHUNKS_PER_NOTE}")
+            for i in range(0, count, CHUNKS_PER_NOTE)
+        ])
+        texts = [make_text(rng.randint(80, 200), vocabulary, cum_weights, rng) for _ in range(count)]
+        NoteChunk.objects.bulk_create([
+            NoteChunk(
+                note=notes[i // CHUNKS_PER_NOTE],
+                user=user,
+                generation=generation,
+                chunk_index=i % CHUNKS_PER_NOTE,
+                content=text,
+                content_hash=NoteChunk.hash_content(text),
+                embedding=embedding,
+            )
+            for i, (text, embedding) in enumerate(zip(texts, provider.embed(texts)))
+        ])
+
+    def _time(self, size: int, mode: str, queries, user, k: int) -> None:
+        """
+        Run every query in one mode (after a short warm-up) and print its latency line.
+        """
+        warmup, queries = queries[:5], queries[5:]
+        for query in warmup:
+            search_notes(query, user, k=k, mode=mode)
+
+        latencies = []
+        with count_queries() as counter:
+            for query in queries:
+                start = time.perf_counter()
+                for chunk in search_notes(query, user, k=k, mode=mode):
+                    # Touch what the search page renders
+                    chunk.note.title
+                latencies.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"{size:>8} {mode:<8} {percentile(latencies, 0.50):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+            f"{percentile(latencies, 0.99):>8.1f} {counter.count / len(queries):>8.1f} {peak_rss_mb():>13.1f}"
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from notes.generations import collect_generation
+from notes.models import IndexGeneration
+
+class Command(BaseCommand):
+    """
+    Delete every retired index generation, in batches.
+    Retired generations are normally removed by a Celery task right after the
+    swap; this catches any whose task was lost.
+    """
+    help = "Delete the chunks of retired index generations."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Number of chunks deleted per statement (defaults to RAG_GENERATION_GC_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        generation_ids = list(IndexGeneration.objects.filter(
+            state=IndexGeneration.RETIRED
+        ).values_list('id', flat=True))
+        deleted = sum(collect_generation(generation_id, options['batch_size']) for generation_id in generation_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {len(generation_ids)} retired generations ({deleted} chunks)."
+        ))
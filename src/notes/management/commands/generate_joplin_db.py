@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from notes.benchmark import generate_joplin_database
+
+class Command(BaseCommand):
+    """
+    Write a synthetic Joplin SQLite database for benchmarks and load tests.
+    The output can be uploaded like a real export or passed to benchmark_etl.
+    """
+    help = "Generate a synthetic Joplin SQLite database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Where to write the database.")
+        parser.add_argument('--notes', type=int, default=1000, help="Number of notes.")
+        parser.add_argument('--mean-words', type=int, default=300, help="Mean note body length in words.")
+        parser.add_argument('--ocr-ratio', type=float, default=0.2, help="Share of notes with OCR'd attachments.")
+        parser.add_argument('--resources-per-note', type=int, default=2, help="Maximum attachments per such note.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+
+    def handle(self, *args, **options):
+        counts = generate_joplin_database(
+            options['path'],
+            options['notes'],
+            mean_words=options['mean_words'],
+            ocr_ratio=options['ocr_ratio'],
+            resources_per_note=options['resources_per_note'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {counts['notes']} notes, {counts['resources']} resources and "
+            f"{counts['note_resources']} note_resources rows to {options['path']}."
+        ))
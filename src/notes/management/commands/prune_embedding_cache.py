@@ -0,0 +1,65 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from notes.models import EmbeddingCache, EmbeddingCacheStats
+
+class Command(BaseCommand):
+    """
+    Evict old or excess entries from the global embedding cache.
+    Entries unused for longer than --max-age-days are removed first, then the
+    least recently used entries are removed until at most --max-entries remain.
+    """
+    help = "Evict embedding cache entries by age and size, and report hit and miss statistics."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age-days', type=int,
+            default=getattr(settings, 'EMBEDDING_CACHE_MAX_AGE_DAYS', 90),
+            help="Remove entries not used within this many days (0 disables).",
+        )
+        parser.add_argument(
+            '--max-entries', type=int,
+            default=getattr(settings, 'EMBEDDING_CACHE_MAX_ENTRIES', 0),
+            help="Keep at most this many of the most recently used entries (0 disables).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help="Number of rows deleted per statement.",
+        )
+
+    def handle(self, *args, **options):
+        max_age_days = options['max_age_days']
+        max_entries = options['max_entries']
+        batch_size = options['batch_size']
+
+        total = EmbeddingCache.objects.count()
+        self.stdout.write(f"Cache entries: {total}")
+        for stats in EmbeddingCacheStats.objects.order_by('model'):
+            lookups = stats.hits + stats.misses
+            hit_rate = stats.hits / lookups if lookups else 0
+            self.stdout.write(
+                f"  {stats.model}: {stats.hits} hits, {stats.misses} misses ({hit_rate:.1%} hit rate)"
+            )
+
+        removed = 0
+        if max_age_days:
+            cutoff = timezone.now() - timedelta(days=max_age_days)
+            removed += self._delete_in_batches(
+                EmbeddingCache.objects.filter(last_used_at__lt=cutoff), batch_size
+            )
+
+        if max_entries:
+            excess = EmbeddingCache.objects.order_by('-last_used_at', '-id')[max_entries:]
+            removed += self._delete_in_batches(excess, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f"Evicted {removed} cache entries."))
+
+    def _delete_in_batches(self, queryset, batch_size: int) -> int:
+        """
+        Delete the rows of a queryset in fixed-size batches to keep transactions short.
+        """
+        ids = list(queryset.values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            EmbeddingCache.objects.filter(id__in=ids[start:start + batch_size]).delete()
+        return len(ids)
@@ -0,0 +1,70 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from notes.models import JoplinUpload, UploadShard
+
+class Command(BaseCommand):
+    """
+    Delete the stored SQLite files of finished uploads.
+    Once an upload is processed its file is no longer read (re-uploads are
+    matched by digest), so only the newest --keep files per user are kept,
+    and none older than --max-age-days. Upload rows are kept for their history.
+    Uploads still being processed are never touched: a failed upload only
+    counts as finished once none of its shards is still running or waiting to be retried.
+    """
+    help = "Delete old uploaded SQLite files, keeping the newest per user."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep', type=int,
+            default=getattr(settings, 'UPLOAD_KEEP_FILES', 1),
+            help="Keep the files of this many of each user's newest finished uploads.",
+        )
+        parser.add_argument(
+            '--max-age-days', type=int,
+            default=getattr(settings, 'UPLOAD_MAX_AGE_DAYS', 30),
+            help="Delete files of finished uploads older than this many days, even if kept (0 disables).",
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Only report what would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        keep = options['keep']
+        max_age_days = options['max_age_days']
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(days=max_age_days) if max_age_days else None
+
+        running_shards = UploadShard.objects.filter(upload=OuterRef('pk'), completed=False, failed=False)
+        finished = JoplinUpload.objects.exclude(file='').filter(
+            Q(processed=True) | (Q(error_message__gt='') & ~Exists(running_shards))
+        ).order_by('user_id', '-uploaded_at', '-id')
+
+        kept_per_user = {}
+        removed = 0
+        freed = 0
+        for upload in finished.iterator():
+            kept = kept_per_user.get(upload.user_id, 0)
+            if kept < keep and (cutoff is None or upload.uploaded_at >= cutoff):
+                kept_per_user[upload.user_id] = kept + 1
+                continue
+
+            try:
+                size = upload.file.size
+            except OSError:
+                size = 0
+            removed += 1
+            freed += size
+            if dry_run:
+                self.stdout.write(f"Would delete {upload.file.name} ({size} bytes)")
+                continue
+            upload.file.delete(save=False)
+            JoplinUpload.objects.filter(id=upload.id).update(file='')
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {removed} upload files ({freed / (1024 * 1024):.1f} MiB)."
+        ))
@@ -0,0 +1,83 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from notes.providers import get_embedding_dimensions
+from notes.vector_index import (
+    create_binary_index_sql, create_index_sql, create_user_index_sql, drop_binary_index_sql,
+    drop_index_sql, drop_user_index_sql, get_distance, get_index_type, list_user_indexes,
+)
+
+class Command(BaseCommand):
+    """
+    Rebuild the ANN index on NoteChunk.embedding from the current RAG_VECTOR_* settings,
+    and the binary-quantized index used by binary search (RAG_BINARY_INDEX).
+    Use after changing the index type, distance, build parameters or
+    RAG_EMBEDDING_DIMENSIONS, or to rebuild an IVFFlat index once enough data
+    has been loaded for good list centroids. Existing per-user partial indexes
+    are rebuilt along with them.
+
+    With --user, only builds (or with --remove, drops) the partial ANN index of
+    one user, for users who own a large share of the chunks.
+    """
+    help = "Drop and recreate the vector indexes on note chunks using the current settings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrently', action='store_true',
+            help="Build without blocking writes (slower, for live systems).",
+        )
+        parser.add_argument(
+            '--user',
+            help="Email of a user to build a partial ANN index for, instead of rebuilding every index.",
+        )
+        parser.add_argument(
+            '--remove', action='store_true',
+            help="With --user, drop the user's partial index instead of building it.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write("Vector indexes require PostgreSQL with pgvector.")
+            return
+
+        concurrently = options['concurrently']
+        if options['user']:
+            User = get_user_model()
+            try:
+                user = User.objects.get(email=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['user']}")
+            with connection.cursor() as cursor:
+                cursor.execute(drop_user_index_sql(user.id, concurrently))
+                sql = create_user_index_sql(user.id, concurrently)
+                if sql and not options['remove']:
+                    self.stdout.write(f"Building {get_index_type()} index for {user.email}...")
+                    cursor.execute(sql)
+            done = 'dropped' if options['remove'] else 'rebuilt'
+            self.stdout.write(self.style.SUCCESS(f"Vector index of {user.email} {done}."))
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(drop_index_sql(concurrently))
+            sql = create_index_sql(concurrently)
+            if sql:
+                self.stdout.write(
+                    f"Building {get_index_type()} index ({get_distance()} distance, "
+                    f"{get_embedding_dimensions()} dimensions)..."
+                )
+                cursor.execute(sql)
+
+            for user_id in list_user_indexes(cursor):
+                cursor.execute(drop_user_index_sql(user_id, concurrently))
+                sql = create_user_index_sql(user_id, concurrently)
+                if sql:
+                    self.stdout.write(f"Building index of user {user_id}...")
+                    cursor.execute(sql)
+
+            cursor.execute(drop_binary_index_sql(concurrently))
+            sql = create_binary_index_sql(concurrently)
+            if sql:
+                self.stdout.write("Building binary-quantized index...")
+                cursor.execute(sql)
+
+        self.stdout.write(self.style.SUCCESS("Vector indexes rebuilt."))
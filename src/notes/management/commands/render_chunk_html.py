@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Value
+from django.db.models.functions import Concat
+from notes.models import NoteChunk
+from notes.rendering import html_key_prefix, store_missing_html
+
+class Command(BaseCommand):
+    """
+    Render and store the HTML of chunks whose stored HTML is missing or stale.
+    New chunks are rendered at ingest; run this after upgrading the renderer or
+    the sanitizer, or to fill in chunks indexed while RENDER_MARKDOWN was off.
+    Until then, search renders stale chunks on the fly without storing them.
+    """
+    help = "Backfill the stored HTML of note chunks, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of chunks rendered and saved per statement.",
+        )
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'RENDER_MARKDOWN', True):
+            self.stderr.write("RENDER_MARKDOWN is off, nothing to render.")
+            return
+
+        batch_size = options['batch_size']
+        stale = NoteChunk.objects.exclude(
+            html_hash=Concat(Value(html_key_prefix()), 'content_hash')
+        ).only('id', 'content', 'content_hash', 'html_hash').order_by('id')
+
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(stale.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            updated += store_missing_html(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered the HTML of {updated} chunks."))
@@ -0,0 +1,32 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    NoteChunk = apps.get_model('notes', 'NoteChunk')
+    batch = []
+    for chunk in NoteChunk.objects.only('id', 'content').iterator(chunk_size=2000):
+        chunk.content_hash = hashlib.sha256(chunk.content.encode('utf-8')).hexdigest()
+        batch.append(chunk)
+        if len(batch) >= 2000:
+            NoteChunk.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        NoteChunk.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0003_notemetadata_chunk_overlap_notemetadata_chunk_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notechunk',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_embeddingcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.IntegerField()),
+                ('content', models.TextField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('attempts', models.IntegerField(default=1)),
+                ('last_error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='failed_embeddings', to='notes.notemetadata')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# The index as of this migration, with the default settings (HNSW, cosine
+# distance, m = 16, ef_construction = 64) on the vector(1536) column. Frozen
+# here rather than built by notes.vector_index, which has changed since;
+# rebuild_vector_index applies other RAG_VECTOR_* settings.
+CREATE_ANN_INDEX = (
+    "CREATE INDEX IF NOT EXISTS notes_notechunk_embedding_ann "
+    "ON notes_notechunk USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+)
+DROP_ANN_INDEX = "DROP INDEX IF EXISTS notes_notechunk_embedding_ann"
+
+
+def create_ann_index(apps, schema_editor):
+    # Vector indexes are only available on PostgreSQL with pgvector
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_ANN_INDEX)
+
+
+def drop_ann_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_ANN_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0006_failedembedding'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_ann_index, drop_ann_index),
+    ]
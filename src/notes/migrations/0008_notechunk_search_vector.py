@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def add_search_vector(apps, schema_editor):
+    # Full-text search columns are PostgreSQL-only. The column is generated and
+    # stored by the database, so it is intentionally not declared on the model.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "ALTER TABLE notes_notechunk ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED"
+    )
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS notes_notechunk_search_vector_gin "
+        "ON notes_notechunk USING gin (search_vector)"
+    )
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS notes_notechunk_search_vector_gin")
+    schema_editor.execute("ALTER TABLE notes_notechunk DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_notechunk_embedding_ann_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector),
+    ]
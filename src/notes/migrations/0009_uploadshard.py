@@ -0,0 +1,31 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_notechunk_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('start_id', models.CharField(blank=True, max_length=32)),
+                ('end_id', models.CharField(blank=True, max_length=32)),
+                ('completed', models.BooleanField(default=False)),
+                ('new_notes_count', models.IntegerField(default=0)),
+                ('updated_notes_count', models.IntegerField(default=0)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='notes.joplinupload')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('upload', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0009_uploadshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notes_total', models.IntegerField(default=0)),
+                ('notes_scanned', models.IntegerField(default=0)),
+                ('notes_skipped', models.IntegerField(default=0)),
+                ('chunks_cached', models.IntegerField(default=0)),
+                ('chunks_embedded', models.IntegerField(default=0)),
+                ('chunks_failed', models.IntegerField(default=0)),
+                ('chunks_written', models.IntegerField(default=0)),
+                ('api_requests', models.IntegerField(default=0)),
+                ('tokens_sent', models.BigIntegerField(default=0)),
+                ('api_seconds', models.FloatField(default=0)),
+                ('extract_seconds', models.FloatField(default=0)),
+                ('split_seconds', models.FloatField(default=0)),
+                ('embed_wait_seconds', models.FloatField(default=0)),
+                ('write_seconds', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('upload', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='notes.joplinupload')),
+            ],
+        ),
+    ]
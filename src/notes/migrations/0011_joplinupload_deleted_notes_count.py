@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0010_uploadstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='joplinupload',
+            name='deleted_notes_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0011_joplinupload_deleted_notes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='joplinupload',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='joplinupload',
+            name='file',
+            field=models.FileField(blank=True, upload_to='uploads/sqlite/'),
+        ),
+    ]
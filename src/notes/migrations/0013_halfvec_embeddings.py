@@ -0,0 +1,82 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:21
+
+import pgvector.django.halfvec
+from django.db import migrations, models
+
+# Every embedding stored before this migration came from text-embedding-ada-002
+LEGACY_MODEL = 'text-embedding-ada-002'
+LEGACY_MODEL_KEY = 'text-embedding-ada-002:1536'
+
+# The ANN index before this migration (see 0007) and after it: on the column cast
+# to the default 1536 dimensions, covering rows of that size only. Frozen here
+# rather than built by notes.vector_index, which has changed since.
+VECTOR_ANN_INDEX = (
+    "CREATE INDEX IF NOT EXISTS notes_notechunk_embedding_ann "
+    "ON notes_notechunk USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+)
+HALFVEC_ANN_INDEX = (
+    "CREATE INDEX IF NOT EXISTS notes_notechunk_embedding_ann "
+    "ON notes_notechunk USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops) "
+    "WITH (m = 16, ef_construction = 64) WHERE vector_dims(embedding) = 1536"
+)
+DROP_ANN_INDEX = "DROP INDEX IF EXISTS notes_notechunk_embedding_ann"
+
+
+def drop_ann_index(apps, schema_editor):
+    # The index is rebuilt on the halfvec column below
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_ANN_INDEX)
+
+
+def create_vector_ann_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(VECTOR_ANN_INDEX)
+
+
+def create_halfvec_ann_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(HALFVEC_ANN_INDEX)
+
+
+def tag_legacy_embeddings(apps, schema_editor):
+    NoteMetadata = apps.get_model('notes', 'NoteMetadata')
+    EmbeddingCache = apps.get_model('notes', 'EmbeddingCache')
+    NoteMetadata.objects.filter(embedding_model='').update(embedding_model=LEGACY_MODEL_KEY)
+    EmbeddingCache.objects.filter(model=LEGACY_MODEL).update(model=LEGACY_MODEL_KEY)
+
+
+def untag_legacy_embeddings(apps, schema_editor):
+    EmbeddingCache = apps.get_model('notes', 'EmbeddingCache')
+    EmbeddingCache.objects.filter(model=LEGACY_MODEL_KEY).update(model=LEGACY_MODEL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0012_joplinupload_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notemetadata',
+            name='embedding_model',
+            field=models.CharField(blank=True, max_length=128),
+        ),
+        migrations.RunPython(tag_legacy_embeddings, untag_legacy_embeddings),
+        migrations.RunPython(drop_ann_index, create_vector_ann_index),
+        # Existing vectors are converted in place (vector -> halfvec cast), no re-embedding needed
+        migrations.AlterField(
+            model_name='embeddingcache',
+            name='embedding',
+            field=pgvector.django.halfvec.HalfVectorField(),
+        ),
+        migrations.AlterField(
+            model_name='notechunk',
+            name='embedding',
+            field=pgvector.django.halfvec.HalfVectorField(),
+        ),
+        migrations.RunPython(create_halfvec_ann_index, drop_ann_index),
+    ]
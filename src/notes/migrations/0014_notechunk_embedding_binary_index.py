@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# The binary-quantized index as of this migration, with the default settings
+# (1536 dimensions, m = 16, ef_construction = 64). Frozen here rather than
+# built by notes.vector_index, which has changed since.
+CREATE_BINARY_INDEX = (
+    "CREATE INDEX IF NOT EXISTS notes_notechunk_embedding_bq "
+    "ON notes_notechunk USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops) "
+    "WITH (m = 16, ef_construction = 64) WHERE vector_dims(embedding) = 1536"
+)
+DROP_BINARY_INDEX = "DROP INDEX IF EXISTS notes_notechunk_embedding_bq"
+
+
+def create_binary_index(apps, schema_editor):
+    # Binary quantization (binary_quantize, bit_hamming_ops) needs pgvector >= 0.7
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_BINARY_INDEX)
+
+
+def drop_binary_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(DROP_BINARY_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0013_halfvec_embeddings'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_binary_index, drop_binary_index),
+    ]
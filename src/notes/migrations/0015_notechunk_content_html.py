@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0014_notechunk_embedding_binary_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notechunk',
+            name='content_html',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='notechunk',
+            name='html_hash',
+            field=models.CharField(blank=True, max_length=80),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:36
+
+from django.db import migrations, models
+
+
+def tag_recursive_chunker(apps, schema_editor):
+    # Every note indexed before this migration was split by the recursive splitter
+    NoteMetadata = apps.get_model('notes', 'NoteMetadata')
+    NoteMetadata.objects.filter(chunker='', chunk_size__isnull=False).update(chunker='recursive')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0015_notechunk_content_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notemetadata',
+            name='chunker',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.RunPython(tag_recursive_chunker, migrations.RunPython.noop),
+    ]
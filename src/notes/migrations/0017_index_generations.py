@@ -0,0 +1,63 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_active_generations(apps, schema_editor):
+    # Every user's existing chunks become their first active generation, recorded
+    # with the index settings of their most recently indexed note
+    NoteMetadata = apps.get_model('notes', 'NoteMetadata')
+    NoteChunk = apps.get_model('notes', 'NoteChunk')
+    IndexGeneration = apps.get_model('notes', 'IndexGeneration')
+    user_ids = NoteMetadata.objects.filter(user__isnull=False).values_list('user_id', flat=True).distinct()
+    for user_id in user_ids:
+        latest = NoteMetadata.objects.filter(user_id=user_id).latest('id')
+        generation = IndexGeneration.objects.create(
+            user_id=user_id,
+            state='active',
+            chunker=latest.chunker,
+            chunk_size=latest.chunk_size,
+            chunk_overlap=latest.chunk_overlap,
+            embedding_model=latest.embedding_model,
+            activated_at=timezone.now(),
+        )
+        NoteChunk.objects.filter(note__user_id=user_id).update(generation=generation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0016_notemetadata_chunker'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('building', 'Building'), ('active', 'Active'), ('retired', 'Retired')], default='building', max_length=16)),
+                ('chunker', models.CharField(blank=True, max_length=32)),
+                ('chunk_size', models.IntegerField(blank=True, null=True)),
+                ('chunk_overlap', models.IntegerField(blank=True, null=True)),
+                ('embedding_model', models.CharField(blank=True, max_length=128)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+                ('upload', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='notes.joplinupload')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_generations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notechunk',
+            name='generation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.indexgeneration'),
+        ),
+        migrations.AddConstraint(
+            model_name='indexgeneration',
+            constraint=models.UniqueConstraint(condition=models.Q(('state', 'active')), fields=('user',), name='notes_one_active_generation_per_user'),
+        ),
+        migrations.RunPython(create_active_generations, migrations.RunPython.noop),
+    ]
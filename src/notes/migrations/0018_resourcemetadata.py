@@ -0,0 +1,73 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def resplit_notes(apps, schema_editor):
+    # Chunks of notes indexed until now include the OCR text of their resources,
+    # which resources are indexed on their own from now on; split them again on
+    # the next upload (chunks of the body keep their embeddings)
+    NoteMetadata = apps.get_model('notes', 'NoteMetadata')
+    NoteMetadata.objects.update(chunker='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0017_index_generations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadshard',
+            name='resources',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='failedembedding',
+            name='note',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='failed_embeddings', to='notes.notemetadata'),
+        ),
+        migrations.AlterField(
+            model_name='notechunk',
+            name='note',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.notemetadata'),
+        ),
+        migrations.CreateModel(
+            name='ResourceMetadata',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunker', models.CharField(blank=True, max_length=32)),
+                ('chunk_size', models.IntegerField(blank=True, null=True)),
+                ('chunk_overlap', models.IntegerField(blank=True, null=True)),
+                ('embedding_model', models.CharField(blank=True, max_length=128)),
+                ('joplin_id', models.CharField(db_index=True, max_length=32)),
+                ('title', models.CharField(blank=True, max_length=512)),
+                ('last_updated', models.DateTimeField(blank=True, null=True)),
+                ('notes', models.ManyToManyField(blank=True, related_name='resources', to='notes.notemetadata')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resources', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='failedembedding',
+            name='resource',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='failed_embeddings', to='notes.resourcemetadata'),
+        ),
+        migrations.AddField(
+            model_name='notechunk',
+            name='resource',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.resourcemetadata'),
+        ),
+        migrations.AddConstraint(
+            model_name='notechunk',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('note__isnull', False), ('resource__isnull', True)), models.Q(('note__isnull', True), ('resource__isnull', False)), _connector='OR'), name='notes_notechunk_note_or_resource'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='resourcemetadata',
+            unique_together={('user', 'joplin_id')},
+        ),
+        migrations.RunPython(resplit_notes, migrations.RunPython.noop),
+    ]
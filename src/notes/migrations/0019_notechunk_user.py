@@ -0,0 +1,44 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_chunk_users(apps, schema_editor):
+    # Every chunk has a generation since migration 0017, owned by the chunk's user.
+    # One UPDATE per generation keeps each statement to one user's chunks
+    NoteChunk = apps.get_model('notes', 'NoteChunk')
+    IndexGeneration = apps.get_model('notes', 'IndexGeneration')
+    for generation_id, user_id in IndexGeneration.objects.values_list('id', 'user_id'):
+        NoteChunk.objects.filter(generation_id=generation_id).update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0018_resourcemetadata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notechunk',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='note_chunks', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_chunk_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='notechunk',
+            name='resource',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.resourcemetadata'),
+        ),
+        migrations.AddIndex(
+            model_name='notechunk',
+            index=models.Index(fields=['user', 'generation'], name='notes_notechunk_user_gen'),
+        ),
+        migrations.AddIndex(
+            model_name='notechunk',
+            index=models.Index(condition=models.Q(('resource__isnull', False)), fields=['resource'], name='notes_notechunk_resource'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-17 00:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0019_notechunk_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadshard',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
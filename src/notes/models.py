@@ -1,6 +1,7 @@
+import hashlib
 from django.db import models
 from django.contrib.auth import get_user_model
-from pgvector.django import VectorField
+from pgvector.django import HalfVectorField
 
 User = get_user_model()
 
@@ -10,17 +11,81 @@ class JoplinUpload(models.Model):
     Stores metadata about the processing status and results.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    file = models.FileField(upload_to='uploads/sqlite/')
+    file = models.FileField(upload_to='uploads/sqlite/', blank=True) # Emptied by prune_uploads and for duplicates
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True) # Digest of the uploaded file
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
     new_notes_count = models.IntegerField(default=0)
     updated_notes_count = models.IntegerField(default=0)
+    deleted_notes_count = models.IntegerField(default=0) # Removed or trashed in Joplin since the last upload
     error_message = models.TextField(blank=True, null=True)
 
     def __str__(self) -> str:
         return f"{self.user.email} - {self.uploaded_at}"
 
-class NoteMetadata(models.Model):
+class UploadStats(models.Model):
+    """
+    Live progress counters and per-stage timings of an upload's ETL run.
+    Updated incrementally (with F() increments, so parallel shards can share a row)
+    and polled by the upload page through the progress endpoint.
+    """
+    upload = models.OneToOneField(JoplinUpload, on_delete=models.CASCADE, related_name='stats')
+    notes_total = models.IntegerField(default=0)
+    notes_scanned = models.IntegerField(default=0)
+    notes_skipped = models.IntegerField(default=0) # Unchanged since the last upload
+    chunks_cached = models.IntegerField(default=0) # Served from the embedding cache
+    chunks_embedded = models.IntegerField(default=0) # Sent to the embeddings API
+    chunks_failed = models.IntegerField(default=0)
+    chunks_written = models.IntegerField(default=0)
+    api_requests = models.IntegerField(default=0)
+    tokens_sent = models.BigIntegerField(default=0)
+    api_seconds = models.FloatField(default=0) # Summed latency of embedding requests
+    extract_seconds = models.FloatField(default=0) # Reading notes and OCR text from SQLite
+    split_seconds = models.FloatField(default=0) # Text splitting and hashing
+    embed_wait_seconds = models.FloatField(default=0) # ETL blocked waiting on embedding requests
+    write_seconds = models.FloatField(default=0) # Postgres reads and writes
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Upload {self.upload_id} - {self.notes_scanned}/{self.notes_total} notes"
+
+class UploadShard(models.Model):
+    """
+    A note-id (or resource-id) range of an upload processed by its own Celery task.
+    Shard results are recorded here once so that a retried shard task
+    reports its stored counts instead of counting its notes again.
+    """
+    upload = models.ForeignKey(JoplinUpload, on_delete=models.CASCADE, related_name='shards')
+    index = models.IntegerField()
+    resources = models.BooleanField(default=False) # A range of resource ids rather than note ids
+    start_id = models.CharField(max_length=32, blank=True) # Inclusive lower bound, blank for the first shard
+    end_id = models.CharField(max_length=32, blank=True) # Exclusive upper bound, blank for the last shard
+    completed = models.BooleanField(default=False)
+    failed = models.BooleanField(default=False) # Gave up after the task's last retry
+    new_notes_count = models.IntegerField(default=0)
+    updated_notes_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('upload', 'index')
+        ordering = ['index']
+
+    def __str__(self) -> str:
+        return f"Upload {self.upload_id} - Shard {self.index}"
+
+class IndexedDocument(models.Model):
+    """
+    Fields recording how a note or resource was indexed (see etl.get_index_settings),
+    used to re-index documents whose settings changed.
+    """
+    chunker = models.CharField(max_length=32, blank=True) # RAG_CHUNKER; chunk size and overlap are in its units
+    chunk_size = models.IntegerField(null=True, blank=True)
+    chunk_overlap = models.IntegerField(null=True, blank=True)
+    embedding_model = models.CharField(max_length=128, blank=True) # Model key the chunks were embedded with
+
+    class Meta:
+        abstract = True
+
+class NoteMetadata(IndexedDocument):
     """
     Stores metadata for a specific Joplin note retrieved from the uploaded SQLite database.
     Ensures that notes are unique per user based on their original Joplin ID.
@@ -31,10 +96,6 @@ class NoteMetadata(models.Model):
     last_updated = models.DateTimeField(null=True, blank=True) # From user_updated_time
     parent_id = models.CharField(max_length=32, blank=True)
     
-    # Track RAG settings for re-indexing detection
-    chunk_size = models.IntegerField(null=True, blank=True)
-    chunk_overlap = models.IntegerField(null=True, blank=True)
-    
     class Meta:
         # User + Joplin ID should be unique to avoid duplicates for the same user
         unique_together = ('user', 'joplin_id')
@@ -42,18 +103,180 @@ class NoteMetadata(models.Model):
     def __str__(self) -> str:
         return self.title or self.joplin_id
 
+class ResourceMetadata(IndexedDocument):
+    """
+    A Joplin resource (attachment) with OCR text, indexed as a document of its own.
+    Its chunks are split and embedded once and shared by every note attaching it,
+    through `notes` (mirroring Joplin's note_resources table).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='resources')
+    joplin_id = models.CharField(max_length=32, db_index=True)
+    title = models.CharField(max_length=512, blank=True)
+    last_updated = models.DateTimeField(null=True, blank=True) # From the resource's updated_time
+    notes = models.ManyToManyField(NoteMetadata, related_name='resources', blank=True) # Live notes attaching it
+
+    class Meta:
+        unique_together = ('user', 'joplin_id')
+
+    def __str__(self) -> str:
+        return self.title or self.joplin_id
+
+class IndexGeneration(models.Model):
+    """
+    A complete set of a user's chunks, built with one set of index settings.
+    Search only reads the user's active generation. When the index settings
+    change, the next upload builds a new generation next to the active one and
+    swaps it in once finished; the old one is then deleted in batches (see notes.generations).
+    """
+    BUILDING = 'building'
+    ACTIVE = 'active'
+    RETIRED = 'retired'
+    STATES = [(BUILDING, 'Building'), (ACTIVE, 'Active'), (RETIRED, 'Retired')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='index_generations')
+    upload = models.ForeignKey(JoplinUpload, on_delete=models.SET_NULL, null=True, blank=True) # Upload that started the build
+    state = models.CharField(max_length=16, choices=STATES, default=BUILDING)
+
+    # Index settings the generation is built with (see etl.get_index_settings)
+    chunker = models.CharField(max_length=32, blank=True)
+    chunk_size = models.IntegerField(null=True, blank=True)
+    chunk_overlap = models.IntegerField(null=True, blank=True)
+    embedding_model = models.CharField(max_length=128, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # The swap retires the old generation before activating the new one
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(state='active'), name='notes_one_active_generation_per_user'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user.email} - Generation {self.id} ({self.state})"
+
 class NoteChunk(models.Model):
     """
     Stores a text segment (chunk) of a note along with its vector embedding.
-    These chunks are used for semantic search.
+    These chunks are used for semantic search. On PostgreSQL the table also has a
+    generated, GIN-indexed `search_vector` tsvector column used for full-text search
+    (managed by migration 0008 rather than declared here), and the ANN indexes of
+    notes.vector_index.
     """
-    note = models.ForeignKey(NoteMetadata, on_delete=models.CASCADE, related_name='chunks')
+    # A chunk belongs to either a note (its body) or a resource (its OCR text)
+    note = models.ForeignKey(NoteMetadata, on_delete=models.CASCADE, null=True, blank=True, related_name='chunks')
+    resource = models.ForeignKey(ResourceMetadata, on_delete=models.CASCADE, null=True, blank=True, related_name='chunks', db_index=False)
+    generation = models.ForeignKey(IndexGeneration, on_delete=models.CASCADE, null=True, related_name='chunks') # Set on every chunk since migration 0017
+    # Owner of the note or resource, denormalized so searches filter without joins (set on every chunk since migration 0019)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, related_name='note_chunks', db_index=False)
     chunk_index = models.IntegerField()
-    content = models.TextField() # Text content including OCR
-    embedding = VectorField(dimensions=1536) # OpenAI text-embedding-ada-002
+    content = models.TextField() # Text of the note body or of the resource's OCR text
+    content_hash = models.CharField(max_length=64, blank=True) # sha256 of content, used to diff re-splits
+    content_html = models.TextField(blank=True) # content rendered from markdown, see notes.rendering
+    html_hash = models.CharField(max_length=80, blank=True) # renderer version and content hash content_html was made from
+    embedding = HalfVectorField() # RAG_EMBEDDING_DIMENSIONS half-precision floats, see vector_index
 
     class Meta:
         ordering = ['chunk_index']
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(note__isnull=False, resource__isnull=True) |
+                          models.Q(note__isnull=True, resource__isnull=False),
+                name='notes_notechunk_note_or_resource',
+            ),
+        ]
+        indexes = [
+            # Candidate rows of a search: one user's active generation. Lets Postgres
+            # pre-filter small tenants before computing distances (see vector_index)
+            models.Index(fields=['user', 'generation'], name='notes_notechunk_user_gen'),
+            # Most chunks are note chunks, so only index the resource ones
+            models.Index(fields=['resource'], condition=models.Q(resource__isnull=False), name='notes_notechunk_resource'),
+        ]
     
     def __str__(self) -> str:
-        return f"{self.note.title} - Chunk {self.chunk_index}"
+        return f"{self.title} - Chunk {self.chunk_index}"
+
+    @property
+    def owner(self) -> IndexedDocument:
+        """
+        The note or resource the chunk was split from.
+        """
+        return self.note if self.note_id else self.resource
+
+    @property
+    def title(self) -> str:
+        """
+        Title of the note or resource the chunk was split from.
+        """
+        return self.owner.title
+
+    @staticmethod
+    def owner_field(model: type) -> str:
+        """
+        Return the foreign key linking chunks to documents of a model: 'note' or 'resource'.
+        """
+        return 'resource' if issubclass(model, ResourceMetadata) else 'note'
+
+    @staticmethod
+    def hash_content(text: str) -> str:
+        """
+        Compute the content hash used to detect unchanged chunks between uploads.
+
+        Args:
+            text: The chunk text.
+
+        Returns:
+            The hex-encoded sha256 digest of the text.
+        """
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingCache(models.Model):
+    """
+    Global cache of embeddings keyed by embedding model and chunk text hash.
+    Shared across users so identical text is only ever embedded once per model.
+    """
+    model = models.CharField(max_length=128) # Model key, including the dimensions
+    text_hash = models.CharField(max_length=64) # sha256 of the embedded text
+    embedding = HalfVectorField()
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('model', 'text_hash')
+
+    def __str__(self) -> str:
+        return f"{self.model} - {self.text_hash[:12]}"
+
+class EmbeddingCacheStats(models.Model):
+    """
+    Running hit and miss counters of the global embedding cache, one row per embedding model.
+    Misses leave no cache entry to count on, so both are kept here for the hit rate.
+    """
+    model = models.CharField(max_length=128, unique=True) # Model key, including the dimensions
+    hits = models.BigIntegerField(default=0)
+    misses = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.model} - {self.hits} hits, {self.misses} misses"
+
+class FailedEmbedding(models.Model):
+    """
+    Durable retry list of chunks whose embedding request failed after all retries.
+    Entries are re-queued at the start of the owner's next ETL run.
+    """
+    note = models.ForeignKey(NoteMetadata, on_delete=models.CASCADE, null=True, blank=True, related_name='failed_embeddings')
+    resource = models.ForeignKey(ResourceMetadata, on_delete=models.CASCADE, null=True, blank=True, related_name='failed_embeddings')
+    chunk_index = models.IntegerField()
+    content = models.TextField()
+    content_hash = models.CharField(max_length=64)
+    attempts = models.IntegerField(default=1)
+    last_error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        owner = self.note if self.note_id else self.resource
+        return f"{owner.title} - Chunk {self.chunk_index} ({self.attempts} attempts)"
@@ -0,0 +1,350 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, List, Optional
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import weakref
+import httpx
+import openai
+import tiktoken
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+# Supported embedding backends (RAG_EMBEDDING_PROVIDER)
+PROVIDERS = ('openai', 'local', 'hash')
+
+# Names of the Embeddings API models, which the local backend cannot load
+OPENAI_MODEL_PREFIX = 'text-embedding-'
+
+_client_lock = threading.Lock()
+_openai_client: Optional[openai.OpenAI] = None
+_openai_client_key: Optional[tuple] = None
+# Async clients per event loop: their pooled connections belong to the loop that opened them
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = weakref.WeakKeyDictionary()
+
+def openai_client_options() -> dict:
+    """
+    Return the OpenAI client arguments built from the OPENAI_* settings
+    (key, base URL, timeouts and retries), shared by the sync and async clients.
+    """
+    return {
+        'api_key': settings.OPENAI_API_KEY,
+        'base_url': getattr(settings, 'OPENAI_BASE_URL', None),
+        'timeout': httpx.Timeout(
+            getattr(settings, 'OPENAI_TIMEOUT', 60.0),
+            connect=getattr(settings, 'OPENAI_CONNECT_TIMEOUT', 10.0),
+        ),
+        'max_retries': getattr(settings, 'OPENAI_MAX_RETRIES', 2),
+    }
+
+def openai_pool_limits() -> httpx.Limits:
+    """
+    Return the connection pool limits of the OpenAI clients (OPENAI_MAX_CONNECTIONS).
+    """
+    max_connections = getattr(settings, 'OPENAI_MAX_CONNECTIONS', 20)
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+def get_openai_client() -> openai.OpenAI:
+    """
+    Return the process-wide OpenAI client.
+    All callers share one connection pool, so HTTPS connections are kept alive
+    and reused between requests. The client is recreated after a fork (Celery
+    prefork workers), since pooled sockets must not be shared between processes,
+    and when the API key or base URL setting changes.
+    Timeouts, pool size and retries come from the OPENAI_* settings.
+    """
+    global _openai_client, _openai_client_key
+    key = (os.getpid(), settings.OPENAI_API_KEY, getattr(settings, 'OPENAI_BASE_URL', None))
+    with _client_lock:
+        if _openai_client is None or _openai_client_key != key:
+            _openai_client = openai.OpenAI(
+                **openai_client_options(),
+                http_client=openai.DefaultHttpxClient(limits=openai_pool_limits()),
+            )
+            _openai_client_key = key
+        return _openai_client
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """
+    Return the AsyncOpenAI client of the running event loop.
+    Under an ASGI server there is one loop per process, so all async views
+    share one connection pool, configured like get_openai_client.
+    Must be called from a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    key = (os.getpid(), settings.OPENAI_API_KEY, getattr(settings, 'OPENAI_BASE_URL', None))
+    entry = _async_clients.get(loop)
+    if entry is None or entry[0] != key:
+        client = openai.AsyncOpenAI(
+            **openai_client_options(),
+            http_client=openai.DefaultAsyncHttpxClient(limits=openai_pool_limits()),
+        )
+        entry = (key, client)
+        _async_clients[loop] = entry
+    return entry[1]
+
+def get_provider_name() -> str:
+    """
+    Return the configured embedding backend: 'openai', 'local' or 'hash'.
+    """
+    provider = getattr(settings, 'RAG_EMBEDDING_PROVIDER', 'openai')
+    if provider not in PROVIDERS:
+        raise ImproperlyConfigured(f"Unsupported RAG_EMBEDDING_PROVIDER: {provider}")
+    return provider
+
+def get_embedding_model() -> str:
+    """
+    Return the configured embedding model name (RAG_EMBEDDING_MODEL).
+    """
+    return getattr(settings, 'RAG_EMBEDDING_MODEL', 'text-embedding-ada-002')
+
+def get_embedding_dimensions() -> int:
+    """
+    Return the configured embedding size (RAG_EMBEDDING_DIMENSIONS).
+    """
+    return int(getattr(settings, 'RAG_EMBEDDING_DIMENSIONS', 1536))
+
+def embedding_model_key(
+    model: Optional[str] = None, dimensions: Optional[int] = None, provider: Optional[str] = None
+) -> str:
+    """
+    Identify the vectors a model produces at a given size, e.g. 'text-embedding-3-small:512'.
+    Used to key the embedding caches and recorded on NoteMetadata, so vectors of
+    different models or sizes are never mixed. Backends other than OpenAI are
+    prefixed with their name, e.g. 'hash:text-embedding-ada-002:1536'.
+
+    Args:
+        model: The embedding model name (defaults to RAG_EMBEDDING_MODEL).
+        dimensions: The embedding size (defaults to RAG_EMBEDDING_DIMENSIONS).
+        provider: The embedding backend (defaults to RAG_EMBEDDING_PROVIDER).
+    """
+    key = f"{model or get_embedding_model()}:{dimensions or get_embedding_dimensions()}"
+    provider = provider or get_provider_name()
+    return key if provider == 'openai' else f"{provider}:{key}"
+
+def request_dimensions(model: str, dimensions: int) -> Optional[int]:
+    """
+    Return the `dimensions` parameter to send with an embeddings request, or None
+    for models that only produce their native size (the parameter is rejected).
+    """
+    if model.startswith('text-embedding-3'):
+        return dimensions
+    return None
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate a token count at ~4 characters per token.
+    """
+    return len(text) // 4 + 1
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str) -> Callable[[str], int]:
+    """
+    Build a function that counts tokens the way the embedding model does.
+    Falls back to a ~4 characters per token estimate when the tiktoken
+    encoding cannot be loaded (e.g. offline workers without a cached BPE file).
+
+    Args:
+        model: The embedding model name.
+
+    Returns:
+        A callable returning the token count of a text.
+    """
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        print(f"Warning: could not load tiktoken encoding for {model} ({e}). Estimating token counts.")
+        return estimate_tokens
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+class EmbeddingProvider(ABC):
+    """
+    Base class of the embedding backends.
+    A provider turns a list of texts into vectors of `dimensions` floats and is
+    safe to call from the scheduler's worker threads.
+    """
+    name: str = ''
+    # Upper bound on parallel requests; in-process backends saturate the CPU with one
+    max_concurrency: Optional[int] = None
+
+    def __init__(self, model: str, dimensions: int):
+        """
+        Initialize the provider.
+
+        Args:
+            model: The embedding model name.
+            dimensions: The size of the returned vectors.
+        """
+        self.model = model
+        self.dimensions = dimensions
+        self.model_key = embedding_model_key(model, dimensions, self.name)
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed the texts in one request.
+
+        Args:
+            texts: The texts to embed.
+
+        Returns:
+            The embeddings, in input order.
+        """
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async version of embed. By default the request runs in a worker thread,
+        so in-process backends do not block the event loop.
+        """
+        return await sync_to_async(self.embed, thread_sensitive=False)(texts)
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count (or estimate) the tokens of a text, for batching and rate limiting.
+        """
+        return estimate_tokens(text)
+
+class OpenAIProvider(EmbeddingProvider):
+    """
+    Embeddings API backend on the shared, pooled OpenAI client.
+    Retries are left to the EmbeddingScheduler, which backs off on rate limits.
+    """
+    name = 'openai'
+
+    def __init__(self, model: str, dimensions: int):
+        super().__init__(model, dimensions)
+        self.options = {}
+        if request_dimensions(model, dimensions):
+            self.options['dimensions'] = dimensions
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        client = get_openai_client().with_options(max_retries=0)
+        response = client.embeddings.create(input=texts, model=self.model, **self.options)
+        return [data.embedding for data in response.data]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        client = get_async_openai_client().with_options(max_retries=0)
+        response = await client.embeddings.create(input=texts, model=self.model, **self.options)
+        return [data.embedding for data in response.data]
+
+    def count_tokens(self, text: str) -> int:
+        return get_token_counter(self.model)(text)
+
+@lru_cache(maxsize=None)
+def load_sentence_transformer(model: str, device: str, backend: str):
+    """
+    Load a sentence-transformers model once per process.
+
+    Args:
+        model: The model name or path.
+        device: The torch device, usually 'cpu'.
+        backend: 'torch', or 'onnx' / 'openvino' for exported CPU inference.
+    """
+    if SentenceTransformer is None:
+        raise ImproperlyConfigured(
+            "RAG_EMBEDDING_PROVIDER=local requires the sentence-transformers package "
+            "(install the 'local' extra)."
+        )
+    print(f"Loading local embedding model {model} ({backend} on {device})...")
+    return SentenceTransformer(model, device=device, backend=backend)
+
+class LocalProvider(EmbeddingProvider):
+    """
+    Network-free backend running a sentence-transformers model on the CPU.
+    Each request is encoded in batches of RAG_LOCAL_BATCH_SIZE texts; vectors are
+    normalized and, for Matryoshka models, truncated to the configured size.
+    """
+    name = 'local'
+    max_concurrency = 1
+
+    def __init__(self, model: str, dimensions: int):
+        if model.startswith(OPENAI_MODEL_PREFIX):
+            raise ImproperlyConfigured(
+                f"RAG_EMBEDDING_MODEL={model} is an OpenAI model; RAG_EMBEDDING_PROVIDER=local "
+                "needs a sentence-transformers model, e.g. sentence-transformers/all-MiniLM-L6-v2."
+            )
+        super().__init__(model, dimensions)
+        self.encoder = load_sentence_transformer(
+            model,
+            getattr(settings, 'RAG_LOCAL_DEVICE', 'cpu'),
+            getattr(settings, 'RAG_LOCAL_BACKEND', 'torch'),
+        )
+        native = self.encoder.get_sentence_embedding_dimension()
+        if native and dimensions > native:
+            raise ImproperlyConfigured(
+                f"RAG_EMBEDDING_DIMENSIONS={dimensions} exceeds the {native} dimensions of {model}"
+            )
+        self.batch_size: int = getattr(settings, 'RAG_LOCAL_BATCH_SIZE', 32)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self.encoder.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            truncate_dim=self.dimensions,
+        )
+        return embeddings.tolist()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoder.tokenizer.tokenize(text))
+
+# Words (and numbers) hashed by the hashing backend
+TOKEN_PATTERN = re.compile(r"\w+")
+
+class HashingProvider(EmbeddingProvider):
+    """
+    Deterministic feature-hashing backend for tests and benchmarks.
+    Words and word pairs are hashed into signed buckets and the vector is
+    L2-normalized, so texts sharing words are close. Needs no model or network.
+    """
+    name = 'hash'
+    max_concurrency = 1
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = TOKEN_PATTERN.findall(text.casefold())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+
+        norm = sum(value * value for value in vector) ** 0.5
+        if not norm:
+            # Keep empty texts usable with cosine distance
+            vector[0], norm = 1.0, 1.0
+        return [value / norm for value in vector]
+
+def get_embedding_provider() -> Optional[EmbeddingProvider]:
+    """
+    Build the embedding provider from the RAG_EMBEDDING_* settings.
+    Providers are cheap to create; the OpenAI client and local models they use
+    are shared per process.
+
+    Returns:
+        The provider, or None when the OpenAI backend has no API key configured.
+    """
+    provider = get_provider_name()
+    model, dimensions = get_embedding_model(), get_embedding_dimensions()
+    if provider == 'local':
+        return LocalProvider(model, dimensions)
+    if provider == 'hash':
+        return HashingProvider(model, dimensions)
+    if not settings.OPENAI_API_KEY:
+        return None
+    return OpenAIProvider(model, dimensions)
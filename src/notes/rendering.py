@@ -0,0 +1,131 @@
+from functools import lru_cache
+from typing import Iterable, List
+import re
+from django.conf import settings
+import markdown
+import nh3
+from .models import NoteChunk
+
+# Bump when the rendering below changes, so stored chunk HTML is re-rendered
+# (the sanitizer's version is part of the stored hash too, see html_key)
+RENDER_VERSION = 2
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'nl2br', 'tables', 'sane_lists']
+
+# Attributes kept by the sanitizer: nh3's defaults, plus the language class of fenced code
+ALLOWED_ATTRIBUTES = {**nh3.ALLOWED_ATTRIBUTES, 'code': {'class'}}
+
+FENCE = re.compile(r'```')
+LAST_FENCE = re.compile(r'```(?!.*```)')
+INLINE_CODE = re.compile(r'(?<!`)`(?!`)')
+TRAILING_BACKTICK = re.compile(r'`\s*$')
+TRAILING_IMAGE = re.compile(r'\[!\[?[^\]]*$')
+TRAILING_LINK_TEXT = re.compile(r'\[[^\]]*$')
+TRAILING_URL = re.compile(r'\]\([^\)]*$')
+
+def fix_broken_markdown(text: str) -> str:
+    """
+    Fix broken markdown elements that can occur when text is chunked.
+
+    Handles:
+    - Unclosed fenced code blocks (```)
+    - Unclosed inline code (`)
+    - Unclosed bold/italic markers (* or **)
+    - Broken links/images at the end of text
+    """
+    # Fix unclosed fenced code blocks (```)
+    fenced_blocks = len(FENCE.findall(text))
+    if fenced_blocks % 2 != 0:
+        # Remove the last orphan marker
+        text = LAST_FENCE.sub('', text, count=1)
+
+    # Fix unclosed inline code (single backtick)
+    # Only fix if there's an odd number at the END of the text
+    inline_code = len(INLINE_CODE.findall(text))
+    if inline_code % 2 != 0:
+        # Remove trailing orphan backtick
+        text = TRAILING_BACKTICK.sub('', text)
+
+    # Fix trailing broken link/image syntax (e.g., "[text" or "![alt")
+    text = TRAILING_IMAGE.sub('', text)  # Remove incomplete image/link at end
+    text = TRAILING_LINK_TEXT.sub('', text)  # Remove incomplete link text at end
+
+    # Fix trailing broken URL part (e.g., "](http://..." at the end)
+    text = TRAILING_URL.sub('', text)
+
+    return text
+
+def sanitize_html(html: str) -> str:
+    """
+    Strip everything but an allowlist of tags and attributes from rendered HTML.
+    Markdown passes raw HTML through, and notes are user content rendered as
+    safe in templates, so scripts, event handlers and javascript: links are removed.
+    """
+    return nh3.clean(html, attributes=ALLOWED_ATTRIBUTES)
+
+def markdown_to_html(text: str) -> str:
+    """
+    Render a chunk's markdown to sanitized HTML, repairing markdown broken by chunking first.
+    """
+    # Use fenced_code for code blocks, nl2br to preserve newlines as breaks if needed,
+    # tables for table support.
+    return sanitize_html(markdown.markdown(fix_broken_markdown(text), extensions=MARKDOWN_EXTENSIONS))
+
+@lru_cache(maxsize=getattr(settings, 'RENDER_CACHE_SIZE', 512))
+def cached_markdown_to_html(text: str) -> str:
+    """
+    markdown_to_html behind a bounded in-process LRU, for chunks without
+    current stored HTML (e.g. indexed while RENDER_MARKDOWN was off).
+    """
+    return markdown_to_html(text)
+
+def html_key_prefix() -> str:
+    """
+    Return the part of html_key shared by every chunk: the renderer version and
+    the sanitizer version (its allowlist can change between releases).
+    """
+    return f"{RENDER_VERSION}:{nh3.__version__}:"
+
+def html_key(chunk: NoteChunk) -> str:
+    """
+    Identify the HTML a chunk should have: its content hash, the renderer
+    version and the sanitizer version.
+    """
+    content_hash = chunk.content_hash or NoteChunk.hash_content(chunk.content)
+    return f"{html_key_prefix()}{content_hash}"
+
+def render_chunk_html(chunk: NoteChunk) -> None:
+    """
+    Render a chunk's content and store the HTML on the (unsaved) instance.
+    """
+    chunk.content_html = markdown_to_html(chunk.content)
+    chunk.html_hash = html_key(chunk)
+
+def chunk_html(chunk: NoteChunk) -> str:
+    """
+    Return a chunk's HTML: the stored rendering if it matches the current
+    content, otherwise a (cached) fresh rendering.
+    """
+    if chunk.html_hash and chunk.html_hash == html_key(chunk):
+        return chunk.content_html
+    return cached_markdown_to_html(chunk.content)
+
+def store_missing_html(chunks: Iterable[NoteChunk]) -> int:
+    """
+    Render and save the HTML of chunks whose stored HTML is missing or stale,
+    so each chunk is rendered once rather than on every page view.
+    Used by the render_chunk_html command; search views never write.
+    Does nothing while RENDER_MARKDOWN is off.
+
+    Returns:
+        The number of chunks updated.
+    """
+    if not getattr(settings, 'RENDER_MARKDOWN', True):
+        return 0
+    stale: List[NoteChunk] = [chunk for chunk in chunks if chunk.html_hash != html_key(chunk)]
+    for chunk in stale:
+        chunk.content_html = cached_markdown_to_html(chunk.content)
+        chunk.html_hash = html_key(chunk)
+    if stale:
+        NoteChunk.objects.bulk_update(stale, ['content_html', 'html_hash'])
+    return len(stale)
@@ -0,0 +1,145 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+import random
+import threading
+import time
+import openai
+from django.conf import settings
+from .providers import EmbeddingProvider
+from .stats import ETLStats
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills continuously up to a per-minute limit.
+    Used to keep embedding traffic under the provider's RPM and TPM quotas.
+    """
+
+    def __init__(self, per_minute: int):
+        """
+        Initialize a full bucket.
+
+        Args:
+            per_minute: Bucket capacity, refilled evenly over one minute.
+        """
+        self.capacity: float = float(per_minute)
+        self.rate: float = per_minute / 60.0
+        self.tokens: float = float(per_minute)
+        self.updated: float = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount: int = 1) -> None:
+        """
+        Block until the requested amount is available, then consume it.
+        Requests larger than the bucket are clamped to its capacity.
+
+        Args:
+            amount: The number of tokens to consume.
+        """
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Decide whether an embeddings API error is transient (rate limit, server or network error).
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Read the server-suggested delay (in seconds) from a rate-limited response, if any.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+class EmbeddingScheduler:
+    """
+    Runs embedding requests on a thread pool with configurable concurrency.
+    Every request first takes one slot from the requests-per-minute bucket and its
+    token count from the tokens-per-minute bucket; transient failures (429/5xx,
+    connection errors) are retried with exponential backoff and jitter.
+    Worker threads only talk to the API, all database work stays with the caller.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, stats: Optional[ETLStats] = None):
+        """
+        Initialize the scheduler from the RAG_EMBEDDING_* settings.
+
+        Args:
+            provider: The embedding provider, shared by all worker threads.
+            stats: Where to count requests, tokens sent and API latency.
+        """
+        self.provider = provider
+        self.stats = stats or ETLStats()
+        self.concurrency: int = getattr(settings, 'RAG_EMBEDDING_CONCURRENCY', 4)
+        if provider.max_concurrency:
+            self.concurrency = min(self.concurrency, provider.max_concurrency)
+        self.max_retries: int = getattr(settings, 'RAG_EMBEDDING_MAX_RETRIES', 5)
+        self.backoff_base: float = getattr(settings, 'RAG_EMBEDDING_BACKOFF_SECONDS', 1.0)
+        self.backoff_max: float = getattr(settings, 'RAG_EMBEDDING_BACKOFF_MAX_SECONDS', 60.0)
+        self.request_bucket = TokenBucket(getattr(settings, 'RAG_EMBEDDING_RPM', 3000))
+        self.token_bucket = TokenBucket(getattr(settings, 'RAG_EMBEDDING_TPM', 1000000))
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='embed')
+
+    def submit(self, texts: List[str], tokens: int) -> Future:
+        """
+        Schedule an embeddings request.
+
+        Args:
+            texts: The texts to embed in one request.
+            tokens: The token count of the request, charged against the TPM bucket.
+
+        Returns:
+            A Future resolving to the list of embeddings, in input order.
+        """
+        return self.executor.submit(self._embed, texts, tokens)
+
+    def _embed(self, texts: List[str], tokens: int) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(tokens)
+            self.stats.add('api_requests')
+            self.stats.add('tokens_sent', tokens)
+            started = time.perf_counter()
+            try:
+                embeddings = self.provider.embed(texts)
+            except Exception as e:
+                self.stats.add('api_seconds', time.perf_counter() - started)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = retry_after(e) or min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay += random.uniform(0, delay / 2)
+                print(f"Embedding request failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.stats.add('api_seconds', time.perf_counter() - started)
+            return embeddings
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Release the worker threads.
+
+        Args:
+            wait: Wait for running requests; otherwise queued requests are cancelled
+                and running ones finish in the background, their results discarded.
+        """
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
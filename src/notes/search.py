@@ -1,45 +1,345 @@
-from typing import Any, List
-import openai
+from array import array
+from typing import Any, List, Optional
+import hashlib
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from pgvector.django import L2Distance
-from .models import NoteChunk
+from django.db import connection, transaction
+from django.db.models import Prefetch, Subquery, prefetch_related_objects
 from django.contrib.auth.models import User
+from .models import IndexGeneration, NoteChunk, NoteMetadata, ResourceMetadata
+from .embeddings import aembed_texts, embed_texts
+from .providers import get_embedding_dimensions, get_embedding_provider
+from .vector_index import (
+    binary_sql, configure_binary_search, configure_search, dimensions_expression,
+    dimensions_sql, distance_expression, distance_operator, embedding_sql,
+)
+from .cache import TwoTierCache
 
-def search_notes(query: str, user: User, k: int = 5) -> List[NoteChunk]:
+# Supported search modes: embeddings only, full-text only, both fused by rank,
+# or binary-quantized candidates re-ranked by exact embedding distance
+SEARCH_MODES = ('vector', 'lexical', 'hybrid', 'binary')
+
+# Postgres text search configuration of the NoteChunk.search_vector column (see migration 0008)
+TEXT_SEARCH_CONFIG = 'english'
+
+# Raw SQL condition restricting chunks (as c) to the user's active generation. The
+# generation is looked up once (a scalar subquery), not joined for every candidate row,
+# so both conditions are on notes_notechunk columns and can be served by its indexes
+ACTIVE_GENERATION = f"""c.user_id = %(user_id)s AND c.generation_id = (
+    SELECT g.id FROM notes_indexgeneration g
+    WHERE g.user_id = %(user_id)s AND g.state = '{IndexGeneration.ACTIVE}'
+)"""
+
+_query_embedding_cache: Optional[TwoTierCache] = None
+
+def get_query_embedding_cache() -> TwoTierCache:
+    """
+    Return the process-wide query embedding cache (in-process LRU in front of Redis).
+    """
+    global _query_embedding_cache
+    if _query_embedding_cache is None:
+        _query_embedding_cache = TwoTierCache(
+            'query-embedding',
+            max_local_entries=getattr(settings, 'QUERY_EMBEDDING_CACHE_SIZE', 1024),
+            ttl=getattr(settings, 'QUERY_EMBEDDING_CACHE_TTL', 604800),
+            redis_url=getattr(settings, 'CACHE_REDIS_URL', None),
+            # Store vectors as packed float32 rather than JSON to keep entries small
+            dumps=lambda embedding: array('f', embedding).tobytes(),
+            loads=lambda raw: array('f', raw).tolist(),
+        )
+    return _query_embedding_cache
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query for cache lookups (collapse whitespace, ignore case).
+    """
+    return " ".join(query.split()).casefold()
+
+def query_cache_key(query: str, model: str) -> str:
+    """
+    Build the query embedding cache key from the normalized query and the embedding model key.
+    """
+    digest = hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+    return f"{model}:{digest}"
+
+def embed_query(query: str) -> Optional[List[float]]:
+    """
+    Embed a search query. Repeated queries are served from the query cache
+    without a network call, then from the global embedding cache.
+
+    Args:
+        query: The user's search text.
+
+    Returns:
+        The query embedding, or None if it could not be generated.
+    """
+    try:
+        provider = get_embedding_provider()
+        if provider is None:
+            print("Warning: OPENAI_API_KEY not found. Vector search is unavailable.")
+            return None
+
+        cache = get_query_embedding_cache()
+        cache_key = query_cache_key(query, provider.model_key)
+        query_embedding = cache.get(cache_key)
+        if query_embedding is None:
+            embeddings, _ = embed_texts(provider, [query])
+            query_embedding = list(embeddings[0])
+            cache.set(cache_key, query_embedding)
+        return query_embedding
+    except Exception as e:
+        print(f"Error embedding search query: {e}")
+        return None
+
+async def aembed_query(query: str) -> Optional[List[float]]:
+    """
+    Async version of embed_query, for async views: the embeddings request is
+    awaited, and cache lookups run in worker threads.
+    """
+    try:
+        provider = get_embedding_provider()
+        if provider is None:
+            print("Warning: OPENAI_API_KEY not found. Vector search is unavailable.")
+            return None
+
+        cache = get_query_embedding_cache()
+        cache_key = query_cache_key(query, provider.model_key)
+        query_embedding = await sync_to_async(cache.get, thread_sensitive=False)(cache_key)
+        if query_embedding is None:
+            embeddings, _ = await aembed_texts(provider, [query])
+            query_embedding = list(embeddings[0])
+            await sync_to_async(cache.set, thread_sensitive=False)(cache_key, query_embedding)
+        return query_embedding
+    except Exception as e:
+        print(f"Error embedding search query: {e}")
+        return None
+
+def _vector_literal(embedding: List[float]) -> str:
+    return '[' + ','.join(str(float(x)) for x in embedding) + ']'
+
+def _vector_search(query_embedding: List[float], user: User, k: int) -> List[NoteChunk]:
+    active_generation = IndexGeneration.objects.filter(user=user, state=IndexGeneration.ACTIVE).values('id')
+    results = NoteChunk.objects.select_related('note').alias(
+        dimensions=dimensions_expression()
+    ).filter(
+        user=user, generation=Subquery(active_generation), dimensions=get_embedding_dimensions()
+    ).annotate(
+        distance=distance_expression(query_embedding)
+    ).order_by('distance')[:k]
+    # Iterative index scans with relaxed ordering may return rows slightly out of order
+    return sorted(results, key=lambda chunk: chunk.distance)
+
+def _lexical_search(query: str, user: User, k: int) -> List[NoteChunk]:
+    sql = f"""
+        SELECT c.*, ts_rank_cd(c.search_vector, q) AS score
+        FROM notes_notechunk c,
+             websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %(query)s) q
+        WHERE {ACTIVE_GENERATION} AND c.search_vector @@ q
+        ORDER BY score DESC
+        LIMIT %(k)s
     """
-    Search for note chunks similar to the query using semantic vector search.
+    return list(NoteChunk.objects.raw(sql, {'query': query, 'user_id': user.id, 'k': k}))
+
+def _hybrid_search(query: str, query_embedding: List[float], user: User, k: int) -> List[NoteChunk]:
+    # Reciprocal rank fusion of the vector and full-text rankings, in one round trip.
+    # Each side contributes 1 / (rrf_k + rank) for the chunks in its top candidates.
+    operator = distance_operator()
+    embedding = embedding_sql('c.embedding')
+    query_vector = f"%(embedding)s::halfvec({get_embedding_dimensions()})"
+    sql = f"""
+        WITH vector_hits AS (
+            SELECT c.id, RANK() OVER (ORDER BY {embedding} {operator} {query_vector}) AS rank
+            FROM notes_notechunk c
+            WHERE {ACTIVE_GENERATION} AND {dimensions_sql('c.embedding')}
+            ORDER BY {embedding} {operator} {query_vector}
+            LIMIT %(candidates)s
+        ),
+        lexical_hits AS (
+            SELECT c.id, RANK() OVER (ORDER BY ts_rank_cd(c.search_vector, q) DESC) AS rank
+            FROM notes_notechunk c,
+                 websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %(query)s) q
+            WHERE {ACTIVE_GENERATION} AND c.search_vector @@ q
+            ORDER BY ts_rank_cd(c.search_vector, q) DESC
+            LIMIT %(candidates)s
+        ),
+        fused AS (
+            SELECT COALESCE(v.id, l.id) AS id,
+                   COALESCE(1.0 / (%(rrf_k)s + v.rank), 0.0) +
+                   COALESCE(1.0 / (%(rrf_k)s + l.rank), 0.0) AS score
+            FROM vector_hits v
+            FULL OUTER JOIN lexical_hits l ON v.id = l.id
+        )
+        SELECT c.*, fused.score
+        FROM fused
+        JOIN notes_notechunk c ON c.id = fused.id
+        ORDER BY fused.score DESC
+        LIMIT %(k)s
+    """
+    params = {
+        'embedding': _vector_literal(query_embedding),
+        'query': query,
+        'user_id': user.id,
+        'candidates': getattr(settings, 'RAG_HYBRID_CANDIDATES', 50),
+        'rrf_k': getattr(settings, 'RAG_RRF_K', 60),
+        'k': k,
+    }
+    return list(NoteChunk.objects.raw(sql, params))
+
+def _binary_search(query_embedding: List[float], user: User, k: int, candidates: int) -> List[NoteChunk]:
+    # Stage one walks the small bit index by Hamming distance; stage two computes
+    # the exact distance for those candidates only, from the stored embeddings.
+    dimensions = get_embedding_dimensions()
+    query_vector = f"%(embedding)s::halfvec({dimensions})"
+    sql = f"""
+        WITH candidates AS (
+            SELECT c.id
+            FROM notes_notechunk c
+            WHERE {ACTIVE_GENERATION} AND {dimensions_sql('c.embedding')}
+            ORDER BY {binary_sql('c.embedding')} <~> binary_quantize({query_vector})::bit({dimensions})
+            LIMIT %(candidates)s
+        )
+        SELECT c.*, {embedding_sql('c.embedding')} {distance_operator()} {query_vector} AS distance
+        FROM candidates
+        JOIN notes_notechunk c ON c.id = candidates.id
+        ORDER BY distance
+        LIMIT %(k)s
+    """
+    params = {
+        'embedding': _vector_literal(query_embedding),
+        'user_id': user.id,
+        'candidates': max(candidates, k),
+        'k': k,
+    }
+    return list(NoteChunk.objects.raw(sql, params))
+
+def search_notes(
+    query: str,
+    user: User,
+    k: int = 5,
+    mode: Optional[str] = None,
+    candidates: Optional[int] = None,
+) -> List[NoteChunk]:
+    """
+    Search for note chunks matching the query.
+
+    In 'vector' mode chunks are ranked by embedding distance, in 'lexical' mode by
+    Postgres full-text rank (no embeddings API call), and in 'hybrid' mode both
+    rankings are fused with reciprocal rank fusion. In 'binary' mode candidates
+    are found on binary-quantized embeddings and re-ranked by exact distance.
+    Hybrid search degrades to lexical search when the query cannot be embedded.
+    Only the user's active index generation is searched, so a re-index in
+    progress never shows up in results (see notes.generations).
 
     Args:
         query: The user's search text.
         user: The User object to filter results for.
         k: The number of results to return (default 5).
+        mode: 'vector', 'lexical', 'hybrid' or 'binary' (defaults to RAG_SEARCH_MODE).
+        candidates: Candidate depth of binary mode (defaults to RAG_BINARY_CANDIDATES).
 
     Returns:
-        A list of NoteChunk objects with an added 'distance' attribute, sorted by similarity.
+        A list of NoteChunk objects sorted by relevance, with an added 'distance'
+        attribute (vector and binary modes) or 'score' attribute (lexical and hybrid
+        modes), and the notes they were found in as 'notes' (see attach_notes).
     """
     if not query:
         return []
 
-    openai_api_key = settings.OPENAI_API_KEY
-    if not openai_api_key:
-        print("Warning: OPENAI_API_KEY not found. Search will fail.")
+    mode = _resolve_mode(mode)
+    query_embedding = embed_query(query) if mode != 'lexical' else None
+    return _run_search(query, query_embedding, user, k, mode, candidates)
+
+async def asearch_notes(
+    query: str,
+    user: User,
+    k: int = 5,
+    mode: Optional[str] = None,
+    candidates: Optional[int] = None,
+) -> List[NoteChunk]:
+    """
+    Async version of search_notes, for async views.
+    The query is embedded without blocking the event loop; the search queries
+    (which need a transaction for the recall settings) run in a worker thread of their own.
+    Arguments and results are the same as search_notes.
+    """
+    if not query:
         return []
 
+    mode = _resolve_mode(mode)
+    query_embedding = await aembed_query(query) if mode != 'lexical' else None
+    return await sync_to_async(_run_search, thread_sensitive=False)(query, query_embedding, user, k, mode, candidates)
+
+def _resolve_mode(mode: Optional[str]) -> str:
+    mode = mode or getattr(settings, 'RAG_SEARCH_MODE', 'hybrid')
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unsupported search mode: {mode}")
+    return mode
+
+def _run_search(
+    query: str,
+    query_embedding: Optional[List[float]],
+    user: User,
+    k: int,
+    mode: str,
+    candidates: Optional[int],
+) -> List[NoteChunk]:
+    """
+    Run the search queries of a mode, once the query has been embedded (if needed).
+    """
+    if mode != 'lexical' and query_embedding is None:
+        if mode in ('vector', 'binary'):
+            return []
+        print("Falling back to lexical search.")
+        mode = 'lexical'
+
     try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        # Embed the query text
-        response = client.embeddings.create(input=query, model="text-embedding-ada-002")
-        query_embedding = response.data[0].embedding
-        
-        # Perform vector similarity search within the user's notes
-        results = NoteChunk.objects.filter(
-            note__user=user
-        ).order_by(
-            L2Distance('embedding', query_embedding)
-        )[:k]
-        
-        return list(results)
+        # The recall settings for the ANN index are scoped to this transaction
+        with transaction.atomic():
+            if mode == 'binary':
+                candidates = candidates or getattr(settings, 'RAG_BINARY_CANDIDATES', 200)
+                with connection.cursor() as cursor:
+                    configure_binary_search(cursor, candidates)
+                results = _binary_search(query_embedding, user, k, candidates)
+            else:
+                with connection.cursor() as cursor:
+                    configure_search(cursor)
+                if mode == 'vector':
+                    results = _vector_search(query_embedding, user, k)
+                elif mode == 'lexical':
+                    results = _lexical_search(query, user, k)
+                else:
+                    results = _hybrid_search(query, query_embedding, user, k)
+        return attach_notes(results)
 
     except Exception as e:
         print(f"Error searching notes: {e}")
         return []
+
+def attach_notes(chunks: List[NoteChunk]) -> List[NoteChunk]:
+    """
+    Set 'notes' on each result to the notes it was found in: a note chunk's own
+    note, or every note attaching a resource chunk's resource (whose OCR text is
+    indexed once, not per note), most recently updated first. Notes, resources
+    and their notes are loaded with one query each (raw queries cannot
+    select_related); resource chunks that no note attaches any more are dropped.
+    """
+    prefetch_related_objects([chunk for chunk in chunks if chunk.note_id], 'note')
+    resource_ids = {chunk.resource_id for chunk in chunks if chunk.resource_id}
+    resources = {}
+    if resource_ids:
+        resources = ResourceMetadata.objects.filter(id__in=resource_ids).prefetch_related(
+            Prefetch('notes', queryset=NoteMetadata.objects.order_by('-last_updated'))
+        ).in_bulk()
+
+    attached: List[NoteChunk] = []
+    for chunk in chunks:
+        if chunk.resource_id:
+            resource = resources.get(chunk.resource_id)
+            chunk.notes = list(resource.notes.all()) if resource else []
+            if not chunk.notes:
+                continue
+            chunk.resource = resource
+        else:
+            chunk.notes = [chunk.note]
+        attached.append(chunk)
+    return attached
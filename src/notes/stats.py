@@ -0,0 +1,91 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+import threading
+import time
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import UploadStats
+
+class ETLStats:
+    """
+    Thread-safe accumulator for ETL counters and stage timings.
+    Values are buffered in memory and periodically added to the upload's
+    UploadStats row with F() increments, so several shards of the same upload
+    can report into one row without overwriting each other.
+    """
+
+    def __init__(self, upload_id: Optional[int] = None):
+        """
+        Initialize the accumulator.
+
+        Args:
+            upload_id: The upload whose UploadStats row is updated, or None to only count in memory.
+        """
+        self.upload_id = upload_id
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.pending: Dict[str, float] = defaultdict(float)
+        self.lock = threading.Lock()
+        self.interval: float = getattr(settings, 'RAG_PROGRESS_INTERVAL', 2.0)
+        self.last_flush: float = time.monotonic()
+
+    def add(self, field: str, amount: float = 1) -> None:
+        """
+        Increment a counter (an UploadStats field name).
+        """
+        with self.lock:
+            self.totals[field] += amount
+            self.pending[field] += amount
+
+    def __getitem__(self, field: str) -> float:
+        with self.lock:
+            return self.totals[field]
+
+    @contextmanager
+    def timer(self, field: str) -> Iterator[None]:
+        """
+        Add the wall time spent in the block to a *_seconds field.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(field, time.perf_counter() - start)
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Write buffered increments to the UploadStats row, at most once per
+        RAG_PROGRESS_INTERVAL seconds unless forced.
+        """
+        if self.upload_id is None:
+            return
+        if not force and time.monotonic() - self.last_flush < self.interval:
+            return
+
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(float)
+        self.last_flush = time.monotonic()
+        if not pending:
+            return
+
+        UploadStats.objects.filter(upload_id=self.upload_id).update(
+            updated_at=timezone.now(),
+            **{field: F(field) + amount for field, amount in pending.items()},
+        )
+
+    def summary(self) -> str:
+        """
+        Format the totals as a one-line log message.
+        """
+        with self.lock:
+            totals = dict(self.totals)
+        counters = ", ".join(
+            f"{field}={int(value)}" for field, value in sorted(totals.items())
+            if not field.endswith('_seconds')
+        )
+        timings = ", ".join(
+            f"{field[:-len('_seconds')]}={value:.2f}s" for field, value in sorted(totals.items())
+            if field.endswith('_seconds')
+        )
+        return f"{counters} | {timings}"
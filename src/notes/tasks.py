@@ -1,19 +1,145 @@
-from celery import shared_task
+from typing import List, Tuple
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
 from .etl import JoplinETL
-from .models import JoplinUpload
+from .generations import activate_generation, collect_generation
+from .models import JoplinUpload, UploadShard
 
 @shared_task
 def process_database_task(upload_id: int) -> None:
     """
     Celery task to process an uploaded Joplin database.
-    
+    Uploads with more than RAG_ETL_SHARD_SIZE notes (or resources with OCR
+    text) are split into note-id and resource-id range shards that run as a
+    chord across workers; smaller uploads are processed in this task.
+
     Args:
         upload_id: The ID of the JoplinUpload instance to process.
     """
     print(f"Starting processing for upload {upload_id}")
     try:
         etl = JoplinETL(upload_id)
-        etl.process()
-        print(f"Finished processing for upload {upload_id}")
+        shard_size = getattr(settings, 'RAG_ETL_SHARD_SIZE', 2000)
+        ranges = etl.plan_shards(shard_size)
+        resource_ranges = etl.plan_shards(shard_size, resources=True)
+        if len(ranges) <= 1 and len(resource_ranges) <= 1:
+            etl.process()
+            print(f"Finished processing for upload {upload_id}")
+            return
+
+        etl.start_progress(etl.count_notes())
+        # Retry previously failed chunks once, before shards start diffing notes
+        etl.retry_failed_embeddings()
+        etl.close_embeddings()
+
+        shards = [(False, start_id, end_id) for start_id, end_id in ranges]
+        shards += [(True, start_id, end_id) for start_id, end_id in resource_ranges]
+        for index, (resources, start_id, end_id) in enumerate(shards):
+            UploadShard.objects.get_or_create(
+                upload_id=upload_id,
+                index=index,
+                defaults={'resources': resources, 'start_id': start_id or '', 'end_id': end_id or ''},
+            )
+        print(f"Split upload {upload_id} into {len(ranges)} note and {len(resource_ranges)} resource shards")
+        chord(
+            process_shard_task.s(upload_id, index) for index in range(len(shards))
+        )(finalize_upload_task.s(upload_id))
     except Exception as e:
         print(f"Error processing upload {upload_id}: {e}")
+
+@shared_task(bind=True, acks_late=True, autoretry_for=(Exception,), max_retries=3, retry_backoff=True)
+def process_shard_task(self, upload_id: int, index: int) -> Tuple[int, int]:
+    """
+    Celery task to process one note-id (or resource-id) range of an upload.
+    Idempotent: a shard that already completed returns its recorded counts.
+    Counts are recorded with each batch of notes (see JoplinETL.shard_id), so
+    notes written by a failed attempt still count after a retry. The chunks that
+    attempt had not written yet were put on the retry list, and a retry embeds
+    them first, since their notes are now seen as unchanged. Failures are retried;
+    the error is only recorded on the upload (and the shard marked as failed)
+    once the last retry has failed.
+
+    Args:
+        upload_id: The ID of the JoplinUpload instance being processed.
+        index: The shard index.
+
+    Returns:
+        A tuple of (new notes, updated notes) in the shard; (0, 0) for a resource shard.
+    """
+    shard = UploadShard.objects.get(upload_id=upload_id, index=index)
+    if shard.completed:
+        return shard.new_notes_count, shard.updated_notes_count
+
+    etl = JoplinETL(upload_id)
+    etl.shard_id = shard.id
+    try:
+        if self.request.retries:
+            etl.retry_failed_embeddings(shard)
+        if shard.resources:
+            etl.process_resource_range(shard.start_id or None, shard.end_id or None)
+        else:
+            etl.process_range(shard.start_id or None, shard.end_id or None)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            UploadShard.objects.filter(id=shard.id).update(failed=True)
+            etl.fail(e)
+        raise
+
+    # The counts were stored batch by batch, including by earlier failed attempts
+    UploadShard.objects.filter(id=shard.id).update(completed=True)
+    shard.refresh_from_db()
+    print(f"Finished shard {index} of upload {upload_id}")
+    return shard.new_notes_count, shard.updated_notes_count
+
+@shared_task
+def finalize_upload_task(results: List[Tuple[int, int]], upload_id: int) -> None:
+    """
+    Chord callback: sweep notes deleted in Joplin, link resources to the notes
+    attaching them, swap in the index generation the shards built (if any),
+    then aggregate the shard counts and mark the upload as processed.
+    The sweep, link sync and swap are idempotent and run in their own short
+    transactions. Counts are summed from the stored shard rows rather than the
+    task results, and the upload row is only locked for that final update, so a
+    repeated callback cannot apply twice.
+
+    Args:
+        results: The (new, updated) counts returned by the shard tasks.
+        upload_id: The ID of the JoplinUpload instance being processed.
+    """
+    if JoplinUpload.objects.filter(id=upload_id, processed=True).exists():
+        return
+    # The sweep needs every live note id, so it runs once all shards are done
+    etl = JoplinETL(upload_id)
+    deleted_count = etl.sweep_deleted_notes()
+    etl.sync_resource_links()
+    activate_generation(etl.generation)
+
+    with transaction.atomic():
+        upload = JoplinUpload.objects.select_for_update().get(id=upload_id)
+        if upload.processed:
+            return
+        totals = upload.shards.filter(completed=True).aggregate(
+            new=Sum('new_notes_count'), updated=Sum('updated_notes_count')
+        )
+        upload.new_notes_count = totals['new'] or 0
+        upload.updated_notes_count = totals['updated'] or 0
+        upload.deleted_notes_count = deleted_count
+        upload.processed = True
+        upload.error_message = None
+        upload.save()
+    print(f"Finished processing for upload {upload_id}")
+
+@shared_task(acks_late=True)
+def collect_generation_task(generation_id: int) -> int:
+    """
+    Celery task to delete a retired index generation in batches.
+
+    Args:
+        generation_id: The ID of the retired IndexGeneration.
+
+    Returns:
+        The number of chunks deleted.
+    """
+    return collect_generation(generation_id)
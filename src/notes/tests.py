@@ -1,13 +1,59 @@
-from django.test import TestCase
-from unittest.mock import MagicMock, patch
+from django.db import DatabaseError, connection
+from asgiref.sync import sync_to_async
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from typing import List
+from unittest import skipUnless
+from unittest.mock import AsyncMock, MagicMock, patch
+from io import StringIO
+import hashlib
+import json
+import shutil
 import sqlite3
 import os
-from .etl import JoplinETL
-from .models import JoplinUpload, NoteMetadata, NoteChunk
+import tempfile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from . import elaborate, search, views
+from .benchmark import generate_joplin_database
+from .chunking import OCR_SEPARATOR, Chunker, MarkdownChunker
+from .etl import JoplinETL, build_resource_text
+from .generations import activate_generation, collect_generation, get_active_generation
+from .embeddings import EmbeddingBatcher
+from .providers import (
+    EmbeddingProvider, HashingProvider, LocalProvider, OpenAIProvider, embedding_model_key, get_embedding_dimensions,
+)
+from .rendering import html_key, markdown_to_html
+from .templatetags.markdown_filters import render_chunk
+from .vector_index import create_binary_index_sql, create_index_sql, create_user_index_sql
+from .cache import TwoTierCache
+from .search import SEARCH_MODES, attach_notes, query_cache_key, search_notes
+from .models import JoplinUpload, IndexGeneration, NoteMetadata, NoteChunk, EmbeddingCache, EmbeddingCacheStats, FailedEmbedding, ResourceMetadata, UploadShard, UploadStats
+from .tasks import process_database_task, process_shard_task
+from joplin_rag.celery import app
 from django.contrib.auth import get_user_model
+from django.urls import reverse
 
 User = get_user_model()
 
+def fake_embeddings(input, model, dimensions=1536):
+    """
+    Stand in for client.embeddings.create: one constant vector per input text.
+    """
+    response = MagicMock()
+    response.data = [MagicMock(embedding=[0.1] * dimensions) for _ in input]
+    return response
+
+def mock_embeddings_client(mock_openai: MagicMock) -> MagicMock:
+    """
+    Make a patched get_openai_client return a client answering embedding requests with fake_embeddings.
+    """
+    mock_client = MagicMock()
+    mock_client.embeddings.create.side_effect = fake_embeddings
+    mock_openai.return_value.with_options.return_value = mock_client
+    return mock_client
+
 class ETLTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create(email='test@example.com', password='password')
@@ -31,31 +77,20 @@ class ETLTestCase(TestCase):
         
         # Create tables
         cursor.execute("CREATE TABLE notes (id TEXT PRIMARY KEY, title TEXT, body TEXT, updated_time INT, parent_id TEXT, deleted_time INT DEFAULT 0)")
-        cursor.execute("CREATE TABLE resources (id TEXT PRIMARY KEY, title TEXT, ocr_text TEXT)")
+        cursor.execute("CREATE TABLE resources (id TEXT PRIMARY KEY, title TEXT, ocr_text TEXT, updated_time INT)")
         cursor.execute("CREATE TABLE note_resources (note_id TEXT, resource_id TEXT)")
         
         # Insert data
         cursor.execute("INSERT INTO notes VALUES ('note1', 'Test Note', 'This is a test note body.', 1600000000000, 'folder1', 0)")
-        cursor.execute("INSERT INTO resources VALUES ('res1', 'Screenshot', 'Extracted OCR Text')")
+        cursor.execute("INSERT INTO resources VALUES ('res1', 'Screenshot', 'Extracted OCR Text', 1600000000000)")
         cursor.execute("INSERT INTO note_resources VALUES ('note1', 'res1')")
         
         self.conn.commit()
 
-    @patch('notes.etl.openai.OpenAI') 
-    @patch('notes.etl.settings')
-    def test_etl_process(self, mock_settings, mock_openai):
-        # Mock settings
-        mock_settings.OPENAI_API_KEY = 'fake-key'
-        
-        # Mock OpenAI embedding response
-        mock_client = MagicMock()
-        mock_openai.return_value = mock_client
-        
-        mock_response = MagicMock()
-        mock_data = MagicMock()
-        mock_data.embedding = [0.1] * 1536
-        mock_response.data = [mock_data]
-        mock_client.embeddings.create.return_value = mock_response
+    @patch('notes.providers.get_openai_client') 
+    @override_settings(OPENAI_API_KEY='fake-key')
+    def test_etl_process(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
         
         # Initialize ETL
         etl = JoplinETL(self.upload.id)
@@ -76,7 +111,997 @@ class ETLTestCase(TestCase):
         chunks = NoteChunk.objects.filter(note=note)
         self.assertTrue(chunks.exists())
         
-        # Check content logic (Body + OCR)
+        # The body is indexed with the note, the OCR text with its resource
         first_chunk = chunks.first()
         self.assertIn("This is a test note body.", first_chunk.content)
-        self.assertIn("Extracted OCR Text", first_chunk.content)
+        self.assertNotIn("Extracted OCR Text", first_chunk.content)
+        resource = ResourceMetadata.objects.get(joplin_id='res1')
+        self.assertEqual(resource.title, 'Screenshot')
+        self.assertEqual(list(resource.notes.all()), [note])
+        self.assertIn("Extracted OCR Text", resource.chunks.get().content)
+
+    @patch('notes.providers.get_openai_client')
+    @override_settings(OPENAI_API_KEY='fake-key', RAG_CHUNK_SIZE=30, RAG_CHUNK_OVERLAP=0)
+    def test_etl_reembeds_only_changed_chunks(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM note_resources")
+        cursor.execute(
+            "UPDATE notes SET body = ? WHERE id = 'note1'",
+            ("First paragraph here.\n\nSecond paragraph here.\n\nThird paragraph here.",)
+        )
+        self.conn.commit()
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        note = NoteMetadata.objects.get(joplin_id='note1')
+        original = {c.content: c.id for c in note.chunks.all()}
+        self.assertEqual(len(original), 3)
+
+        # Edit only the middle paragraph
+        cursor.execute(
+            "UPDATE notes SET body = ?, updated_time = 1700000000000 WHERE id = 'note1'",
+            ("First paragraph here.\n\nSecond paragraph edited.\n\nThird paragraph here.",)
+        )
+        self.conn.commit()
+        mock_client.embeddings.create.reset_mock()
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        mock_client.embeddings.create.assert_called_once()
+        self.assertEqual(
+            mock_client.embeddings.create.call_args.kwargs['input'],
+            ['Second paragraph edited.']
+        )
+        chunks = list(note.chunks.all())
+        self.assertEqual([c.content for c in chunks], [
+            'First paragraph here.', 'Second paragraph edited.', 'Third paragraph here.'
+        ])
+        self.assertEqual(chunks[0].id, original['First paragraph here.'])
+        self.assertEqual(chunks[2].id, original['Third paragraph here.'])
+        self.assertFalse(NoteChunk.objects.filter(content='Second paragraph here.').exists())
+
+    @patch('notes.providers.get_openai_client')
+    @override_settings(OPENAI_API_KEY='fake-key')
+    def test_etl_reuses_cached_embeddings(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        # One request for the note, one for its resource
+        self.assertEqual(mock_client.embeddings.create.call_count, 2)
+        self.assertEqual(EmbeddingCache.objects.count(), 2)
+
+        # The same note imported by another user is served from the cache
+        other_user = User.objects.create(username='other', email='other@example.com', password='password')
+        other_upload = JoplinUpload.objects.create(user=other_user, file=self.db_path)
+        etl = JoplinETL(other_upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        self.assertEqual(mock_client.embeddings.create.call_count, 2)
+        self.assertEqual(etl.stats['chunks_cached'], 2)
+        self.assertEqual(list(EmbeddingCache.objects.values_list('hit_count', flat=True)), [1, 1])
+        stats = EmbeddingCacheStats.objects.get()
+        self.assertEqual((stats.hits, stats.misses), (2, 2))
+        out = StringIO()
+        call_command('prune_embedding_cache', stdout=out)
+        self.assertIn('2 hits, 2 misses (50.0% hit rate)', out.getvalue())
+        self.assertTrue(NoteChunk.objects.filter(note__user=other_user).exists())
+        self.assertTrue(NoteChunk.objects.filter(resource__user=other_user).exists())
+
+    @patch('notes.providers.get_openai_client')
+    @override_settings(OPENAI_API_KEY='fake-key')
+    def test_etl_batches_chunks_across_notes(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM note_resources")
+        for i in range(2, 6):
+            cursor.execute(
+                "INSERT INTO notes VALUES (?, ?, ?, 1600000000000, 'folder1', 0)",
+                (f'note{i}', f'Note {i}', f'Body of note number {i}.')
+            )
+        self.conn.commit()
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        # Five notes, one embedding request
+        mock_client.embeddings.create.assert_called_once()
+        self.assertEqual(NoteMetadata.objects.count(), 5)
+        for note in NoteMetadata.objects.all():
+            self.assertEqual(note.chunks.count(), 1)
+
+    def test_batcher_flushes_on_input_limit(self):
+        note = NoteMetadata.objects.create(user=self.user, joplin_id='note1', title='Test Note')
+        with patch('notes.providers.get_openai_client') as mock_openai:
+            mock_client = mock_embeddings_client(mock_openai)
+            batcher = EmbeddingBatcher(OpenAIProvider('text-embedding-ada-002', 1536), max_inputs=2)
+            for i in range(5):
+                text = f'chunk {i}'
+                batcher.add(note, i, text, NoteChunk.hash_content(text))
+            batcher.close()
+
+        self.assertEqual(mock_client.embeddings.create.call_count, 3)
+        self.assertEqual(list(note.chunks.values_list('chunk_index', flat=True)), [0, 1, 2, 3, 4])
+
+    @patch('notes.providers.get_openai_client')
+    @override_settings(OPENAI_API_KEY='fake-key')
+    def test_failed_embeddings_are_retried_on_next_run(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+        mock_client.embeddings.create.side_effect = ValueError("boom")
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        note = NoteMetadata.objects.get(joplin_id='note1')
+        self.assertFalse(note.chunks.exists())
+        failure = FailedEmbedding.objects.get(note=note)
+        self.assertEqual(failure.attempts, 1)
+        self.assertIn("boom", failure.last_error)
+
+        self.assertTrue(FailedEmbedding.objects.filter(resource__joplin_id='res1').exists())
+
+        # The note itself is unchanged, so only the retry list brings it back
+        mock_client.embeddings.create.side_effect = fake_embeddings
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        self.assertEqual(note.chunks.count(), 1)
+        self.assertFalse(FailedEmbedding.objects.exists())
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash')
+    def test_chunks_of_aborted_run_are_retried_on_next_run(self):
+        # A failure outside the embeddings API, after the note's metadata was stored
+        with patch.object(NoteChunk.objects, 'bulk_create', side_effect=DatabaseError("disk full")):
+            etl = JoplinETL(self.upload.id)
+            etl.db_path = self.db_path
+            with self.assertRaises(DatabaseError):
+                etl.process()
+
+        note = NoteMetadata.objects.get(joplin_id='note1')
+        self.assertFalse(note.chunks.exists())
+        failure = FailedEmbedding.objects.get(note=note)
+        self.assertIn("disk full", failure.last_error)
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        self.assertEqual(note.chunks.count(), 1)
+        self.assertTrue(NoteChunk.objects.filter(resource__joplin_id='res1').exists())
+        self.assertFalse(FailedEmbedding.objects.exists())
+
+    @patch('notes.providers.get_openai_client')
+    @override_settings(OPENAI_API_KEY='fake-key')
+    def test_etl_records_progress_and_stats(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        stats = UploadStats.objects.get(upload=self.upload)
+        self.assertEqual(stats.notes_total, 1)
+        self.assertEqual(stats.notes_scanned, 1)
+        # The note's chunk and its resource's chunk
+        self.assertEqual(stats.chunks_embedded, 2)
+        self.assertEqual(stats.chunks_written, 2)
+        self.assertEqual(stats.api_requests, 2)
+        self.assertGreater(stats.tokens_sent, 0)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('notes:upload_progress', args=[self.upload.id]))
+        data = response.json()
+        self.assertTrue(data['processed'])
+        self.assertEqual(data['progress'], 100)
+        self.assertEqual(data['stats']['chunks_written'], 2)
+
+    @override_settings(RAG_ETL_BATCH_SIZE=2)
+    def test_iter_notes_and_resources_stream_batches(self):
+        cursor = self.conn.cursor()
+        for i in range(2, 6):
+            cursor.execute(
+                "INSERT INTO notes VALUES (?, ?, 'body', 1600000000000, 'folder1', 0)",
+                (f'note{i}', f'Note {i}')
+            )
+        cursor.execute("INSERT INTO notes VALUES ('note9', 'Trashed', 'body', 1600000000000, 'folder1', 1)")
+        cursor.execute("INSERT INTO resources VALUES ('res2', 'Scan', 'Second OCR', 1600000000000)")
+        cursor.execute("INSERT INTO resources VALUES ('res3', 'Trashed scan', 'Third OCR', 1600000000000)")
+        cursor.execute("INSERT INTO resources VALUES ('res4', 'Photo', '', 1600000000000)")
+        cursor.execute("INSERT INTO note_resources VALUES ('note4', 'res2')")
+        cursor.execute("INSERT INTO note_resources VALUES ('note4', 'res1')")
+        cursor.execute("INSERT INTO note_resources VALUES ('note9', 'res3')")
+        cursor.execute("INSERT INTO note_resources VALUES ('note5', 'res4')")
+        self.conn.commit()
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        conn = etl.connect()
+        batches = list(etl.iter_note_batches(conn))
+        notes = [note['id'] for batch in batches for note in batch]
+        # Shared resources are read once; those without OCR text or live notes are not read
+        resources = [resource['id'] for batch in etl.iter_resource_batches(conn) for resource in batch]
+        conn.close()
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(notes, ['note1', 'note2', 'note3', 'note4', 'note5'])
+        self.assertEqual(resources, ['res1', 'res2'])
+
+    def add_notes(self, count: int) -> None:
+        cursor = self.conn.cursor()
+        for i in range(2, count + 1):
+            cursor.execute(
+                "INSERT INTO notes VALUES (?, ?, ?, 1600000000000, 'folder1', 0)",
+                (f'note{i:02d}', f'Note {i}', f'Body of note number {i}.')
+            )
+        self.conn.commit()
+
+    @patch('notes.providers.get_openai_client')
+    @override_settings(OPENAI_API_KEY='fake-key')
+    def test_changing_embedding_model_reembeds_notes(self, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        note = NoteMetadata.objects.get(joplin_id='note1')
+        self.assertEqual(note.embedding_model, 'text-embedding-ada-002:1536')
+        old_chunk_ids = set(note.chunks.values_list('id', flat=True))
+        self.assertNotIn('dimensions', mock_client.embeddings.create.call_args.kwargs)
+
+        with override_settings(RAG_EMBEDDING_MODEL='text-embedding-3-small', RAG_EMBEDDING_DIMENSIONS=512):
+            etl = JoplinETL(self.upload.id)
+            etl.db_path = self.db_path
+            etl.process()
+
+        note.refresh_from_db()
+        self.assertEqual(note.embedding_model, 'text-embedding-3-small:512')
+        self.assertEqual(mock_client.embeddings.create.call_args.kwargs['dimensions'], 512)
+        chunk = note.chunks.get(generation=etl.generation)
+        self.assertNotIn(chunk.id, old_chunk_ids)
+        self.assertEqual(len(chunk.embedding), 512)
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash', RAG_EMBEDDING_DIMENSIONS=64)
+    def test_hash_provider_embeds_without_api(self):
+        provider = HashingProvider('text-embedding-ada-002', 64)
+        first, again, other = provider.embed(['Hello world', 'hello world', 'something else'])
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertAlmostEqual(sum(value * value for value in first), 1.0)
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        note = NoteMetadata.objects.get(joplin_id='note1')
+        self.assertEqual(note.embedding_model, 'hash:text-embedding-ada-002:64')
+        self.assertEqual(len(note.chunks.get().embedding), 64)
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash')
+    def test_chunk_html_is_rendered_at_ingest(self):
+        self.conn.execute("UPDATE notes SET body = 'Some **bold** text' WHERE id = 'note1'")
+        self.conn.commit()
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        chunk = NoteChunk.objects.get(note__joplin_id='note1')
+        self.assertIn('<strong>bold</strong>', chunk.content_html)
+        self.assertEqual(chunk.html_hash, html_key(chunk))
+
+        # The stored HTML is served while it matches the content
+        chunk.content_html = '<p>stored</p>'
+        self.assertEqual(render_chunk(chunk), '<p>stored</p>')
+        chunk.content = 'Other *text*'
+        chunk.content_hash = NoteChunk.hash_content(chunk.content)
+        self.assertIn('<em>text</em>', render_chunk(chunk))
+        chunk.save()
+
+        # Search does not write; the command stores the HTML of stale chunks
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('notes:search'), {'q': 'text', 'mode': 'lexical'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(NoteChunk.objects.get(id=chunk.id).content_html, '<p>stored</p>')
+        call_command('render_chunk_html', stdout=StringIO())
+        chunk.refresh_from_db()
+        self.assertIn('<em>text</em>', chunk.content_html)
+        self.assertEqual(chunk.html_hash, html_key(chunk))
+
+    def test_chunk_html_is_sanitized(self):
+        html = markdown_to_html(
+            'Hi <script>alert(1)</script><b onclick="steal()">x</b> [link](javascript:alert(1))\n\n'
+            '```python\nprint(1)\n```'
+        )
+        self.assertNotIn('<script', html)
+        self.assertNotIn('onclick', html)
+        self.assertNotIn('javascript:', html)
+        self.assertIn('<b>x</b>', html)
+        self.assertIn('<code class="language-python">', html)
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash')
+    def test_changing_chunker_resplits_notes(self):
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        note = NoteMetadata.objects.get(joplin_id='note1')
+        self.assertEqual((note.chunker, note.chunk_size), ('recursive', 1000))
+        self.assertEqual(note.chunks.count(), 1)
+
+        with override_settings(RAG_CHUNKER='markdown', RAG_CHUNK_TOKENS=256):
+            etl = JoplinETL(self.upload.id)
+            etl.db_path = self.db_path
+            etl.process()
+
+        note.refresh_from_db()
+        self.assertEqual((note.chunker, note.chunk_size, note.chunk_overlap), ('markdown', 256, 0))
+        self.assertEqual(
+            list(note.chunks.filter(generation=etl.generation).values_list('content', flat=True)),
+            ['This is a test note body.'],
+        )
+        resource = ResourceMetadata.objects.get(joplin_id='res1')
+        self.assertEqual(resource.chunker, 'markdown')
+        self.assertEqual(
+            list(resource.chunks.filter(generation=etl.generation).values_list('content', flat=True)),
+            [f'{OCR_SEPARATOR}\n\nExtracted OCR Text'],
+        )
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash')
+    def test_reindex_builds_new_generation_before_swapping(self):
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        old = etl.generation
+        self.assertEqual(old.state, IndexGeneration.ACTIVE)
+        old_ids = set(old.chunks.values_list('id', flat=True))
+
+        with override_settings(RAG_CHUNKER='markdown', RAG_CHUNK_TOKENS=256):
+            etl = JoplinETL(self.upload.id)
+            etl.db_path = self.db_path
+            new = etl.generation
+            self.assertEqual(new.state, IndexGeneration.BUILDING)
+            etl.process_range()
+            etl.process_resource_range()
+
+            # Search keeps reading the untouched old generation until the swap
+            self.assertEqual(get_active_generation(self.user), old)
+            self.assertEqual(set(old.chunks.values_list('id', flat=True)), old_ids)
+            self.assertEqual(new.chunks.count(), 2)
+            # An interrupted build is resumed rather than started again
+            self.assertEqual(JoplinETL(self.upload.id).generation, new)
+
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertTrue(activate_generation(new))
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_active_generation(self.user), new)
+        old.refresh_from_db()
+        self.assertEqual(old.state, IndexGeneration.RETIRED)
+
+        self.assertEqual(collect_generation(old.id, batch_size=1), len(old_ids))
+        self.assertFalse(IndexGeneration.objects.filter(id=old.id).exists())
+        self.assertEqual(NoteChunk.objects.count(), 2)
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash')
+    def test_shared_resource_is_indexed_once(self):
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO notes VALUES ('note2', 'Other Note', 'Another body.', 1700000000000, 'folder1', 0)")
+        cursor.execute("INSERT INTO note_resources VALUES ('note2', 'res1')")
+        self.conn.commit()
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        chunk = NoteChunk.objects.get(resource__joplin_id='res1')
+        self.assertEqual(NoteChunk.objects.filter(content__contains='Extracted OCR Text').count(), 1)
+        self.assertEqual(
+            sorted(chunk.resource.notes.values_list('joplin_id', flat=True)), ['note1', 'note2']
+        )
+        # Search results carry the owning notes, most recently updated first,
+        # loaded with one query per relation rather than one per result
+        self.assertEqual(set(NoteChunk.objects.values_list('user', flat=True)), {self.user.id})
+        results = [NoteChunk.objects.get(id=c.id) for c in NoteChunk.objects.order_by('id')]
+        with self.assertNumQueries(3):
+            results = attach_notes(results)
+            self.assertEqual([[note.joplin_id for note in c.notes] for c in results], [
+                ['note1'], ['note2'], ['note2', 'note1'],
+            ])
+
+        # Detaching the resource from every note drops its chunks from the results
+        cursor.execute("DELETE FROM note_resources WHERE note_id = 'note2'")
+        cursor.execute("UPDATE notes SET deleted_time = 1700000000000 WHERE id = 'note1'")
+        self.conn.commit()
+        upload = JoplinUpload.objects.create(user=self.user, file=self.db_path)
+        etl = JoplinETL(upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        self.assertFalse(ResourceMetadata.objects.filter(joplin_id='res1').exists())
+        self.assertFalse(NoteChunk.objects.filter(resource__isnull=False).exists())
+
+    @override_settings(RAG_ETL_BATCH_SIZE=10)
+    def test_unchanged_notes_are_reconciled_in_bulk(self):
+        self.add_notes(30)
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        self.assertEqual(NoteMetadata.objects.filter(user=self.user).count(), 30)
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        with CaptureQueriesContext(connection) as queries:
+            new_count, updated_count = etl.process_range()
+
+        self.assertEqual((new_count, updated_count), (0, 0))
+        self.assertEqual(etl.stats['notes_skipped'], 30)
+        metadata_queries = [q for q in queries if 'notes_notemetadata' in q['sql']]
+        self.assertEqual(len(metadata_queries), 1)
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash')
+    def test_incremental_upload_reads_only_changed_notes(self):
+        self.add_notes(5)
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE notes SET body = 'Edited', updated_time = 1700000000000 WHERE id = 'note03'")
+        # Synced from other devices: they keep timestamps older than the local edit above
+        cursor.execute("UPDATE notes SET body = 'Edited elsewhere', updated_time = 1650000000000 WHERE id = 'note02'")
+        cursor.execute("INSERT INTO notes VALUES ('note06', 'Synced', 'Old note', 1500000000000, 'folder1', 0)")
+        # Re-OCRed image of note1: only the resource is indexed again
+        cursor.execute("UPDATE resources SET ocr_text = 'New OCR', updated_time = 1700000000000")
+        self.conn.commit()
+
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        conn = etl.connect()
+        changed_ids, total = etl.find_changed_ids(conn, etl.load_existing_metadata())
+        self.assertEqual((changed_ids, total), (['note02', 'note03', 'note06'], 6))
+        read = [note['id'] for batch in etl.iter_note_batches(conn, ids=changed_ids) for note in batch]
+        conn.close()
+        self.assertEqual(read, ['note02', 'note03', 'note06'])
+
+        self.assertEqual(etl.process_range(), (1, 2))
+        self.assertEqual(etl.stats['notes_scanned'], 6)
+        self.assertEqual(etl.stats['notes_skipped'], 3)
+        self.assertEqual(etl.process_resource_range(), 1)
+        resource = ResourceMetadata.objects.get(joplin_id='res1')
+        self.assertEqual(resource.last_updated.timestamp(), 1700000000)
+        self.assertIn('New OCR', resource.chunks.get().content)
+
+        with override_settings(RAG_CHUNK_SIZE=500):
+            conn = etl.connect()
+            self.assertEqual(etl.find_changed_ids(conn, etl.load_existing_metadata()), (None, 0))
+            conn.close()
+
+    def test_notes_removed_from_joplin_are_swept(self):
+        self.add_notes(4)
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+        self.assertEqual(NoteMetadata.objects.filter(user=self.user).count(), 4)
+
+        cursor = self.conn.cursor()
+        cursor.execute("UPDATE notes SET deleted_time = 1700000000000 WHERE id = 'note02'")
+        cursor.execute("DELETE FROM notes WHERE id = 'note03'")
+        self.conn.commit()
+        upload = JoplinUpload.objects.create(user=self.user, file=self.db_path)
+        etl = JoplinETL(upload.id)
+        etl.db_path = self.db_path
+        etl.process()
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.deleted_notes_count, 2)
+        self.assertEqual(
+            sorted(NoteMetadata.objects.filter(user=self.user).values_list('joplin_id', flat=True)),
+            ['note04', 'note1'],
+        )
+
+    def test_plan_shards(self):
+        self.add_notes(5)
+        etl = JoplinETL(self.upload.id)
+        etl.db_path = self.db_path
+        self.assertEqual(etl.plan_shards(2), [
+            (None, 'note04'), ('note04', 'note1'), ('note1', None),
+        ])
+        self.assertEqual(etl.plan_shards(10), [(None, None)])
+
+    @patch('notes.providers.get_openai_client')
+    @patch('notes.tasks.JoplinETL')
+    @override_settings(OPENAI_API_KEY='fake-key', RAG_ETL_SHARD_SIZE=2)
+    def test_sharded_upload_aggregates_counts_once(self, mock_etl_class, mock_openai):
+        mock_client = mock_embeddings_client(mock_openai)
+
+        def make_etl(upload_id):
+            etl = JoplinETL(upload_id)
+            etl.db_path = self.db_path
+            return etl
+        mock_etl_class.side_effect = make_etl
+
+        self.add_notes(5)
+        app.conf.task_always_eager = True
+        try:
+            process_database_task(self.upload.id)
+            # A retried shard returns its stored counts instead of re-counting
+            self.assertEqual(process_shard_task(self.upload.id, 0), (2, 0))
+        finally:
+            app.conf.task_always_eager = False
+
+        self.upload.refresh_from_db()
+        self.assertTrue(self.upload.processed)
+        self.assertEqual(self.upload.new_notes_count, 5)
+        # Three note shards and one resource shard
+        self.assertEqual(UploadShard.objects.filter(upload=self.upload, completed=True).count(), 4)
+        self.assertEqual(UploadShard.objects.filter(upload=self.upload, resources=True).count(), 1)
+        self.assertEqual(NoteChunk.objects.count(), 6)
+
+    @override_settings(OPENAI_API_KEY=None, RAG_EMBEDDING_PROVIDER='hash', RAG_ETL_BATCH_SIZE=2)
+    def test_retried_shard_keeps_counts_and_fails_after_last_retry(self):
+        self.add_notes(5)
+        UploadShard.objects.create(upload=self.upload, index=0)
+
+        def make_etl(upload_id):
+            etl = JoplinETL(upload_id)
+            etl.db_path = self.db_path
+            return etl
+
+        close_embeddings = JoplinETL.close_embeddings
+        attempts = []
+        def flaky_close(etl):
+            # The first attempt fails after writing every batch of notes
+            attempts.append(etl)
+            if len(attempts) == 1:
+                raise ValueError("boom")
+            close_embeddings(etl)
+
+        app.conf.task_always_eager = True
+        try:
+            with patch('notes.tasks.JoplinETL', side_effect=make_etl), \
+                    patch.object(JoplinETL, 'close_embeddings', flaky_close):
+                self.assertEqual(process_shard_task.apply(args=(self.upload.id, 0)).get(), (5, 0))
+            self.assertEqual(len(attempts), 2)
+            self.upload.refresh_from_db()
+            self.assertFalse(self.upload.error_message)
+            # The chunks left unwritten by the first attempt were written by the retry
+            self.assertEqual(NoteChunk.objects.filter(note__isnull=False).count(), 5)
+            self.assertFalse(FailedEmbedding.objects.exists())
+
+            UploadShard.objects.create(upload=self.upload, index=1)
+            with patch('notes.tasks.JoplinETL', side_effect=make_etl), \
+                    patch.object(JoplinETL, 'process_range', side_effect=ValueError("boom")):
+                self.assertTrue(process_shard_task.apply(args=(self.upload.id, 1)).failed())
+        finally:
+            app.conf.task_always_eager = False
+
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.error_message, 'boom')
+        self.assertTrue(UploadShard.objects.get(upload=self.upload, index=1).failed)
+
+class UploadTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='test@example.com', password='password')
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, content: bytes):
+        return self.client.post(reverse('notes:upload'), {
+            'file': SimpleUploadedFile('database.sqlite', content),
+        })
+
+    @patch('notes.views.process_database_task')
+    def test_identical_upload_is_not_processed_again(self, mock_task):
+        self.upload(b'joplin database')
+        first = JoplinUpload.objects.get()
+        self.assertEqual(first.sha256, hashlib.sha256(b'joplin database').hexdigest())
+        mock_task.delay.assert_called_once_with(first.id)
+        JoplinUpload.objects.filter(id=first.id).update(processed=True, new_notes_count=3)
+
+        mock_task.reset_mock()
+        self.upload(b'joplin database')
+        duplicate = JoplinUpload.objects.latest('id')
+        mock_task.delay.assert_not_called()
+        self.assertTrue(duplicate.processed)
+        self.assertEqual((duplicate.sha256, duplicate.file.name), (first.sha256, ''))
+        self.assertEqual(duplicate.new_notes_count, 0)
+
+        self.upload(b'joplin database, edited')
+        mock_task.delay.assert_called_once()
+
+    @patch('notes.views.process_database_task')
+    def test_failed_upload_shows_error_and_stops_polling(self, mock_task):
+        self.upload(b'joplin database')
+        response = self.client.get(reverse('notes:upload'))
+        self.assertContains(response, 'function poll()')
+
+        JoplinUpload.objects.update(error_message='database disk image is malformed')
+        response = self.client.get(reverse('notes:upload'))
+        self.assertContains(response, 'Failed: database disk image is malformed')
+        self.assertNotContains(response, 'function poll()')
+
+    @patch('notes.views.process_database_task')
+    def test_prune_uploads_keeps_newest_file_per_user(self, mock_task):
+        for content in (b'first', b'second', b'third'):
+            self.upload(content)
+        JoplinUpload.objects.update(processed=True)
+        JoplinUpload.objects.filter(sha256=hashlib.sha256(b'third').hexdigest()).update(processed=False)
+        files = {upload.sha256: upload.file.path for upload in JoplinUpload.objects.all()}
+
+        call_command('prune_uploads', keep=1, max_age_days=0, stdout=StringIO())
+
+        remaining = {
+            upload.sha256: bool(upload.file) for upload in JoplinUpload.objects.all()
+        }
+        first, second, third = (hashlib.sha256(c).hexdigest() for c in (b'first', b'second', b'third'))
+        # The unprocessed upload is untouched and the newest finished one kept
+        self.assertEqual(remaining, {first: False, second: True, third: True})
+        self.assertFalse(os.path.exists(files[first]))
+        self.assertTrue(os.path.exists(files[second]))
+
+    @patch('notes.views.process_database_task')
+    def test_prune_uploads_waits_for_running_shards(self, mock_task):
+        self.upload(b'first')
+        upload = JoplinUpload.objects.get()
+        # One shard gave up while another one is still reading the file
+        JoplinUpload.objects.update(error_message='boom')
+        UploadShard.objects.create(upload=upload, index=0, failed=True)
+        running = UploadShard.objects.create(upload=upload, index=1)
+
+        call_command('prune_uploads', keep=0, max_age_days=0, stdout=StringIO())
+        self.assertTrue(JoplinUpload.objects.get().file)
+
+        UploadShard.objects.filter(id=running.id).update(completed=True)
+        call_command('prune_uploads', keep=0, max_age_days=0, stdout=StringIO())
+        self.assertFalse(JoplinUpload.objects.get().file)
+
+@override_settings(OPENAI_API_KEY='fake-key', CACHE_REDIS_URL=None)
+class ElaborateTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='test@example.com', password='password')
+        note = NoteMetadata.objects.create(user=self.user, joplin_id='note1', title='Test Note')
+        self.chunk = NoteChunk.objects.create(
+            note=note, user=self.user, chunk_index=0, content='Some content', embedding=[0.1] * 1536,
+            content_hash=NoteChunk.hash_content('Some content'),
+        )
+        self.client.force_login(self.user)
+        elaborate._elaboration_cache = None
+
+    def elaborate(self, query: str, **headers):
+        return self.client.post(
+            reverse('notes:elaborate'), {'chunk_id': self.chunk.id, 'query': query},
+            content_type='application/json', headers=headers,
+        )
+
+    @patch('notes.elaborate.get_openai_client')
+    def test_elaboration_is_streamed_then_cached(self, mock_openai):
+        def fake_stream(**kwargs):
+            self.assertTrue(kwargs['stream'])
+            for text in ['### Summary', '\n\n', 'All **good**.']:
+                yield MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+        mock_openai.return_value.chat.completions.create.side_effect = fake_stream
+
+        response = self.elaborate('What is it?', accept='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.count('event: delta'), 3)
+        done = json.loads(body.split('event: done\ndata: ')[1])
+        self.assertIn('<strong>good</strong>', done['elaborated_html'])
+
+        # A repeated click (with a differently spaced query) is served from the cache
+        response = self.elaborate('  what is   it? ', accept='text/event-stream')
+        self.assertEqual(response.json()['elaborated_html'], done['elaborated_html'])
+        self.assertTrue(response.json()['cached'])
+        self.assertEqual(mock_openai.return_value.chat.completions.create.call_count, 1)
+
+        # Changed chunk content invalidates the entry
+        NoteChunk.objects.filter(id=self.chunk.id).update(content_hash=NoteChunk.hash_content('Other'))
+        response = self.elaborate('What is it?')
+        self.assertFalse(response.json()['cached'])
+        self.assertEqual(mock_openai.return_value.chat.completions.create.call_count, 2)
+
+    @patch('notes.elaborate.get_async_openai_client')
+    async def test_async_elaborate_view_streams(self, mock_openai):
+        async def fake_stream():
+            for text in ['Hello', ' *world*']:
+                yield MagicMock(choices=[MagicMock(delta=MagicMock(content=text))])
+
+        async def fake_create(**kwargs):
+            return fake_stream()
+        mock_openai.return_value.chat.completions.create.side_effect = fake_create
+
+        request = AsyncRequestFactory().post(
+            reverse('notes:elaborate'), {'chunk_id': self.chunk.id, 'query': 'hello'},
+            content_type='application/json', headers={'accept': 'text/event-stream'},
+        )
+        request.user = self.user
+        async def auser():
+            return self.user
+        request.auser = auser
+
+        response = await views.async_elaborate_view(request)
+        body = ''.join([part.decode() async for part in response.streaming_content])
+        self.assertEqual(body.count('event: delta'), 2)
+        self.assertIn('<em>world</em>', body.split('event: done')[1])
+
+        # The finished answer is cached for the sync view too
+        response = await sync_to_async(self.elaborate)('hello')
+        self.assertTrue(response.json()['cached'])
+
+def axis_embedding(*weights: float) -> List[float]:
+    """
+    Build an embedding whose first dimensions are the given weights and the rest zero.
+    """
+    embedding = [0.0] * get_embedding_dimensions()
+    embedding[:len(weights)] = weights
+    return embedding
+
+@skipUnless(connection.vendor == 'postgresql', "Raw search SQL needs PostgreSQL with pgvector")
+class SearchSQLTestCase(TestCase):
+    """
+    Runs the raw search queries, which SQLite cannot execute.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com', password='password')
+        self.other_user = User.objects.create(username='bob', email='bob@example.com', password='password')
+        self.generation = IndexGeneration.objects.create(user=self.user, state=IndexGeneration.ACTIVE)
+        other_generation = IndexGeneration.objects.create(user=self.other_user, state=IndexGeneration.ACTIVE)
+        self.notes = 0
+
+        self.both = self.add_chunk(self.user, self.generation, 'postgres vacuum tuning for postgres', axis_embedding(1))
+        self.vector_only = self.add_chunk(self.user, self.generation, 'gardening notes', axis_embedding(1, 0.5))
+        self.lexical_only = self.add_chunk(
+            self.user, self.generation, 'postgres mentioned once among many other words', axis_embedding(0, 0, 1)
+        )
+
+        # Better matches that must never be returned: another user's chunk, and
+        # chunks of generations that are being built or were replaced
+        self.add_chunk(self.other_user, other_generation, 'postgres postgres postgres', axis_embedding(1))
+        for state in (IndexGeneration.BUILDING, IndexGeneration.RETIRED):
+            generation = IndexGeneration.objects.create(user=self.user, state=state)
+            self.add_chunk(self.user, generation, 'postgres postgres postgres', axis_embedding(1))
+
+    def add_chunk(self, user, generation: IndexGeneration, content: str, embedding: List[float]) -> NoteChunk:
+        self.notes += 1
+        note = NoteMetadata.objects.create(user=user, joplin_id=f'note{self.notes}', title=content)
+        return NoteChunk.objects.create(
+            note=note, user=user, generation=generation, chunk_index=0, content=content,
+            content_hash=NoteChunk.hash_content(content), embedding=embedding,
+        )
+
+    def search(self, mode: str, user=None, **kwargs) -> List[NoteChunk]:
+        with patch('notes.search.embed_query', return_value=axis_embedding(1)):
+            return search_notes('postgres', user or self.user, mode=mode, **kwargs)
+
+    def test_lexical_search_ranks_active_generation_of_user(self):
+        results = self.search('lexical')
+        self.assertEqual([chunk.id for chunk in results], [self.both.id, self.lexical_only.id])
+        self.assertGreater(results[0].score, results[1].score)
+        self.assertEqual(results[0].notes, [self.both.note])
+
+    def test_hybrid_search_fuses_rankings_of_active_generation_of_user(self):
+        results = self.search('hybrid')
+        # Both rankings put the first chunk on top; the lexical match is second in
+        # one ranking and third in the other, ahead of the vector-only match (second in one)
+        self.assertEqual(
+            [chunk.id for chunk in results], [self.both.id, self.lexical_only.id, self.vector_only.id]
+        )
+        self.assertEqual(results, sorted(results, key=lambda chunk: -chunk.score))
+
+    def test_binary_search_reranks_hamming_candidates_by_exact_distance(self):
+        # Hamming distances to the query bits are 0, 1 and 2; only the two nearest are candidates
+        results = self.search('binary', candidates=2)
+        self.assertEqual([chunk.id for chunk in results], [self.both.id, self.vector_only.id])
+
+        results = self.search('binary', candidates=10)
+        self.assertEqual(
+            [chunk.id for chunk in results], [self.both.id, self.vector_only.id, self.lexical_only.id]
+        )
+        self.assertAlmostEqual(results[0].distance, 0, places=3)
+        self.assertLess(results[1].distance, results[2].distance)
+
+    def test_every_mode_filters_on_chunk_owner(self):
+        # Search filters on the owner denormalized onto each chunk (NoteChunk.user)
+        for mode in SEARCH_MODES:
+            with self.subTest(mode=mode):
+                results = self.search(mode, user=self.other_user)
+                self.assertEqual(len(results), 1)
+                self.assertEqual(results[0].user_id, self.other_user.id)
+                self.assertEqual(results[0].notes[0].user_id, self.other_user.id)
+                self.assertEqual({chunk.user_id for chunk in self.search(mode)}, {self.user.id})
+
+@override_settings(OPENAI_API_KEY='fake-key', CACHE_REDIS_URL=None, RAG_EMBEDDING_PROVIDER='openai')
+class AsyncSearchViewTestCase(TransactionTestCase):
+    # The search runs its queries in a worker thread, which cannot write while a
+    # TestCase transaction holds the SQLite test database
+    def setUp(self):
+        self.user = User.objects.create(email='test@example.com', password='password')
+        note = NoteMetadata.objects.create(user=self.user, joplin_id='note1', title='Test Note')
+        self.chunk = NoteChunk.objects.create(
+            note=note, user=self.user, chunk_index=0, content='Some **content**', embedding=[0.1] * 1536,
+            content_hash=NoteChunk.hash_content('Some **content**'),
+        )
+        search._query_embedding_cache = None
+
+    def tearDown(self):
+        search._query_embedding_cache = None
+
+    async def search(self, query: str):
+        request = AsyncRequestFactory().get(reverse('notes:search'), {'q': query, 'mode': 'vector'})
+        request.user = self.user
+        async def auser():
+            return self.user
+        request.auser = auser
+        return await views.async_search_view(request)
+
+    def find_chunk(self, query_embedding, user, k):
+        # Stands in for the pgvector query, which SQLite cannot run
+        self.query_embeddings.append(query_embedding)
+        chunk = NoteChunk.objects.get(id=self.chunk.id, user=user)
+        chunk.distance = 0.25
+        return [chunk]
+
+    @patch('notes.providers.get_async_openai_client')
+    async def test_async_search_view_embeds_query_through_caches(self, mock_openai):
+        create = AsyncMock(side_effect=lambda input, model: fake_embeddings(input, model))
+        mock_openai.return_value.with_options.return_value.embeddings.create = create
+        self.query_embeddings = []
+
+        with patch('notes.search._vector_search', side_effect=self.find_chunk):
+            response = await self.search('some content')
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '<strong>content</strong>')
+            self.assertContains(response, 'Test Note')
+            create.assert_awaited_once_with(input=['some content'], model='text-embedding-ada-002')
+            self.assertEqual(self.query_embeddings, [[0.1] * 1536])
+            model_key = embedding_model_key()
+            self.assertTrue(await EmbeddingCache.objects.filter(model=model_key).aexists())
+
+            # A repeated query is served from the query cache, then from the embedding cache
+            await self.search('Some  content')
+            search._query_embedding_cache = None
+            await self.search('some content')
+            self.assertEqual(create.await_count, 1)
+            stats = await EmbeddingCacheStats.objects.aget(model=model_key)
+            self.assertEqual((stats.hits, stats.misses), (1, 1))
+            self.assertEqual(len(self.query_embeddings), 3)
+
+class BenchmarkTestCase(TestCase):
+    def test_generated_database_loads_through_stub_api(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'joplin.sqlite')
+            counts = generate_joplin_database(path, 50, mean_words=40, ocr_ratio=0.5, seed=1)
+            self.assertEqual(counts['notes'], 50)
+            self.assertGreater(counts['note_resources'], 0)
+            self.assertEqual(counts, generate_joplin_database(path, 50, mean_words=40, ocr_ratio=0.5, seed=1))
+
+            out = StringIO()
+            call_command('benchmark_etl', database=path, latency_ms=0, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        cold = next(line for line in lines if line.startswith('cold'))
+        self.assertGreater(int(cold.split()[4]), 0) # chunks
+        self.assertTrue(any(line.startswith('unchanged') for line in lines))
+        # The throwaway user and its cache entries are removed
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(EmbeddingCache.objects.exists())
+
+class MarkdownChunkerTestCase(SimpleTestCase):
+    def setUp(self):
+        # Count words as tokens to keep the sizes readable
+        self.chunker = MarkdownChunker(20, count_tokens=lambda text: len(text.split()))
+
+    def test_structure_is_kept_together(self):
+        text = (
+            "# Title\n\nIntro paragraph.\n\n## Code\n\n```\nx = 1\ny = 2\n```\n\n"
+            "| a | b |\n|---|---|\n| 1 | 2 |\n\n" + " ".join(f"Sentence {i}." for i in range(20)) +
+            "\n\n" + build_resource_text("Scanned receipt text")
+        )
+        chunks = self.chunker.split(text)
+        self.assertTrue(all(len(chunk.split()) <= 20 for chunk in chunks))
+        self.assertEqual(chunks[0], "# Title\n\nIntro paragraph.")
+        self.assertIn("## Code\n\n```\nx = 1\ny = 2\n```", chunks[1])
+        self.assertTrue(any("| a | b |\n|---|---|\n| 1 | 2 |" in chunk for chunk in chunks))
+        # OCR text gets its own chunk
+        self.assertEqual(chunks[-1], f"{OCR_SEPARATOR}\n\nScanned receipt text")
+
+    def test_oversized_blocks_are_split(self):
+        code = "```\n" + "\n".join(f"line {i} of code" for i in range(20)) + "\n```"
+        table = "| h1 | h2 |\n|---|---|\n" + "\n".join(f"| {i} | value {i} |" for i in range(20))
+        words = " ".join(["word"] * 50)
+        for chunk in self.chunker.split("\n\n".join([code, table, words])):
+            self.assertLessEqual(len(chunk.split()), 20)
+            if "line" in chunk:
+                self.assertTrue(chunk.startswith("```\n") and chunk.endswith("\n```"))
+            if "value" in chunk:
+                self.assertTrue(chunk.startswith("| h1 | h2 |\n|---|---|\n"))
+
+class ProviderTestCase(SimpleTestCase):
+    def test_base_classes_are_abstract(self):
+        with self.assertRaises(TypeError):
+            EmbeddingProvider('model', 8)
+        with self.assertRaises(TypeError):
+            Chunker()
+
+    @patch('notes.providers.load_sentence_transformer')
+    def test_local_provider_rejects_openai_models(self, mock_load):
+        with self.assertRaises(ImproperlyConfigured):
+            LocalProvider('text-embedding-ada-002', 384)
+        mock_load.assert_not_called()
+
+        mock_load.return_value.get_sentence_embedding_dimension.return_value = 384
+        provider = LocalProvider('sentence-transformers/all-MiniLM-L6-v2', 384)
+        self.assertEqual(provider.model_key, 'local:sentence-transformers/all-MiniLM-L6-v2:384')
+
+class VectorIndexTestCase(SimpleTestCase):
+    @override_settings(RAG_VECTOR_INDEX='hnsw', RAG_VECTOR_DISTANCE='cosine', RAG_HNSW_M=24)
+    def test_hnsw_index_sql(self):
+        sql = create_index_sql()
+        self.assertIn("USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops)", sql)
+        self.assertIn("m = 24", sql)
+        self.assertTrue(sql.endswith("WHERE vector_dims(embedding) = 1536"))
+
+    @override_settings(RAG_VECTOR_INDEX='ivfflat', RAG_VECTOR_DISTANCE='inner_product', RAG_IVFFLAT_LISTS=200,
+                       RAG_EMBEDDING_DIMENSIONS=512)
+    def test_ivfflat_index_sql(self):
+        sql = create_index_sql(concurrently=True)
+        self.assertIn("CREATE INDEX CONCURRENTLY", sql)
+        self.assertIn("USING ivfflat ((embedding::halfvec(512)) halfvec_ip_ops) WITH (lists = 200)", sql)
+
+    @override_settings(RAG_VECTOR_INDEX='none')
+    def test_no_index(self):
+        self.assertEqual(create_index_sql(), '')
+
+    @override_settings(RAG_VECTOR_INDEX='hnsw', RAG_VECTOR_DISTANCE='cosine')
+    def test_user_index_sql(self):
+        sql = create_user_index_sql(42)
+        self.assertIn("IF NOT EXISTS notes_notechunk_embedding_ann_u42 ON notes_notechunk USING hnsw", sql)
+        self.assertTrue(sql.endswith("WHERE user_id = 42 AND vector_dims(embedding) = 1536"))
+
+    @override_settings(RAG_EMBEDDING_DIMENSIONS=512)
+    def test_binary_index_sql(self):
+        sql = create_binary_index_sql()
+        self.assertIn("USING hnsw ((binary_quantize(embedding)::bit(512)) bit_hamming_ops)", sql)
+        self.assertTrue(sql.endswith("WHERE vector_dims(embedding) = 512"))
+        with self.settings(RAG_BINARY_INDEX=False):
+            self.assertEqual(create_binary_index_sql(), '')
+
+
+class TwoTierCacheTestCase(SimpleTestCase):
+    def test_local_lru_eviction_and_counters(self):
+        cache = TwoTierCache('test', max_local_entries=2, ttl=60)
+        cache.set('a', [1.0])
+        cache.set('b', [2.0])
+        self.assertEqual(cache.get('a'), [1.0])
+        cache.set('c', [3.0])  # evicts 'b', the least recently used
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), [3.0])
+        stats = cache.stats()
+        self.assertEqual(stats['local'], {'local_hits': 2, 'redis_hits': 0, 'misses': 1})
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+    def test_query_key_is_normalized_per_model(self):
+        self.assertEqual(
+            query_cache_key("  Error  CODE 42 ", 'model-a'),
+            query_cache_key("error code 42", 'model-a'),
+        )
+        self.assertNotEqual(
+            query_cache_key("error code 42", 'model-a'),
+            query_cache_key("error code 42", 'model-b'),
+        )
+
@@ -0,0 +1,33 @@
+from typing import Optional
+import hashlib
+from django.core.files.uploadhandler import FileUploadHandler
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes the SHA-256 digest of each uploaded file while it streams in.
+    Runs in front of Django's default handlers and passes every chunk on
+    unchanged, so the digest costs no second read of a multi-GB file.
+    Digests are published on the request as request.upload_digests,
+    a dict of form field name -> hex digest.
+    """
+
+    def new_file(self, *args, **kwargs) -> None:
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int) -> bytes:
+        self.hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size: int) -> None:
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests[self.field_name] = self.hasher.hexdigest()
+        # Let the next handler build the file object
+        return None
+
+def get_upload_digest(request, field_name: str) -> Optional[str]:
+    """
+    Return the SHA-256 digest computed for an uploaded file field, if any.
+    """
+    return getattr(request, 'upload_digests', {}).get(field_name)
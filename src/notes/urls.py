@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -5,6 +6,13 @@ from django.views.generic import RedirectView
 
 app_name = 'notes'
 
+# Under an ASGI server the search and elaboration endpoints are served by async
+# views, which do not hold a thread while waiting on OpenAI (see RAG_ASYNC_VIEWS)
+if getattr(settings, 'RAG_ASYNC_VIEWS', False):
+    search_view, elaborate_view = views.async_search_view, views.async_elaborate_view
+else:
+    search_view, elaborate_view = views.search_view, views.elaborate_view
+
 # URL configuration for the 'notes' application.
 # Includes routing for file uploads and semantic search results.
 
@@ -15,9 +23,12 @@ urlpatterns = [
     # Interface to upload the Joplin database.sqlite
     path('upload/', views.upload_view, name='upload'),
     
+    # JSON progress of an upload's ETL run, polled by the upload page
+    path('upload/<int:upload_id>/progress/', views.upload_progress_view, name='upload_progress'),
+    
     # Interface for performing semantic vector search
-    path('search/', views.search_view, name='search'),
+    path('search/', search_view, name='search'),
     
     # API endpoint for LLM elaboration of search results
-    path('elaborate/', views.elaborate_view, name='elaborate'),
+    path('elaborate/', elaborate_view, name='elaborate'),
 ]
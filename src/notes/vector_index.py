@@ -0,0 +1,259 @@
+from typing import Any, Dict, List
+from django.conf import settings
+from django.db import connection
+from django.db.models import Func, IntegerField
+from django.db.models.functions import Cast
+from pgvector import HalfVector
+from pgvector.django import CosineDistance, HalfVectorField, L2Distance, MaxInnerProduct
+from .providers import get_embedding_dimensions
+
+# Name of the approximate nearest neighbour index on NoteChunk.embedding
+INDEX_NAME = 'notes_notechunk_embedding_ann'
+
+# Prefix of the partial ANN indexes covering a single user's chunks (followed by the user id)
+USER_INDEX_PREFIX = 'notes_notechunk_embedding_ann_u'
+
+# Name of the HNSW index on the binary-quantized embeddings
+BINARY_INDEX_NAME = 'notes_notechunk_embedding_bq'
+
+# HNSW only returns up to ef_search rows per scan, and ef_search is capped at 1000
+MAX_EF_SEARCH = 1000
+
+# Distance choice -> (pgvector operator class, Django distance expression, SQL operator)
+DISTANCES: Dict[str, Any] = {
+    'cosine': ('halfvec_cosine_ops', CosineDistance, '<=>'),
+    'l2': ('halfvec_l2_ops', L2Distance, '<->'),
+    'inner_product': ('halfvec_ip_ops', MaxInnerProduct, '<#>'),
+}
+
+# NoteChunk.embedding is an unsized halfvec so the embedding size can change without
+# a schema change. The index is built on the column cast to the configured size and
+# only covers rows of that size, so vectors of a previous model can coexist with it
+# until they are re-embedded. Queries must use the same cast and filter to use it.
+
+def get_index_type() -> str:
+    """
+    Return the configured ANN index type: 'hnsw', 'ivfflat' or 'none'.
+    """
+    index_type = getattr(settings, 'RAG_VECTOR_INDEX', 'hnsw')
+    if index_type not in ('hnsw', 'ivfflat', 'none'):
+        raise ValueError(f"Unsupported RAG_VECTOR_INDEX: {index_type}")
+    return index_type
+
+def get_distance() -> str:
+    """
+    Return the configured distance metric: 'cosine', 'l2' or 'inner_product'.
+    """
+    distance = getattr(settings, 'RAG_VECTOR_DISTANCE', 'cosine')
+    if distance not in DISTANCES:
+        raise ValueError(f"Unsupported RAG_VECTOR_DISTANCE: {distance}")
+    return distance
+
+def embedding_sql(column: str = 'embedding') -> str:
+    """
+    Return the indexed SQL expression of an embedding column, for raw queries.
+    """
+    return f"({column}::halfvec({get_embedding_dimensions()}))"
+
+def dimensions_sql(column: str = 'embedding') -> str:
+    """
+    Return the SQL condition selecting rows covered by the ANN index, for raw queries.
+    """
+    return f"vector_dims({column}) = {get_embedding_dimensions()}"
+
+def dimensions_expression() -> Func:
+    """
+    Build the embedding size expression to filter on (see dimensions_sql).
+    """
+    return Func('embedding', function='vector_dims', output_field=IntegerField())
+
+def distance_expression(query_embedding: List[float]):
+    """
+    Build the distance expression matching the index expression and operator class,
+    so that ordering by it can be served by the ANN index. Querysets must also
+    filter on dimensions_expression() == get_embedding_dimensions().
+
+    Args:
+        query_embedding: The query vector.
+
+    Returns:
+        A pgvector distance expression over NoteChunk.embedding.
+    """
+    _, expression, _ = DISTANCES[get_distance()]
+    embedding = Cast('embedding', HalfVectorField(dimensions=get_embedding_dimensions()))
+    return expression(embedding, HalfVector(list(query_embedding)))
+
+def distance_operator() -> str:
+    """
+    Return the SQL distance operator matching the index operator class, for raw queries.
+    """
+    _, _, operator = DISTANCES[get_distance()]
+    return operator
+
+def create_index_sql(concurrently: bool = False) -> str:
+    """
+    Build the CREATE INDEX statement for the configured index type and distance.
+
+    Args:
+        concurrently: Build without blocking writes (cannot run inside a transaction).
+
+    Returns:
+        The SQL statement, or an empty string when no index is configured.
+    """
+    return _ann_index_sql(INDEX_NAME, dimensions_sql(), concurrently)
+
+def user_index_name(user_id: int) -> str:
+    """
+    Return the name of a user's partial ANN index.
+    """
+    return f"{USER_INDEX_PREFIX}{int(user_id)}"
+
+def create_user_index_sql(user_id: int, concurrently: bool = False) -> str:
+    """
+    Build the CREATE INDEX statement of a partial ANN index over one user's chunks.
+
+    The shared index holds every user's vectors, so a search for one user walks
+    the graph past other users' neighbours (iterative scans keep it going until
+    enough rows pass the filter). For a user with a large share of the table, a
+    partial index on their rows answers the search from their vectors only.
+    Postgres picks it for queries filtering on that literal user_id, which
+    search_notes does (Django binds parameters client-side).
+
+    Args:
+        user_id: The user whose chunks the index covers.
+        concurrently: Build without blocking writes (cannot run inside a transaction).
+
+    Returns:
+        The SQL statement, or an empty string when no index is configured.
+    """
+    return _ann_index_sql(
+        user_index_name(user_id), f"user_id = {int(user_id)} AND {dimensions_sql()}", concurrently
+    )
+
+def drop_user_index_sql(user_id: int, concurrently: bool = False) -> str:
+    """
+    Build the DROP INDEX statement of a user's partial ANN index.
+    """
+    return f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {user_index_name(user_id)}"
+
+def list_user_indexes(cursor) -> List[int]:
+    """
+    Return the ids of the users that have a partial ANN index.
+
+    Args:
+        cursor: A database cursor on a PostgreSQL connection.
+    """
+    cursor.execute(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'notes_notechunk' AND indexname LIKE %s",
+        [USER_INDEX_PREFIX + '%'],
+    )
+    return sorted(int(name[len(USER_INDEX_PREFIX):]) for name, in cursor.fetchall())
+
+def _ann_index_sql(name: str, condition: str, concurrently: bool) -> str:
+    index_type = get_index_type()
+    if index_type == 'none':
+        return ''
+
+    opclass, _, _ = DISTANCES[get_distance()]
+    if index_type == 'hnsw':
+        options = (
+            f"m = {int(getattr(settings, 'RAG_HNSW_M', 16))}, "
+            f"ef_construction = {int(getattr(settings, 'RAG_HNSW_EF_CONSTRUCTION', 64))}"
+        )
+    else:
+        options = f"lists = {int(getattr(settings, 'RAG_IVFFLAT_LISTS', 100))}"
+
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+        f"ON notes_notechunk USING {index_type} ({embedding_sql()} {opclass}) WITH ({options}) "
+        f"WHERE {condition}"
+    )
+
+def drop_index_sql(concurrently: bool = False) -> str:
+    """
+    Build the DROP INDEX statement for the ANN index.
+    """
+    return f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {INDEX_NAME}"
+
+def binary_sql(column: str = 'embedding') -> str:
+    """
+    Return the binary-quantized SQL expression of an embedding column (one bit per
+    dimension, set for positive values), as indexed by the binary index.
+    """
+    return f"(binary_quantize({column})::bit({get_embedding_dimensions()}))"
+
+def create_binary_index_sql(concurrently: bool = False) -> str:
+    """
+    Build the CREATE INDEX statement for the binary-quantized HNSW index.
+    At one bit per dimension it is a small fraction of the size of the full index.
+
+    Args:
+        concurrently: Build without blocking writes (cannot run inside a transaction).
+
+    Returns:
+        The SQL statement, or an empty string when RAG_BINARY_INDEX is disabled.
+    """
+    if not getattr(settings, 'RAG_BINARY_INDEX', True):
+        return ''
+    options = (
+        f"m = {int(getattr(settings, 'RAG_HNSW_M', 16))}, "
+        f"ef_construction = {int(getattr(settings, 'RAG_HNSW_EF_CONSTRUCTION', 64))}"
+    )
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {BINARY_INDEX_NAME} "
+        f"ON notes_notechunk USING hnsw ({binary_sql()} bit_hamming_ops) WITH ({options}) "
+        f"WHERE {dimensions_sql()}"
+    )
+
+def drop_binary_index_sql(concurrently: bool = False) -> str:
+    """
+    Build the DROP INDEX statement for the binary-quantized index.
+    """
+    return f"DROP INDEX {'CONCURRENTLY ' if concurrently else ''}IF EXISTS {BINARY_INDEX_NAME}"
+
+def configure_search(cursor) -> None:
+    """
+    Apply the recall/latency settings for the current transaction.
+    Must be called inside transaction.atomic() so SET LOCAL is scoped to the search.
+
+    Sets hnsw.ef_search or ivfflat.probes, and enables iterative index scans
+    (pgvector >= 0.8) so the per-user filter does not starve the result list.
+
+    Args:
+        cursor: A database cursor on the connection running the search.
+    """
+    if connection.vendor != 'postgresql':
+        return
+
+    index_type = get_index_type()
+    iterative_scan = getattr(settings, 'RAG_ITERATIVE_SCAN', 'relaxed_order')
+    if index_type == 'hnsw':
+        cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)",
+                       [str(int(getattr(settings, 'RAG_HNSW_EF_SEARCH', 100)))])
+        if iterative_scan != 'off':
+            cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", [iterative_scan])
+    elif index_type == 'ivfflat':
+        cursor.execute("SELECT set_config('ivfflat.probes', %s, true)",
+                       [str(int(getattr(settings, 'RAG_IVFFLAT_PROBES', 10)))])
+        if iterative_scan != 'off':
+            # IVFFlat only supports relaxed ordering
+            cursor.execute("SELECT set_config('ivfflat.iterative_scan', 'relaxed_order', true)")
+
+def configure_binary_search(cursor, candidates: int) -> None:
+    """
+    Apply the recall settings of the binary index for the current transaction.
+    ef_search is raised to the candidate depth so one index scan can return every
+    candidate. Must be called inside transaction.atomic(), like configure_search.
+
+    Args:
+        cursor: A database cursor on the connection running the search.
+        candidates: The number of candidates to retrieve before re-ranking.
+    """
+    if connection.vendor != 'postgresql':
+        return
+
+    ef_search = min(MAX_EF_SEARCH, max(int(getattr(settings, 'RAG_HNSW_EF_SEARCH', 100)), candidates))
+    cursor.execute("SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search)])
+    iterative_scan = getattr(settings, 'RAG_ITERATIVE_SCAN', 'relaxed_order')
+    if iterative_scan != 'off':
+        cursor.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", [iterative_scan])
@@ -1,17 +1,54 @@
-from django.shortcuts import render, redirect
+from typing import Optional
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.conf import settings
-from .models import JoplinUpload, NoteMetadata
+from django.db.models import Q
+from .models import JoplinUpload, NoteMetadata, ResourceMetadata, UploadStats, FailedEmbedding
+from .uploadhandlers import get_upload_digest
+from .etl import get_index_settings
 from .tasks import process_database_task
 
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse
+
+def find_identical_upload(user, sha256: str) -> Optional[JoplinUpload]:
+    """
+    Return the user's latest upload if it was the same file and its index is still current.
+    A duplicate only counts as unchanged when that upload finished without errors,
+    no note or resource was indexed with other chunking settings since, and no
+    chunk is waiting on the embedding retry list.
+
+    Args:
+        user: The uploading user.
+        sha256: The digest of the new file.
+
+    Returns:
+        The matching upload, or None if the new file must be processed.
+    """
+    last_upload = JoplinUpload.objects.filter(user=user).order_by('-uploaded_at').first()
+    if not last_upload or not sha256 or last_upload.sha256 != sha256:
+        return None
+    if not last_upload.processed or last_upload.error_message:
+        return None
+
+    index_settings = get_index_settings()
+    settings_mismatch = (
+        NoteMetadata.objects.filter(user=user).exclude(**index_settings).exists() or
+        ResourceMetadata.objects.filter(user=user).exclude(**index_settings).exists()
+    )
+    failures = FailedEmbedding.objects.filter(Q(note__user=user) | Q(resource__user=user))
+    if settings_mismatch or failures.exists():
+        return None
+    return last_upload
 
 @login_required
 def upload_view(request: HttpRequest) -> HttpResponse:
     """
     Handles the upload of a Joplin database.sqlite file.
     Validates the file type, creates a JoplinUpload instance, and triggers the ETL task.
+    Re-uploads of the file processed last (same SHA-256, computed while the
+    file streamed in) are recorded as processed with no changes, without
+    keeping another copy of the file or queuing the ETL task.
     """
     if request.method == 'POST':
         if 'file' in request.FILES:
@@ -19,8 +56,14 @@ def upload_view(request: HttpRequest) -> HttpResponse:
             if not sqlite_file.name.endswith('.sqlite'):
                 messages.error(request, 'Invalid file type. Please upload a .sqlite file.')
                 return redirect('notes:upload')
+
+            sha256 = get_upload_digest(request, 'file') or ''
+            if find_identical_upload(request.user, sha256):
+                JoplinUpload.objects.create(user=request.user, sha256=sha256, processed=True)
+                messages.success(request, 'This database is identical to your last upload. No changes to process.')
+                return redirect('notes:upload')
             
-            upload = JoplinUpload.objects.create(user=request.user, file=sqlite_file)
+            upload = JoplinUpload.objects.create(user=request.user, file=sqlite_file, sha256=sha256)
             messages.success(request, 'File uploaded successfully. Processing started.')
             
             # Start asynchronous processing
@@ -31,20 +74,20 @@ def upload_view(request: HttpRequest) -> HttpResponse:
             messages.error(request, 'No file selected.')
     
     # Check for RAG settings mismatch to warn about automatic flush/re-index
-    current_chunk_size = getattr(settings, 'RAG_CHUNK_SIZE', 1000)
-    current_chunk_overlap = getattr(settings, 'RAG_CHUNK_OVERLAP', 200)
+    index_settings = get_index_settings()
+    current_chunk_size = index_settings['chunk_size']
+    current_chunk_overlap = index_settings['chunk_overlap']
     
     # Check if any existing notes were indexed with different settings
     mismatch_note = NoteMetadata.objects.filter(
         user=request.user
-    ).exclude(
-        chunk_size=current_chunk_size,
-        chunk_overlap=current_chunk_overlap
-    ).first()
+    ).exclude(**index_settings).first()
 
     settings_mismatch = mismatch_note is not None
     old_chunk_size = mismatch_note.chunk_size if mismatch_note else None
     old_chunk_overlap = mismatch_note.chunk_overlap if mismatch_note else None
+    old_embedding_model = mismatch_note.embedding_model if mismatch_note else None
+    old_chunker = mismatch_note.chunker if mismatch_note else None
 
     # Fetch the latest upload for status display
     last_upload = JoplinUpload.objects.filter(user=request.user).order_by('-uploaded_at').first()
@@ -56,47 +99,229 @@ def upload_view(request: HttpRequest) -> HttpResponse:
         'current_chunk_overlap': current_chunk_overlap,
         'old_chunk_size': old_chunk_size,
         'old_chunk_overlap': old_chunk_overlap,
+        'current_chunker': index_settings['chunker'],
+        'old_chunker': old_chunker,
+        'current_embedding_model': index_settings['embedding_model'],
+        'old_embedding_model': old_embedding_model,
     }
     return render(request, 'notes/upload.html', context)
 
-from .search import search_notes
+@login_required
+def upload_progress_view(request: HttpRequest, upload_id: int) -> JsonResponse:
+    """
+    Lightweight JSON progress endpoint polled by the upload page while an upload is processed.
+    Returns the upload status, note counts and the live ETL counters and stage timings.
+    """
+    upload = get_object_or_404(JoplinUpload, id=upload_id, user=request.user)
+    stats = UploadStats.objects.filter(upload=upload).values().first() or {}
+    for field in ('id', 'upload_id'):
+        stats.pop(field, None)
+
+    notes_total = stats.get('notes_total') or 0
+    progress = min(100, round(100 * stats.get('notes_scanned', 0) / notes_total)) if notes_total else 0
+    if upload.processed:
+        progress = 100
+
+    return JsonResponse({
+        'processed': upload.processed,
+        'error': upload.error_message,
+        'new_notes_count': upload.new_notes_count,
+        'updated_notes_count': upload.updated_notes_count,
+        'deleted_notes_count': upload.deleted_notes_count,
+        'progress': progress,
+        'stats': stats,
+    })
+
+from asgiref.sync import sync_to_async
+from .search import asearch_notes, search_notes, SEARCH_MODES
+
+def get_search_mode(request: HttpRequest) -> str:
+    """
+    Return the requested search mode, or RAG_SEARCH_MODE if none or an unknown one was given.
+    """
+    mode = request.GET.get('mode', '')
+    if mode not in SEARCH_MODES:
+        mode = getattr(settings, 'RAG_SEARCH_MODE', 'hybrid')
+    return mode
 
 @login_required
 def search_view(request: HttpRequest) -> HttpResponse:
     """
     Handles the semantic search interface.
-    Accepts a 'q' query parameter, performs vector search, and renders results.
+    Accepts a 'q' query parameter and an optional 'mode' (vector, lexical, hybrid or binary),
+    performs the search, and renders results.
     """
     query = request.GET.get('q', '')
+    mode = get_search_mode(request)
     results = []
     
     if query:
-        results = search_notes(query, request.user)
+        results = search_notes(query, request.user, mode=mode)
     
     # Fetch the latest upload to show data freshness
     last_upload = JoplinUpload.objects.filter(user=request.user).order_by('-uploaded_at').first()
     
     context = {
         'query': query,
+        'mode': mode,
+        'search_modes': SEARCH_MODES,
         'results': results,
         'last_upload': last_upload,
     }
     return render(request, 'notes/search.html', context)
 
+@login_required
+async def async_search_view(request: HttpRequest) -> HttpResponse:
+    """
+    Async version of search_view, used under ASGI (RAG_ASYNC_VIEWS).
+    The event loop serves other requests while the query is embedded.
+    """
+    user = await request.auser()
+    query = request.GET.get('q', '')
+    mode = get_search_mode(request)
+    results = []
+
+    if query:
+        results = await asearch_notes(query, user, mode=mode)
+
+    last_upload = await JoplinUpload.objects.filter(user=user).order_by('-uploaded_at').afirst()
+
+    context = {
+        'query': query,
+        'mode': mode,
+        'search_modes': SEARCH_MODES,
+        'results': results,
+        'last_upload': last_upload,
+    }
+    # The template follows lazy relations (chunk.note, request.user), which need a sync context
+    return await sync_to_async(render)(request, 'notes/search.html', context)
+
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from .models import NoteChunk
-import openai
+from .elaborate import (
+    astream_elaboration, elaboration_cache_key, get_elaboration_cache,
+    get_elaboration_model, render_elaboration, stream_elaboration,
+)
+from typing import AsyncIterator, Iterator
 import json
-import markdown
+import time
+
+# Minimum seconds between re-renders of a streaming elaboration's markdown
+STREAM_RENDER_INTERVAL = 0.1
+
+def sse_event(event: str, data: dict) -> str:
+    """
+    Format a server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class ElaborationEvents:
+    """
+    Formats a streaming elaboration as server-sent events.
+    'delta' events carry the new text and the markdown rendered so far (re-rendered
+    at most every STREAM_RENDER_INTERVAL seconds, so partial tables and lists fix
+    themselves as the text grows); a final 'done' event carries the complete HTML,
+    or an 'error' event the failure.
+    """
+
+    def __init__(self, chunk: NoteChunk):
+        self.chunk = chunk
+        self.text = ''
+        self.rendered_at = 0.0
+
+    def delta(self, delta: str) -> str:
+        self.text += delta
+        event = {'text': delta}
+        if time.monotonic() - self.rendered_at >= STREAM_RENDER_INTERVAL:
+            event['html'] = render_elaboration(self.text)
+            self.rendered_at = time.monotonic()
+        return sse_event('delta', event)
+
+    def done(self) -> str:
+        return sse_event('done', {
+            'elaborated': self.text,
+            'elaborated_html': render_elaboration(self.text),
+            'note_title': self.chunk.title,
+        })
+
+    def error(self, error: Exception) -> str:
+        return sse_event('error', {'error': str(error)})
+
+def elaboration_events(chunk: NoteChunk, query: str) -> Iterator[str]:
+    """
+    Stream an elaboration as server-sent events (see ElaborationEvents).
+    """
+    events = ElaborationEvents(chunk)
+    try:
+        for delta in stream_elaboration(chunk, query):
+            yield events.delta(delta)
+        yield events.done()
+    except Exception as e:
+        yield events.error(e)
+
+async def aelaboration_events(chunk: NoteChunk, query: str) -> AsyncIterator[str]:
+    """
+    Async version of elaboration_events.
+    """
+    events = ElaborationEvents(chunk)
+    try:
+        async for delta in astream_elaboration(chunk, query):
+            yield events.delta(delta)
+        yield events.done()
+    except Exception as e:
+        yield events.error(e)
+
+def event_stream_response(events) -> StreamingHttpResponse:
+    """
+    Wrap an iterator (or async iterator) of server-sent events in a response.
+    """
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def cached_elaboration_response(chunk: NoteChunk, query: str) -> Optional[JsonResponse]:
+    """
+    Return the cached elaboration of a chunk for a query as a response, if there is one.
+    """
+    cached = get_elaboration_cache().get(elaboration_cache_key(chunk, query, get_elaboration_model()))
+    if cached is None:
+        return None
+    return JsonResponse({
+        'success': True,
+        'cached': True,
+        'elaborated': cached['text'],
+        'elaborated_html': cached['html'],
+        'note_title': chunk.title
+    })
+
+def elaboration_response(chunk: NoteChunk, text: str) -> JsonResponse:
+    """
+    Return a freshly generated elaboration as a response.
+    """
+    return JsonResponse({
+        'success': True,
+        'cached': False,
+        'elaborated': text,
+        'elaborated_html': render_elaboration(text),
+        'note_title': chunk.title
+    })
+
+def accepts_event_stream(request: HttpRequest) -> bool:
+    return 'text/event-stream' in request.headers.get('Accept', '')
 
 @login_required
 @require_POST
-def elaborate_view(request: HttpRequest) -> JsonResponse:
+def elaborate_view(request: HttpRequest) -> HttpResponse:
     """
     Takes a chunk ID and search query, sends to OpenAI to elaborate/clean up the content.
-    Returns the elaborated response as JSON.
+    Finished elaborations are cached per chunk content, query and model, so repeated
+    requests are answered as JSON without an API call. Otherwise the completion is
+    streamed as server-sent events when the client accepts text/event-stream, and
+    returned as JSON once complete for other clients.
     """
     try:
         data = json.loads(request.body)
@@ -108,66 +333,61 @@ def elaborate_view(request: HttpRequest) -> JsonResponse:
         
         # Get the chunk and verify ownership
         try:
-            chunk = NoteChunk.objects.select_related('note').get(
-                id=chunk_id,
-                note__user=request.user
-            )
+            chunk = NoteChunk.objects.select_related('note', 'resource').get(user=request.user, id=chunk_id)
         except NoteChunk.DoesNotExist:
             return JsonResponse({'error': 'Chunk not found'}, status=404)
+
+        cached = cached_elaboration_response(chunk, query)
+        if cached is not None:
+            return cached
         
         # Check for API key
         openai_api_key = settings.OPENAI_API_KEY
         if not openai_api_key:
             return JsonResponse({'error': 'OpenAI API key not configured'}, status=500)
+
+        if accepts_event_stream(request):
+            return event_stream_response(elaboration_events(chunk, query))
+        return elaboration_response(chunk, ''.join(stream_elaboration(chunk, query)))
         
-        # Create the prompt
-        system_prompt = """You are a helpful assistant that elaborates on search results. 
-The user searched for information and got a partial match from their notes. 
-Your job is to:
-1. Clean up the content (fix any OCR errors, formatting issues) and return valid markdown. 
-2. Follow these markdown rules:
-    a. For tables: Use plain text for headers (no formatting like **bold** or *italics*).
-    b. For headers outside of tables:Only use `###` or `####`
-3. Highlight the parts most relevant to the search query
-4. Provide a short,clear summary
-Keep your response concise."""
-
-        user_prompt = f"""Search Query: "{query}"
-
-Note Title: {chunk.note.title}
-
-Content from the note:
-{chunk.content}
-
-Please elaborate on this content in relation to the search query."""
-
-        # Call OpenAI
-        client = openai.OpenAI(api_key=openai_api_key)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        elaborated_content = response.choices[0].message.content
-        
-        # Render markdown to HTML
-        elaborated_html = markdown.markdown(
-            elaborated_content,
-            extensions=['fenced_code', 'nl2br', 'tables', 'sane_lists']
-        )
-        
-        return JsonResponse({
-            'success': True,
-            'elaborated': elaborated_content,
-            'elaborated_html': elaborated_html,
-            'note_title': chunk.note.title
-        })
-        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+@login_required
+@require_POST
+async def async_elaborate_view(request: HttpRequest) -> HttpResponse:
+    """
+    Async version of elaborate_view, used under ASGI (RAG_ASYNC_VIEWS).
+    The completion is awaited on the AsyncOpenAI client, so one process can hold
+    many elaborations in flight without a thread per request.
+    """
+    try:
+        data = json.loads(request.body)
+        chunk_id = data.get('chunk_id')
+        query = data.get('query', '')
+
+        if not chunk_id:
+            return JsonResponse({'error': 'Missing chunk_id'}, status=400)
+
+        user = await request.auser()
+        try:
+            chunk = await NoteChunk.objects.select_related('note', 'resource').aget(user=user, id=chunk_id)
+        except NoteChunk.DoesNotExist:
+            return JsonResponse({'error': 'Chunk not found'}, status=404)
+
+        cached = await sync_to_async(cached_elaboration_response, thread_sensitive=False)(chunk, query)
+        if cached is not None:
+            return cached
+
+        if not settings.OPENAI_API_KEY:
+            return JsonResponse({'error': 'OpenAI API key not configured'}, status=500)
+
+        if accepts_event_stream(request):
+            return event_stream_response(aelaboration_events(chunk, query))
+        return elaboration_response(chunk, ''.join([delta async for delta in astream_elaboration(chunk, query)]))
+
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e: